@@ -0,0 +1,43 @@
+import os
+import argparse
+
+from src.runtime_analytics import write_runtime_report, project_campaign
+from src.run_names import SIMULATION_METRICS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='Simulation Runtime Analytics',
+        description='Reports runtime percentiles and scaling models of simulation campaigns and projects the runtime of a planned campaign')
+
+    parser.add_argument('--simulation-folders', required=True, nargs='+', help="Paths to the generated simulation folders whose runtimes are analyzed.")
+    parser.add_argument('--output-folder', required=True, help="Folder the runtime tables and figures are written to.")
+    parser.add_argument('--models', required=False, nargs='*', default=None, help="Models of the planned campaign (default: all models of the analyzed campaigns).")
+    parser.add_argument('--metrics', required=False, nargs='*', default=None, help="Metrics of the planned campaign (default: all simulation metrics).")
+    parser.add_argument('--repetitions', required=False, type=int, default=1, help="Repetitions of every run of the planned campaign.")
+    parser.add_argument('--max-images', required=False, type=int, default=300, help="Number of images up to which the runs of the planned campaign are simulated.")
+    parser.add_argument('--jobs', required=False, type=int, default=1, help="Number of simulations that are run in parallel in the planned campaign.")
+
+    args = parser.parse_args()
+
+    # Check if the folders exist
+    for folder in args.simulation_folders:
+        if not os.path.exists(folder + "/000_Results"):
+            print("Invalid input folder!", folder)
+            exit(1)
+    os.makedirs(args.output_folder, exist_ok=True)
+
+    iterations = write_runtime_report(args.simulation_folders, args.output_folder, update=False)
+    if len(iterations["seconds"]) == 0:
+        exit(1)
+
+    # Project the runtime of the planned campaign
+    models = args.models if args.models is not None else sorted(set(iterations["model"]))
+    metrics = args.metrics if args.metrics is not None else SIMULATION_METRICS
+    jobs, total, makespan = project_campaign(iterations, models, metrics, args.repetitions, args.max_images, workers=args.jobs)
+
+    print("Planned campaign:", len(jobs), "runs up to", args.max_images, "images")
+    print("Predicted runtime of all runs:", round(total / 3600, 2), "hours")
+    print("Predicted makespan with", args.jobs, "parallel simulations:", round(makespan / 3600, 2), "hours")
+    print("Longest runs:")
+    for job in jobs[:5]:
+        print("   ", job["model"], job["metric"], round(job["predicted_runtime"] / 60, 1), "minutes")
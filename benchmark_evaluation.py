@@ -0,0 +1,41 @@
+import sys
+import argparse
+
+from src.evaluation_benchmark import STAGES, run_benchmarks, save_baseline, find_regressions, run_import_benchmarks
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='Point Cloud Metric Evaluation Benchmark',
+        description='Measures runtime and peak memory of the evaluation stages on synthetic datasets of increasing size')
+
+    parser.add_argument('--work-folder', required=False, default=None, help="Folder for the generated datasets and figures.")
+    parser.add_argument('--scales', required=False, nargs='*', default=["2x2x10000", "4x3x50000", "8x5x200000"],
+                        help="Dataset scales as {models}x{clouds per run}x{points per cloud}.")
+    parser.add_argument('--stages', required=False, nargs='*', default=list(STAGES.keys()), choices=list(STAGES.keys()), help="Stages to benchmark.")
+    parser.add_argument('--history', required=False, default="benchmark_history.jsonl", help="File the results are appended to.")
+    parser.add_argument('--baseline', required=False, default=None, help="Baseline file the results are compared against.")
+    parser.add_argument('--save-baseline', required=False, default=None, help="Save the results as new baseline into this file.")
+    parser.add_argument('--imports', required=False, action='store_true', help="Measure the import time of the modules the command line tools start with instead of the stages.")
+    parser.add_argument('--max-import-seconds', required=False, type=float, default=0.5, help="Import time of a module that counts as regression.")
+    parser.add_argument('--tolerance', required=False, type=float, default=0.2, help="Relative slowdown or memory increase that counts as regression.")
+
+    args = parser.parse_args()
+
+    # Startup latency: no module may load a heavy library or take longer than the maximum to import
+    if args.imports:
+        violations = run_import_benchmarks(args.history, args.max_import_seconds)
+        if len(violations) > 0:
+            print("Slow imports:", ", ".join(violations))
+            sys.exit(1)
+        sys.exit(0)
+
+    if args.work_folder is None:
+        parser.error("--work-folder is required for benchmarking the stages")
+
+    results = run_benchmarks(args.work_folder, args.scales, args.stages, args.history)
+
+    if args.save_baseline is not None:
+        save_baseline(results, args.save_baseline)
+
+    if args.baseline is not None and len(find_regressions(results, args.baseline, args.tolerance)) > 0:
+        sys.exit(1)
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+from src.render_cache import run_cached_render
+
+# Drop-in replacement for the blender executable that serves repeated render requests from an on-disk cache. It is
+# configured through environment variables, as the simulation executable calls it with the regular blender arguments:
+#   BLENDER_CACHE_REAL_BLENDER  Path to the real blender executable (required)
+#   BLENDER_CACHE_DIR           Folder of the render cache (required)
+#   BLENDER_CACHE_MAX_GB        Maximum size of the cache in gigabytes (default: 50)
+#   BLENDER_CACHE_OUTPUT_OPTIONS  Further options followed by an output location, separated by "," (optional)
+if __name__ == "__main__":
+    if "BLENDER_CACHE_REAL_BLENDER" not in os.environ or "BLENDER_CACHE_DIR" not in os.environ:
+        print("Error: BLENDER_CACHE_REAL_BLENDER and BLENDER_CACHE_DIR need to be set", file=sys.stderr)
+        sys.exit(2)
+
+    maximum_size = float(os.environ.get("BLENDER_CACHE_MAX_GB", "50")) * 1024 ** 3
+
+    sys.exit(run_cached_render(os.environ["BLENDER_CACHE_REAL_BLENDER"], sys.argv[1:], os.environ["BLENDER_CACHE_DIR"], maximum_size))
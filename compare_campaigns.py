@@ -0,0 +1,76 @@
+import os
+import sys
+import argparse
+
+from src.campaign_comparison import compare_runtimes, print_runtime_comparison, compare_quality, print_quality_comparison, \
+    QUALITY_MEASURES
+from src.runtime_analytics import write_table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='Simulation Campaign Comparison',
+        description='Compares the runtimes and the reconstruction quality of a candidate campaign against a baseline campaign and fails on regressions')
+
+    parser.add_argument('--baseline', required=True, help="Path to the simulation folder of the baseline campaign.")
+    parser.add_argument('--candidate', required=True, help="Path to the simulation folder of the candidate campaign.")
+    parser.add_argument('--checks', required=False, nargs='+', choices=["runtime", "quality"], default=["runtime", "quality"], help="Comparisons that are run.")
+    parser.add_argument('--threshold', required=False, type=float, default=0.1, help="Relative slowdown of a component that counts as regression.")
+    parser.add_argument('--alpha', required=False, type=float, default=90, help="Completeness in percent for the number of images needed to reach it.")
+    parser.add_argument('--quality-tolerance', required=False, type=float, default=1.0, help="Loss of completeness (area under the curve and final) in percentage points that counts as regression.")
+    parser.add_argument('--images-tolerance', required=False, type=float, default=5, help="Additional images needed to reach alpha that count as regression.")
+    parser.add_argument('--significance', required=False, type=float, default=0.05, help="Significance level of the statistical tests.")
+    parser.add_argument('--bootstrap-samples', required=False, type=int, default=10000, help="Number of bootstrap samples for the confidence intervals.")
+    parser.add_argument('--report', required=False, default=None, help="Write the runtime comparison as table into this file.")
+    parser.add_argument('--quality-report', required=False, default=None, help="Write the quality comparison as table into this file.")
+    parser.add_argument('--run-report', required=False, default=None, help="Write the quality measures of every run pair as table into this file.")
+
+    args = parser.parse_args()
+
+    # Check if the folders exist
+    for folder in [args.baseline, args.candidate]:
+        if not os.path.exists(folder + "/000_Results"):
+            print("Invalid input folder!", folder)
+            sys.exit(1)
+
+    regressions = 0
+
+    if "runtime" in args.checks:
+        rows = compare_runtimes(args.baseline, args.candidate, args.threshold, args.significance, args.bootstrap_samples)
+        if len(rows) == 0:
+            print("No runs with runtime measurements in both campaigns")
+            sys.exit(1)
+
+        print_runtime_comparison(rows)
+        if args.report is not None:
+            write_table(rows, ["source", "component", "pairs", "iterations", "baseline_median", "candidate_median", "ratio",
+                               "ratio_lower", "ratio_upper", "p_value", "regression"], args.report)
+
+        slower = [row for row in rows if row["regression"]]
+        if len(slower) > 0:
+            print(len(slower), "components got slower by more than", str(round(100 * args.threshold)) + "%")
+        regressions += len(slower)
+
+    if "quality" in args.checks:
+        run_rows, rows = compare_quality(args.baseline, args.candidate, args.alpha, args.quality_tolerance, args.images_tolerance,
+                                         args.significance, args.bootstrap_samples)
+        if len(rows) == 0:
+            print("No runs with completeness results in both campaigns")
+            sys.exit(1)
+
+        print_quality_comparison(rows)
+        if args.quality_report is not None:
+            write_table(rows, ["metric", "measure", "pairs", "compared", "baseline_missing", "candidate_missing", "baseline_mean",
+                               "candidate_mean", "delta", "delta_lower", "delta_upper", "p_value", "regression"], args.quality_report)
+        if args.run_report is not None:
+            keys = ["model", "metric", "repetition"]
+            for measure, _ in QUALITY_MEASURES:
+                keys += ["baseline_" + measure, "candidate_" + measure, "delta_" + measure]
+            write_table(run_rows, keys, args.run_report)
+
+        worse = [row for row in rows if row["regression"]]
+        if len(worse) > 0:
+            print(len(worse), "quality measures got significantly worse")
+        regressions += len(worse)
+
+    if regressions > 0:
+        sys.exit(1)
@@ -1,14 +1,9 @@
 import os
-import shutil
-import subprocess
-import glob
+import sys
 import argparse
 
-from src.time_dependent_behaviour import plot_metrics_over_time_with_averaging
-from src.evaluate_correlation import create_correlation_plot
-from src.metric_runtime_table import evaluate_average_metric_runtime
-from src.completeness_over_time import summarize_simulation_global_metrics
-from src.alpha_completeness import plot_joint_alpha_completeness
+from src.rank_correlation import CORRELATION_MODES
+from src.evaluation_pipeline import STAGES, run_evaluation
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -17,30 +12,23 @@ if __name__ == "__main__":
         epilog='Text at the bottom of help')
     
     parser.add_argument('--simulation-folder', required=True, help="Path to the generated simulation folder.")
+    parser.add_argument('--workers', required=False, type=int, default=1, help="Number of processes used for evaluating the dense clouds.")
+    parser.add_argument('--correlation-mode', required=False, choices=CORRELATION_MODES, default="exact", help="Compute the exact Spearman correlation of the metrics or approximate it from rank bins.")
+    parser.add_argument('--bootstrap-samples', required=False, type=int, default=2000, help="Number of bootstrap samples for the confidence bands of the completeness figures.")
+    parser.add_argument('--only', required=False, nargs='+', choices=list(STAGES.keys()), default=None, help="Only bring these stages (and the stages they need) up to date.")
+    parser.add_argument('--jobs', required=False, type=int, default=1, help="Number of stages that are run in parallel.")
+    parser.add_argument('--force', required=False, action='store_true', help="Run the selected stages even if their cached results are up to date.")
     
     args = parser.parse_args()
     
     # Check if the folder exists
     if not os.path.exists(args.simulation_folder):
         print("Invalid input folder!")
-        
-    # Create the figure folder
-    figure_folder = args.simulation_folder + "/001_Figures"
-    if os.path.exists(figure_folder):
-        shutil.rmtree(figure_folder)
-    os.mkdir(figure_folder)
-    
-    # Time dependent behaviour
-    plot_metrics_over_time_with_averaging(args.simulation_folder, figure_folder + "/time_dependent_behaviour.png")
-    
-    # MDS Plot (Metric correlation)
-    create_correlation_plot(args.simulation_folder, figure_folder + "/mds_plot.png")
-    
-    # Metric Runtime Table
-    evaluate_average_metric_runtime(args.simulation_folder, figure_folder + "/metric_runtime.csv")
-    
-    # Completeness for a single model
-    summarize_simulation_global_metrics(args.simulation_folder, figure_folder + "/completeness_single_model.png")
-    
-    # Alpha completeness plot over all models
-    plot_joint_alpha_completeness(args.simulation_folder, figure_folder + "/alpha_completeness_plot.png")
\ No newline at end of file
+        sys.exit(1)
+    
+    # Only stages whose inputs, parameters or code changed are run, the figures are written into 001_Figures
+    parameters = {"workers": args.workers, "correlation_mode": args.correlation_mode, "bootstrap_samples": args.bootstrap_samples}
+    failed = run_evaluation(args.simulation_folder, parameters, args.only, args.jobs, args.force)
+    if len(failed) > 0:
+        print("Failed stages:", ", ".join(failed))
+        sys.exit(1)
@@ -0,0 +1,27 @@
+import argparse
+
+from src.synthetic_results import generate_synthetic_results, POINT_METRICS
+from src.run_names import SIMULATION_METRICS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='Synthetic Simulation Result Generator',
+        description='Writes a synthetic simulation output folder for testing and benchmarking the evaluation without running simulations')
+
+    parser.add_argument('--output-folder', required=True, help="Path to the output folder.")
+    parser.add_argument('--models', required=False, type=int, default=14, help="Number of models.")
+    parser.add_argument('--metrics', required=False, nargs='*', default=SIMULATION_METRICS, help="View planning metrics that are simulated.")
+    parser.add_argument('--repetitions', required=False, type=int, default=1, help="Repetitions per model and metric.")
+    parser.add_argument('--iterations', required=False, type=int, default=30, help="Maximum number of iterations per run.")
+    parser.add_argument('--image-step', required=False, type=int, default=5, help="Images added per iteration.")
+    parser.add_argument('--points-per-cloud', required=False, type=int, default=100000, help="Number of points of every dense cloud.")
+    parser.add_argument('--clouds-per-run', required=False, type=int, default=5, help="Number of dense clouds written per run.")
+    parser.add_argument('--point-metrics', required=False, nargs='*', default=POINT_METRICS, help="Per-vertex metric properties of the dense clouds.")
+    parser.add_argument('--seed', required=False, type=int, default=0, help="Seed of the random number generator.")
+    parser.add_argument('--workers', required=False, type=int, default=1, help="Number of processes writing dense clouds.")
+
+    args = parser.parse_args()
+
+    runs = generate_synthetic_results(args.output_folder, args.models, args.metrics, args.repetitions, args.iterations, args.image_step,
+                                      args.points_per_cloud, args.clouds_per_run, args.point_metrics, args.seed, args.workers)
+    print("Wrote", runs, "synthetic runs to", args.output_folder)
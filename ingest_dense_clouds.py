@@ -0,0 +1,24 @@
+import os
+import argparse
+
+from src.cloud_store import ingest_results, get_store_folder
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='Dense Cloud Store Ingest',
+        description='Converts the dense clouds of a simulation output folder into a columnar store that is read by the evaluation')
+
+    parser.add_argument('--simulation-folder', required=True, help="Path to the generated simulation folder.")
+    parser.add_argument('--float32', required=False, action='store_true', help="Store double precision properties as float32.")
+    parser.add_argument('--compress', required=False, action='store_true', help="Store compressed archives instead of memory mappable column files.")
+    parser.add_argument('--workers', required=False, type=int, default=1, help="Number of processes converting dense clouds.")
+
+    args = parser.parse_args()
+
+    # Check if the folder exists
+    if not os.path.exists(args.simulation_folder + "/000_Results/DenseClouds"):
+        print("Invalid input folder!")
+        exit(1)
+
+    converted = ingest_results(args.simulation_folder, args.float32, args.compress, args.workers)
+    print("Converted", converted, "dense clouds into", get_store_folder(args.simulation_folder))
@@ -0,0 +1,70 @@
+import os
+import sys
+import runpy
+import argparse
+
+from src.rank_correlation import CORRELATION_MODES
+from src.evaluation_pipeline import COMMAND_STAGES, run_evaluation
+
+# Only lightweight modules are imported here, plotting and statistics libraries are loaded by the stages that need them
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='Point Cloud Metrics',
+        description='Runs the simulations of a campaign and creates the figures and tables from its results')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # The simulation runner keeps its own arguments
+    subparsers.add_parser("run", add_help=False, help="Run the simulations of a campaign (takes the arguments of run_simulations.py).")
+
+    descriptions = {"evaluate": "Create all figures and tables.",
+                    "runtime": "Create the metric runtime table and the runtime percentiles and scaling models.",
+                    "alpha": "Create the alpha completeness figures.",
+                    "completeness": "Create the completeness figures and their bootstrap statistics.",
+                    "correlation": "Create the MDS figure of the metric correlation.",
+                    "time-dependent": "Create the figure of the pooled metric response over time."}
+    for command, stage_names in COMMAND_STAGES.items():
+        command_parser = subparsers.add_parser(command, help=descriptions[command])
+        command_parser.add_argument('--simulation-folder', required=True, help="Path to the generated simulation folder.")
+        command_parser.add_argument('--workers', required=False, type=int, default=1, help="Number of processes used within a stage.")
+        command_parser.add_argument('--jobs', required=False, type=int, default=1, help="Number of stages that are run in parallel.")
+        command_parser.add_argument('--force', required=False, action='store_true', help="Run the stages even if their cached results are up to date.")
+        if "mds_plot" in stage_names:
+            command_parser.add_argument('--correlation-mode', required=False, choices=CORRELATION_MODES, default="exact", help="Compute the exact Spearman correlation of the metrics or approximate it from rank bins.")
+        if "bootstrap_statistics" in stage_names:
+            command_parser.add_argument('--bootstrap-samples', required=False, type=int, default=2000, help="Number of bootstrap samples for the confidence bands of the completeness figures.")
+
+    # Live figures of a running campaign
+    watch_parser = subparsers.add_parser("watch", help="Fold newly harvested runs into live figures while a campaign runs.")
+    watch_parser.add_argument('--simulation-folder', required=True, help="Path to the generated simulation folder.")
+    watch_parser.add_argument('--poll-interval', required=False, type=float, default=10.0, help="Seconds between two checks for new results.")
+    watch_parser.add_argument('--refresh-interval', required=False, type=float, default=60.0, help="Minimum number of seconds between two updates of a figure.")
+    watch_parser.add_argument('--workers', required=False, type=int, default=1, help="Number of processes that pool new dense clouds.")
+    watch_parser.add_argument('--once', required=False, action='store_true', help="Fold in the current results, draw the figures once and exit.")
+
+    args, remaining = parser.parse_known_args()
+
+    if args.command == "run":
+        sys.argv = ["run_simulations.py"] + remaining
+        runpy.run_path(os.path.dirname(os.path.abspath(__file__)) + "/run_simulations.py", run_name="__main__")
+        sys.exit(0)
+
+    if len(remaining) > 0:
+        parser.error("unrecognized arguments: " + " ".join(remaining))
+
+    # Check if the folder exists
+    if not os.path.exists(args.simulation_folder):
+        print("Invalid input folder!")
+        sys.exit(1)
+
+    if args.command == "watch":
+        from src.live_evaluation import watch_campaign
+        watch_campaign(args.simulation_folder, args.poll_interval, args.refresh_interval, args.workers, args.once)
+        sys.exit(0)
+
+    parameters = {"workers": args.workers, "correlation_mode": getattr(args, "correlation_mode", "exact"),
+                  "bootstrap_samples": getattr(args, "bootstrap_samples", 2000)}
+    failed = run_evaluation(args.simulation_folder, parameters, COMMAND_STAGES[args.command], args.jobs, args.force)
+    if len(failed) > 0:
+        print("Failed stages:", ", ".join(failed))
+        sys.exit(1)
@@ -1,10 +1,15 @@
 import os
 import shutil
-import subprocess
 import glob
 import argparse
 import time
 
+from src.simulation_scheduler import create_result_folders, run_simulations_in_parallel, run_simulations_from_queue, log
+from src.campaign_manifest import plan_campaign, load_manifest, summarize_manifest
+from src.shared_queue import create_queue
+from src.runtime_prediction import collect_runtime_history, create_runtime_predictor, order_longest_first, predict_makespan
+from src.run_names import SIMULATION_METRICS
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog='Point Cloud Metric Simulation Runner',
@@ -16,12 +21,32 @@ if __name__ == "__main__":
     parser.add_argument('--blender', required=True, help="Path to the blender executable.")
     parser.add_argument('--output-folder', required=True, help="Path to the output folder.")
     parser.add_argument('--fast', required=False, action='store_true', help="Only run a subset of simulations.")
+    parser.add_argument('--jobs', required=False, type=int, default=1, help="Number of simulations that are run in parallel.")
+    parser.add_argument('--timeout', required=False, type=float, default=0, help="Wall-clock timeout per run in seconds after which the run is killed (0 = no timeout).")
+    parser.add_argument('--retries', required=False, type=int, default=0, help="How often a failed or timed out run is retried.")
+    parser.add_argument('--plateau-iterations', required=False, type=int, default=0, help="Stop a run early once its completeness improved by less than --plateau-delta over this many iterations (0 = never).")
+    parser.add_argument('--plateau-delta', required=False, type=float, default=0.5, help="Minimum completeness improvement in percentage points that does not count as a plateau.")
+    parser.add_argument('--plateau-metrics', required=False, nargs='*', default=[], help="Only stop runs of these metrics early (default: all metrics).")
+    parser.add_argument('--progress-interval', required=False, type=float, default=5.0, help="Seconds between two progress checks of a running simulation.")
+    parser.add_argument('--order', required=False, choices=["default", "longest-first"], default="default", help="Order in which the runs are started. 'longest-first' predicts the runtime of each run from previous campaigns.")
+    parser.add_argument('--history', required=False, nargs='*', default=[], help="Folders of previous campaigns whose runtimes are used for predicting the run order.")
+    parser.add_argument('--shared', required=False, action='store_true', help="Share the campaign with other nodes that use the same output folder.")
+    parser.add_argument('--node-id', required=False, default=None, help="Name of this node in shared mode (defaults to host name and process id).")
+    parser.add_argument('--heartbeat-interval', required=False, type=float, default=30.0, help="Seconds between two heartbeats of a node in shared mode.")
+    parser.add_argument('--stale-after', required=False, type=float, default=300.0, help="Seconds without heartbeat after which the runs of a node are reclaimed by others.")
+    parser.add_argument('--blender-cache', required=False, default=None, help="Folder of a render cache that is shared by all runs. Repeated blender renders are served from it.")
+    parser.add_argument('--blender-cache-size', required=False, type=float, default=50.0, help="Maximum size of the render cache in gigabytes.")
+    parser.add_argument('--restart', required=False, action='store_true', help="Delete the output folder and start the campaign from scratch.")
+    parser.add_argument('--cloud-store', required=False, action='store_true', help="Convert the dense clouds of every finished run into the columnar cloud store used by the evaluation.")
+    parser.add_argument('--cloud-store-float32', required=False, action='store_true', help="Store double precision dense cloud properties as float32.")
+    parser.add_argument('--cloud-store-compress', required=False, action='store_true', help="Store the dense clouds as compressed archives instead of memory mappable column files.")
+    parser.add_argument('--retry-delay', required=False, type=float, default=5.0, help="Seconds to wait before retrying a run.")
     
     args = parser.parse_args()
 
     # Get the models from the dataset folder
     models = []
-    model_folders = glob.glob(args.dataset + "/[0-9][0-9][0-9]_*")
+    model_folders = sorted(glob.glob(args.dataset + "/[0-9][0-9][0-9]_*"))
     for folder in model_folders:
         folder_name = os.path.basename(folder)
         object_name = folder_name[4:]
@@ -32,10 +57,7 @@ if __name__ == "__main__":
         models = [models[0], models[1], models[2]]
 
     # All Metrics v2
-    metrics = ["Distance_To_Sparse_Cloud", "Density", "Normalized_Density", "Coverage", "Initial_Coverage", "Relative_Coverage",
-               "Angle_Of_Incidence", "Baseline_Height_Ratio", "Camera_Standoff_Distance", "Triangulation_Uncertainty",
-               "Saliency2D", "Mean_Curvature", "Plane_Local_Roughness", "Quadratic_Local_Roughness", "Saliency3D",  
-               "Unified", "RQF_V15", "Random"]
+    metrics = SIMULATION_METRICS
 
     # Set how many repetitions per metric and model we want to run
     repetitions = 1
@@ -48,88 +70,59 @@ if __name__ == "__main__":
     # Define the project folder
     project_folder = args.output_folder
 
-    # Create the project folder
-    if os.path.exists(project_folder):
+    # Only start from scratch if requested, otherwise continue the campaign found in the project folder
+    if args.restart and os.path.exists(project_folder):
         shutil.rmtree(project_folder)
-    os.mkdir(project_folder)
-
-    results_folder = project_folder + "/000_Results"
-    resultMetricFolder = results_folder + "/Metrics"
-    resultTerminationFolder = results_folder + "/Termination"
-    resultRuntimeFolder = results_folder + "/Runtime"
-    resultMetricRuntimeFolder = results_folder + "/MetricRuntime"
-    resultDenseFolder = results_folder + "/DenseClouds"
-    os.mkdir(results_folder)
-    os.mkdir(resultMetricFolder)
-    os.mkdir(resultTerminationFolder)
-    os.mkdir(resultMetricRuntimeFolder)
-    os.mkdir(resultRuntimeFolder)
-    os.mkdir(resultDenseFolder)
-
-    counter = 0
-    for model in models:
-        for metric in metrics:
-            for i in range(repetitions):
-                if counter < 7:
-                    counter = counter + 1
-                    continue
-                
-                # Create the run name
-                run_name = str(counter).zfill(3) + "_" + model[0] + "_" + metric + "_" + str(i)
-                
-                print("========= Running Configuration:", run_name, "==========")
-                
-                # Call the simulation executable
-                call_args = [args.executable_folder + "/orthosfm-simulation-executable.exe", 
-                        "--currentRunID", str(counter), 
-                        "--projectFolder", os.path.abspath(project_folder).replace("\\", "\\\\"),
-                        "--tripletName", run_name,
-                        "--modelName", model[0],
-                        "--modelPath", os.path.abspath(model[1]).replace("\\", "\\\\"),
-                        "--modelReferencePath", os.path.abspath(model[2]).replace("\\", "\\\\"),
-                        "--scanZone", model[3],
-                        "--metricName", metric,
-                        "--blenderPath", os.path.abspath(args.blender).replace("\\", "\\\\"),
-                        "--blenderFilePath", os.path.abspath(blender_file).replace("\\", "\\\\"),
-                        "--resourceFolder", os.path.abspath(resource_folder).replace("\\", "\\\\")
-                        ]
-                
-                subprocess.run(call_args)
-                
-                # Start the subprocess
-                # process = subprocess.Popen(call_args)
-
-                # # Wait for the process to complete or timeout after 60 seconds
-                # try:
-                #     process.wait(timeout=300)
-                # except subprocess.TimeoutExpired:
-                #     print("Process exceeded timeout, killing it.")
-                #     process.terminate()
-                    
-                # time.sleep(5.0)
-                
-                # Copy results
-                tripletFolder = project_folder + "/" + run_name
-                tripletRecoFolder = tripletFolder + "/Reco"
-                
-                if os.path.exists(tripletRecoFolder + "/global_metrics.txt"):
-                    shutil.copy(tripletRecoFolder + "/global_metrics.txt", resultMetricFolder + "/" + run_name + ".txt")
-                    
-                if os.path.exists(tripletRecoFolder + "/termination.txt"):
-                    shutil.copy(tripletRecoFolder + "/termination.txt", resultTerminationFolder + "/" + run_name + ".txt")
-                    
-                if os.path.exists(tripletRecoFolder + "/time_measurements.txt"):
-                    shutil.copy(tripletRecoFolder + "/time_measurements.txt", resultRuntimeFolder + "/" + run_name + ".txt")
-                    
-                if os.path.exists(tripletRecoFolder + "/metric_runtimes.txt"):
-                    shutil.copy(tripletRecoFolder + "/metric_runtimes.txt", resultMetricRuntimeFolder + "/" + run_name + ".txt")
-                
-                # Clean up the triplet folder
-                try:
-                    shutil.rmtree(tripletFolder)
-                except:
-                    print("Failed to delete triplet folder!")
-                
-                
-                # Increase the counter
-                counter = counter + 1
\ No newline at end of file
+    os.makedirs(project_folder, exist_ok=True)
+
+    create_result_folders(project_folder)
+
+    # Register all runs in the campaign manifest and get the ones that still need to be simulated
+    manifest, jobs = plan_campaign(project_folder, models, metrics, repetitions, shared=args.shared)
+    print(len(manifest["runs"]) - len(jobs), "of", len(manifest["runs"]), "runs are already finished,", len(jobs), "runs remaining")
+
+    # Route all blender calls through the caching wrapper, which is configured through the inherited environment
+    blender = args.blender
+    if args.blender_cache is not None:
+        os.environ["BLENDER_CACHE_REAL_BLENDER"] = os.path.abspath(args.blender)
+        os.environ["BLENDER_CACHE_DIR"] = os.path.abspath(args.blender_cache)
+        os.environ["BLENDER_CACHE_MAX_GB"] = str(args.blender_cache_size)
+        blender = os.path.dirname(os.path.abspath(__file__)) + ("/blender_cache.cmd" if os.name == "nt" else "/blender_cache.py")
+
+    settings = {"executable_folder": args.executable_folder,
+                "project_folder": project_folder,
+                "blender": blender,
+                "blender_file": blender_file,
+                "resource_folder": resource_folder,
+                "timeout": args.timeout if args.timeout > 0 else None,
+                "retries": args.retries,
+                "retry_delay": args.retry_delay,
+                "manifest": manifest,
+                "early_stopping": None,
+                "poll_interval": args.progress_interval,
+                "cloud_store": None}
+
+    if args.plateau_iterations > 0:
+        settings["early_stopping"] = {"patience": args.plateau_iterations, "min_delta": args.plateau_delta, "metrics": args.plateau_metrics}
+
+    if args.cloud_store:
+        settings["cloud_store"] = {"float32": args.cloud_store_float32, "compress": args.cloud_store_compress}
+
+    # Predict the runtime of every run from previous campaigns and start the longest runs first
+    if args.order == "longest-first":
+        predict = create_runtime_predictor(collect_runtime_history([project_folder] + args.history))
+        jobs = order_longest_first(jobs, predict)
+        print("Predicted makespan:", round(predict_makespan(jobs, args.jobs), 1), "seconds")
+
+    # Run all simulations on a pool of workers
+    start = time.time()
+    if args.shared:
+        queue = create_queue(project_folder, args.node_id, args.heartbeat_interval, args.stale_after, log)
+        run_simulations_from_queue(jobs, settings, args.jobs, queue)
+    else:
+        run_simulations_in_parallel(jobs, settings, args.jobs)
+    print("Actual makespan:", round(time.time() - start, 1), "seconds")
+
+    # State of the whole campaign, which also includes the runs of other nodes in shared mode
+    counts = summarize_manifest(load_manifest(project_folder))
+    print("Campaign:", ", ".join(str(counts[state]) + " " + state for state in counts if counts[state] > 0))
@@ -1,120 +1,96 @@
 import os
-from matplotlib import pyplot as plt
-import matplotlib
 from glob import glob
 import numpy as np
 
-def plot_alpha_completeness(result_folder, data_folder, alpha, ignore_list=None, with_legend=True):
-    # Get the models in the data folder
-    model_names = ["Aphrodite_of_melos", "Bust_of_roza_loewenfeld", "Sculpture_st_anna", "Carved_perfum_bottle",
-                   "Coffin_from_el_hiba", "Dinosaur_footprint", "Fragment_plaque", "Funerary_stela",
-                   "Antique_figure", "Wooden_apothecary_vessel", "Baba", "Bike", "Candlestick", "Storm_Bird"]
-    
-    # Get all global metric result files in the folder
-    result_files = glob(result_folder + "/[0-9][0-9][0-9]_*.txt")
-    
-    # Seperate into metrics
-    metric_files = {}
-    for txt in result_files:
-        # Clean up the name
-        cleaned_name = os.path.basename(txt)[4:-6]
-        matching_model = ""
-        for model in model_names:
-            if model in cleaned_name:
-                matching_model = model
-                break
-                
-        # Remove the model name from the filename
-        cleaned_name = cleaned_name.replace(matching_model, "")
-        
-        # Remove prefix "_"
-        cleaned_name = cleaned_name[1:]
-        
-        if ignore_list is not None:
-            ignored = False
-            for ignored_name in ignore_list:
-                if ignored_name in cleaned_name:
-                    ignored = True
-                    break
-            
-            # Skip this metric
-            if ignored:
-                continue
-        
-        if cleaned_name not in metric_files:
-            metric_files[cleaned_name] = {matching_model : txt}
-        else:
-            metric_files[cleaned_name][matching_model] = txt
-            
-    # Loop over all metrics and read in the completeness and corresponding number of images
-    metric_values = {}
-    for metric_name in metric_files:
-        # Init the dictionary
-        metric_values[metric_name] = {}
-        
-        # Loop over all models for this metric
-        for model in metric_files[metric_name]:
-            # Read in the file
-            images = []
-            completeness = []
-            
-            with open(metric_files[metric_name][model], "r") as f:
-                for line in f:
-                    # Read in completeness
-                    if line.startswith("Completeness"):
-                        splitted = line.rstrip().split(";")
-                        for val in splitted[1:]:
-                            completeness.append(float(val))
-                        
-                    # Read in Images
-                    if line.startswith("Images"):
-                        splitted = line.rstrip().split(";")
-                        for val in splitted[1:]:
-                            images.append(int(val))
-                            
-            # Add to the value dictionary
-            metric_values[metric_name][model] = [images, completeness]
-            
-            
-    # Create the image number array for evaluating alpha recall
-    images = range(0, 300)
-    completeness_percentage = {}
-    
-    # Now calculate the "alpha recall"
-    for metric_name in metric_values:
-        percentage_values = []
-        
-        # Loop over all alpha values (images)
-        for img in images:
-            model_fullfills_threshold = []
-            
-            # Loop over all models of the metric
-            for model in metric_values[metric_name]:
-                # Find the index of the largest evaluated image number that is smaller than the threshold 
-                best_index = -1
-                for i in range(len(metric_values[metric_name][model][0])):
-                    if metric_values[metric_name][model][0][i] <= img:
-                        best_index = i
-                    elif metric_values[metric_name][model][0][i] > img:
-                        break
-                        
-                if best_index != -1:
-                    # Do the threshold check
-                    if metric_values[metric_name][model][1][best_index] > alpha:
-                        model_fullfills_threshold.append(1)
-                    else:
-                        model_fullfills_threshold.append(0)
-                else:
-                    model_fullfills_threshold.append(0)
-                    
-            # Calculate the percentage of models that fullfill the threshold
-            current_percentage = 100 * (np.sum(model_fullfills_threshold) / len(model_fullfills_threshold))
-            
-            percentage_values.append(current_percentage)
-        
-        completeness_percentage[metric_name] = percentage_values
-    
-    
+from src.results_catalog import query_results
+
+# Number of images up to which the completeness of the models is compared
+MAXIMUM_IMAGES = 300
+
+# Thresholds of the joint alpha completeness plot and metrics that are left out of it
+JOINT_ALPHA_VALUES = [75, 90]
+IGNORED_METRICS = ["V10", "V14"]
+
+
+def read_completeness_results(simulation_folder, ignore_list=None):
+    # Read the image counts and the completeness of every run from the results catalog. Returns the metric names and per
+    # metric a list of [images, completeness, model, repetition] entries, one per run.
+    metric_runs = {}
+    for run, lines in query_results(simulation_folder, "Metrics", ["Images", "Completeness [%]"]):
+        # Skip ignored metrics
+        if ignore_list is not None and any(ignored_name in run["metric"] for ignored_name in ignore_list):
+            continue
+
+        # Evaluation steps in order of their image count
+        images = lines.get("Images", np.zeros(0)).astype(np.int64)
+        completeness = lines.get("Completeness [%]", np.zeros(0))
+        order = np.argsort(images, kind="stable")
+        metric_runs.setdefault(run["metric"], []).append([images[order], completeness[order], run["model"], run["repetition"]])
+
+    metric_names = list(metric_runs)
+    return metric_names, [metric_runs[name] for name in metric_names]
+
+
+def calculate_run_completeness(runs, images):
+    # Completeness of every run after adding N images as an array of the shape (runs, images). A run counts with the
+    # completeness of its last evaluation that used at most N images and with -inf before its first evaluation.
+    images = np.asarray(images, dtype=np.int64)
+    if len(runs) == 0:
+        return np.zeros((0, len(images)))
+
+    run_lengths = np.array([len(run[0]) for run in runs], dtype=np.int64)
+    run_starts = np.cumsum(run_lengths) - run_lengths
+
+    # Place every run in its own key range, so one search in the concatenated evaluations finds the last step of every
+    # run for every image count at once
+    all_images = np.concatenate([run[0] for run in runs])
+    all_completeness = np.concatenate([run[1] for run in runs])
+    offset = min(np.min(all_images, initial=0), np.min(images))
+    span = max(np.max(all_images, initial=0), np.max(images)) - offset + 1
+    run_keys = np.arange(len(runs))[:, None] * span
+    keys = np.repeat(run_keys[:, 0], run_lengths) + all_images - offset
+    last_step = np.searchsorted(keys, run_keys + images[None, :] - offset, side="right") - 1
+
+    valid = last_step >= run_starts[:, None]
+    return np.where(valid, all_completeness[np.maximum(last_step, 0)], -np.inf)
+
+
+def calculate_alpha_completeness(metric_runs, alpha_values, images=None):
+    # Percentage of runs of every metric whose completeness after adding N images is greater than alpha, as an array of
+    # the shape (alpha, images, metric). Runs without an evaluation yet are never complete.
+    if images is None:
+        images = np.arange(MAXIMUM_IMAGES)
+    alpha_values = np.asarray(alpha_values, dtype=np.float64)
+
+    runs = [run for runs in metric_runs for run in runs]
+    if len(runs) == 0:
+        return np.zeros((len(alpha_values), len(images), len(metric_runs)))
+    completeness = calculate_run_completeness(runs, images)
+
+    # Count the complete runs per metric for all alpha values, the runs of a metric are stored next to each other
+    complete = completeness[None, :, :] > alpha_values[:, None, None]
+    run_counts = np.array([len(runs) for runs in metric_runs])
+    counts = np.add.reduceat(complete, np.cumsum(run_counts) - run_counts, axis=1, dtype=np.int64)
+    return 100 * np.transpose(counts, (0, 2, 1)) / run_counts
+
+
+def get_display_name(metric):
+    cleaned_name = metric.replace("_", " ")
+    if cleaned_name == "Coverage":
+        cleaned_name = "Absolute Coverage"
+    if cleaned_name == "Distance To Edge":
+        cleaned_name = "Distance-To-Edge"
+    if cleaned_name == "Baseline Height Ratio":
+        cleaned_name = "Baseline-Height-Ratio"
+    if cleaned_name == "RQF V15":
+        cleaned_name = "RQF (ours)"
+    return cleaned_name
+
+
+def plot_alpha_completeness(metric_names, images, completeness_percentage, alpha, with_legend=True, lower=None, upper=None):
+    # Plot the percentage of complete models over the number of images (of the shape (images, metric)) for one alpha,
+    # optionally with a confidence band between lower and upper
+    from matplotlib import pyplot as plt
     colors = [
             "#50B695",
             "#5D85C3",
@@ -131,20 +107,10 @@ def plot_alpha_completeness(result_folder, data_folder, alpha, ignore_list=None,
     #plt.figure(figsize=(8, 6), dpi=200)
     
     # Plot
-    counter = 0
-    for metric in completeness_percentage:
-        cleaned_name = metric.replace("_", " ")
-        if cleaned_name == "Coverage":
-            cleaned_name = "Absolute Coverage"
-        if cleaned_name == "Distance To Edge":
-            cleaned_name = "Distance-To-Edge"
-        if cleaned_name == "Baseline Height Ratio":
-            cleaned_name = "Baseline-Height-Ratio"
-        if cleaned_name == "RQF V15":
-            cleaned_name = "RQF (ours)"
-        
-        plt.plot(images, completeness_percentage[metric], linestyle=line_styles[counter % len(line_styles)], color=colors[counter % len(colors)], label=cleaned_name, alpha=0.9)
-        counter = counter + 1
+    for counter in range(len(metric_names)):
+        plt.plot(images, completeness_percentage[:, counter], linestyle=line_styles[counter % len(line_styles)], color=colors[counter % len(colors)], label=get_display_name(metric_names[counter]), alpha=0.9)
+        if lower is not None and upper is not None:
+            plt.fill_between(images, lower[:, counter], upper[:, counter], color=colors[counter % len(colors)], alpha=0.15, lw=0)
         
     plt.xlabel("Images added to the reconstruction")
     #plt.ylabel(f"Percentage of models with a completeness greater than {alpha}%")
@@ -183,19 +149,63 @@ def plot_joint_alpha_completeness(simulation_folder, output_path):
     #find_outliers_in_data(folder)
     #exit()
     
+    #alpha_values = [50, 75, 90]
+    alpha_values = JOINT_ALPHA_VALUES
+    
+    metric_names, metric_runs = read_completeness_results(simulation_folder, IGNORED_METRICS)
+    images = np.arange(MAXIMUM_IMAGES)
+    completeness_percentage = calculate_alpha_completeness(metric_runs, alpha_values, images)
+    draw_joint_alpha_completeness(metric_names, images, completeness_percentage, alpha_values, output_path)
+
+
+def draw_joint_alpha_completeness(metric_names, images, completeness_percentage, alpha_values, output_path):
+    # One panel per alpha with the percentages of the shape (alpha, images, metric)
+    from matplotlib import pyplot as plt
+
     #plt.figure(figsize=(12, 5), dpi=150)
     plt.figure(figsize=(8, 5), dpi=150)
     
-    #alpha_values = [50, 75, 90]
-    alpha_values = [75, 90]
-    
     for i in range(len(alpha_values)):
         plt.subplot(len(alpha_values),1,i + 1)
-        plot_alpha_completeness(folder, "D:\\Users\\kneumann\\002_OrthoSfM\\Simulations\\SimulationsPython\\data\\CulturalHeritage", alpha_values[i], ["V10", "V14"], i == 0)
+        plot_alpha_completeness(metric_names, images, completeness_percentage[i], alpha_values[i], i == 0)
         
     
     plt.suptitle(f"Percentage of models with a completeness greater than $\\alpha$ after adding N images.")
     
     plt.tight_layout()
     #plt.show() 
-    plt.savefig(output_path)
\ No newline at end of file
+    plt.savefig(output_path)
+
+
+def plot_alpha_completeness_sweep(simulation_folder, output_path, alpha_values=range(50, 100)):
+    # Heatmap of the percentage of complete models over the number of images and a dense range of thresholds alpha,
+    # one panel per metric
+    from matplotlib import pyplot as plt
+    metric_names, metric_runs = read_completeness_results(simulation_folder, IGNORED_METRICS)
+    alpha_values = np.asarray(alpha_values)
+    images = np.arange(MAXIMUM_IMAGES)
+    completeness_percentage = calculate_alpha_completeness(metric_runs, alpha_values, images)
+    
+    columns = 3
+    rows = max(1, int(np.ceil(len(metric_names) / columns)))
+    figure, axes = plt.subplots(rows, columns, figsize=(4 * columns, 2.5 * rows), dpi=150, sharex=True, sharey=True, squeeze=False)
+    
+    for i in range(rows * columns):
+        axis = axes[i // columns][i % columns]
+        if i >= len(metric_names):
+            axis.axis("off")
+            continue
+        
+        mesh = axis.pcolormesh(images, alpha_values, completeness_percentage[:, :, i], vmin=0, vmax=100, cmap="viridis", shading="nearest")
+        axis.set_title(get_display_name(metric_names[i]), fontsize=9)
+        if i % columns == 0:
+            axis.set_ylabel("Threshold $\\alpha$ [%]")
+        if i // columns == rows - 1 or i + columns >= len(metric_names):
+            axis.set_xlabel("Images added to the reconstruction")
+    
+    if len(metric_names) > 0:
+        figure.colorbar(mesh, ax=axes, label="Complete Models [%]")
+    figure.suptitle("Percentage of models with a completeness greater than $\\alpha$ after adding N images.")
+    
+    plt.savefig(output_path)
+    plt.close(figure)
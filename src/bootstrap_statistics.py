@@ -0,0 +1,248 @@
+import warnings
+import numpy as np
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from src.alpha_completeness import read_completeness_results, calculate_run_completeness, plot_alpha_completeness, \
+    get_display_name, MAXIMUM_IMAGES
+
+# Confidence bands and significance tests for the completeness figures. The unit of resampling is a run, identified by
+# model and repetition, and every metric is evaluated on the same units. A bootstrap sample draws the models with
+# replacement and then the repetitions of every drawn model with replacement, which turns into a weight per unit. The
+# mean curves of all metrics of a batch of samples are then a single product of the (samples, units) weight matrix with
+# the (units, values) curves. Batches are spread over worker processes and every batch has its own seed, so the results
+# only depend on the seed and not on the number of workers.
+#
+# RQF is compared against every baseline on the mean of a curve of a run (the share of complete models averaged over
+# the number of images, or the average completeness over the evaluation steps): the confidence interval of the
+# difference comes from the same bootstrap samples, the p-value from a paired sign flip permutation test over the units
+# and is adjusted for the number of baselines with the Holm method.
+
+# Number of bootstrap samples that are drawn at once
+BATCH_SIZE = 250
+
+
+def get_units(metric_runs):
+    # All (model, repetition) pairs that occur in any metric, grouped by model
+    units = sorted(set((run[2], run[3]) for runs in metric_runs for run in runs))
+    models = sorted(set(model for model, _ in units))
+    unit_models = np.array([models.index(model) for model, _ in units])
+    return units, unit_models
+
+
+def stack_curves(metric_runs, units, run_curves):
+    # Arrange the curves of all runs (an array of the shape (runs, ...) in the order of metric_runs) into an array of
+    # the shape (units, metrics, ...) that is NaN for units a metric has no run for
+    values = np.full((len(units), len(metric_runs)) + run_curves.shape[1:], np.nan)
+    unit_index = {unit: i for i, unit in enumerate(units)}
+    counter = 0
+    for metric in range(len(metric_runs)):
+        for run in metric_runs[metric]:
+            values[unit_index[(run[2], run[3])], metric] = run_curves[counter]
+            counter += 1
+    return values
+
+
+def draw_unit_weights(unit_models, samples, rng):
+    # Number of times every unit is drawn in each of the samples: first the models, then the repetitions of every drawn
+    # model with replacement
+    number_of_models = np.max(unit_models) + 1
+    model_counts = rng.multinomial(number_of_models, np.full(number_of_models, 1 / number_of_models), size=samples)
+
+    weights = np.zeros((samples, len(unit_models)))
+    for model in range(number_of_models):
+        members = np.flatnonzero(unit_models == model)
+        weights[:, members] = rng.multinomial(model_counts[:, model] * len(members), np.full(len(members), 1 / len(members)))
+    return weights
+
+
+def calculate_weighted_means(weights, values):
+    # Means over the units of the values (units, ...) for every row of weights, ignoring NaN values
+    valid = ~np.isnan(values.reshape(len(values), -1))
+    sums = weights @ np.where(valid, values.reshape(len(values), -1), 0.0)
+    counts = weights @ valid
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).reshape((len(weights),) + values.shape[1:])
+
+
+def bootstrap_batch(values, summaries, unit_models, samples, seed):
+    rng = np.random.default_rng(seed)
+    weights = draw_unit_weights(unit_models, samples, rng)
+    return calculate_weighted_means(weights, values).astype(np.float32), calculate_weighted_means(weights, summaries)
+
+
+def bootstrap_means(values, summaries, unit_models, samples=2000, workers=1, seed=0):
+    # Bootstrap distribution of the mean curves (samples, metrics, ...) and of the mean summaries of all metrics
+    batch_sizes = [min(BATCH_SIZE, samples - start) for start in range(0, samples, BATCH_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    arguments = [repeat(values), repeat(summaries), repeat(unit_models), batch_sizes, seeds]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            batches = list(executor.map(bootstrap_batch, *arguments))
+    else:
+        batches = list(map(bootstrap_batch, *arguments))
+
+    return np.concatenate([batch[0] for batch in batches]), np.concatenate([batch[1] for batch in batches])
+
+
+def calculate_quantile(values, quantile):
+    # Linearly interpolated quantile along the first axis that ignores NaN values. Sorting moves the NaN values to the
+    # end, so the quantile of every column can be read at its own position without a loop over the columns.
+    sorted_values = np.sort(values, axis=0)
+    counts = np.sum(~np.isnan(values), axis=0)
+    position = quantile * np.maximum(counts - 1, 0)
+    below = np.floor(position).astype(np.int64)
+    above = np.minimum(below + 1, np.maximum(counts - 1, 0))
+    lower = np.take_along_axis(sorted_values, below[None], axis=0)[0]
+    upper = np.take_along_axis(sorted_values, above[None], axis=0)[0]
+    return np.where(counts > 0, lower + (position - below) * (upper - lower), np.nan)
+
+
+def calculate_confidence_band(bootstrap_values, confidence=0.95):
+    return calculate_quantile(bootstrap_values, (1 - confidence) / 2), calculate_quantile(bootstrap_values, (1 + confidence) / 2)
+
+
+def calculate_sign_flip_p_value(differences, permutations=10000, seed=0):
+    # Two sided p-value of a paired sign flip permutation test for a zero mean difference. All sign combinations are
+    # enumerated if there are fewer than permutations of them.
+    differences = differences[~np.isnan(differences)]
+    if len(differences) == 0 or np.all(differences == 0):
+        return 1.0
+
+    if 2 ** len(differences) <= permutations:
+        signs = 1 - 2 * ((np.arange(2 ** len(differences))[:, None] >> np.arange(len(differences))) & 1)
+        statistics = np.abs(signs @ differences)
+        return float(np.mean(statistics >= np.abs(np.sum(differences)) - 1e-12))
+
+    rng = np.random.default_rng(seed)
+    signs = rng.choice([-1.0, 1.0], size=(permutations, len(differences)))
+    statistics = np.abs(signs @ differences)
+    return float((1 + np.sum(statistics >= np.abs(np.sum(differences)) - 1e-12)) / (permutations + 1))
+
+
+def adjust_holm(p_values):
+    p_values = np.asarray(p_values, dtype=np.float64)
+    order = np.argsort(p_values)
+    adjusted = np.minimum(1.0, np.maximum.accumulate(p_values[order] * (len(p_values) - np.arange(len(p_values)))))
+    result = np.empty_like(adjusted)
+    result[order] = adjusted
+    return result
+
+
+def compare_against_reference(metric_names, curve_names, summaries, bootstrap_summaries, reference, confidence=0.95,
+                              permutations=10000, seed=0):
+    # Difference of the mean summary of the reference metric and every other metric per curve with its bootstrap
+    # confidence interval and permutation p-value. Returns a list of result rows.
+    if reference not in metric_names:
+        print("Reference metric '" + reference + "' not found, skipping the significance tests")
+        return []
+
+    reference_index = metric_names.index(reference)
+    baselines = [i for i in range(len(metric_names)) if i != reference_index]
+
+    rows = []
+    for curve in range(len(curve_names)):
+        curve_rows = []
+        for baseline in baselines:
+            differences = summaries[:, reference_index, curve] - summaries[:, baseline, curve]
+            bootstrap_differences = bootstrap_summaries[:, reference_index, curve] - bootstrap_summaries[:, baseline, curve]
+            lower, upper = calculate_confidence_band(bootstrap_differences, confidence)
+            curve_rows.append({"curve": curve_names[curve], "baseline": metric_names[baseline],
+                               "reference_mean": np.nanmean(summaries[:, reference_index, curve]),
+                               "baseline_mean": np.nanmean(summaries[:, baseline, curve]),
+                               "difference": np.nanmean(differences), "lower": lower, "upper": upper,
+                               "p_value": calculate_sign_flip_p_value(differences, permutations, seed)})
+
+        for row, adjusted in zip(curve_rows, adjust_holm([row["p_value"] for row in curve_rows])):
+            row["holm_p_value"] = adjusted
+        rows.extend(curve_rows)
+
+    return rows
+
+
+def write_significance_table(rows, reference, output_path):
+    with open(output_path, "w") as f:
+        f.write("Curve;Reference;Baseline;Reference mean;Baseline mean;Difference;CI lower;CI upper;p-value;Holm p-value\n")
+        for row in rows:
+            f.write(";".join([row["curve"], reference, row["baseline"]] + [str(row[key]) for key in
+                    ["reference_mean", "baseline_mean", "difference", "lower", "upper", "p_value", "holm_p_value"]]) + "\n")
+
+
+def plot_bootstrap_statistics(simulation_folder, output_folder, samples=2000, workers=1, alpha_values=None,
+                              reference="RQF_V15", confidence=0.95, seed=0):
+    # Alpha completeness and mean completeness over time with bootstrap confidence bands and the significance of the
+    # reference metric against all other metrics
+    from matplotlib import pyplot as plt
+    if alpha_values is None:
+        alpha_values = [75, 90]
+
+    metric_names, metric_runs = read_completeness_results(simulation_folder, ["V10", "V14"])
+    runs = [run for runs in metric_runs for run in runs]
+    if len(runs) == 0:
+        print("No completeness results found, skipping the bootstrap")
+        return
+    units, unit_models = get_units(metric_runs)
+
+    # Curves of every run: completeness indicators per alpha over the number of images and the completeness over the
+    # evaluation steps
+    images = np.arange(MAXIMUM_IMAGES)
+    completeness = calculate_run_completeness(runs, images)
+    complete = 100 * (completeness[:, None, :] > np.asarray(alpha_values, dtype=np.float64)[None, :, None])
+
+    steps = max(len(run[1]) for run in runs)
+    step_completeness = np.full((len(runs), steps), np.nan)
+    for i in range(len(runs)):
+        step_completeness[i, :len(runs[i][1])] = runs[i][1]
+
+    alpha_curves = stack_curves(metric_runs, units, complete)
+    step_curves = stack_curves(metric_runs, units, step_completeness)
+    values = np.concatenate([alpha_curves.reshape(len(units), len(metric_names), -1),
+                             step_curves.reshape(len(units), len(metric_names), -1)], axis=2)
+
+    # Per unit summaries: mean share of images with a complete model per alpha and the mean completeness over the steps
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        summaries = np.concatenate([np.mean(alpha_curves, axis=3), np.nanmean(step_curves, axis=2)[:, :, None]], axis=2)
+    curve_names = ["Alpha " + str(alpha) for alpha in alpha_values] + ["Completeness"]
+
+    bootstrap_curves, bootstrap_summaries = bootstrap_means(values, summaries, unit_models, samples, workers, seed)
+    lower, upper = calculate_confidence_band(bootstrap_curves, confidence)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(values, axis=0)
+
+    alpha_size = len(alpha_values) * len(images)
+    alpha_mean = mean[:, :alpha_size].reshape(len(metric_names), len(alpha_values), len(images))
+    alpha_lower = lower[:, :alpha_size].reshape(len(metric_names), len(alpha_values), len(images))
+    alpha_upper = upper[:, :alpha_size].reshape(len(metric_names), len(alpha_values), len(images))
+
+    # Alpha completeness with confidence bands
+    plt.figure(figsize=(8, 5), dpi=150)
+    for i in range(len(alpha_values)):
+        plt.subplot(len(alpha_values), 1, i + 1)
+        plot_alpha_completeness(metric_names, images, alpha_mean[:, i].T, alpha_values[i], i == 0, alpha_lower[:, i].T, alpha_upper[:, i].T)
+    plt.suptitle(f"Percentage of models with a completeness greater than $\\alpha$ ({int(100 * confidence)}% confidence bands)")
+    plt.tight_layout()
+    plt.savefig(output_folder + "/alpha_completeness_bootstrap.png")
+    plt.close()
+
+    # Mean completeness over the evaluation steps with confidence bands, plotted over the image counts of the longest run
+    step_images = max((run[0] for run in runs), key=len)
+    plt.figure(figsize=(9, 5), dpi=150)
+    colors = ["#50B695", "#5D85C3", "#009CDA", "#F8BA3C", "#EE7A34", "#C9308E", "#804597", "#E9503E"]
+    line_styles = ["solid", "dotted", "dashed"]
+    for i in range(len(metric_names)):
+        color = colors[i % len(colors)]
+        plt.plot(step_images, mean[i, alpha_size:], linestyle=line_styles[i % len(line_styles)], lw=1, color=color, label=get_display_name(metric_names[i]))
+        plt.fill_between(step_images, lower[i, alpha_size:], upper[i, alpha_size:], color=color, alpha=0.15, lw=0)
+    plt.legend(bbox_to_anchor=(1.025, 0.97), loc='upper left')
+    plt.xlabel("Total number of images")
+    plt.ylabel("Reconstruction completeness [%]")
+    plt.subplots_adjust(right=0.675, left=0.08, top=0.95, bottom=0.1)
+    plt.title(f"Reconstruction Completeness over Time ({int(100 * confidence)}% confidence bands)")
+    plt.savefig(output_folder + "/completeness_bootstrap.png")
+    plt.close()
+
+    rows = compare_against_reference(metric_names, curve_names, summaries, bootstrap_summaries, reference, confidence, seed=seed)
+    write_significance_table(rows, reference, output_folder + "/completeness_significance.csv")
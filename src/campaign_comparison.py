@@ -0,0 +1,210 @@
+import numpy as np
+
+from src.runtime_analytics import load_runtime_iterations, get_components
+from src.results_catalog import query_results
+from src.alpha_completeness import calculate_run_completeness
+
+# Comparison of a candidate campaign (e.g. simulated with a new executable) against a baseline campaign. Runs are paired
+# by model, metric and repetition and only iterations with the same number of images in both runs are compared, so runs
+# that terminated at different times are still comparable.
+#
+# The runtime of a component in a run is the median time of its paired iterations and the change of a component is
+# the geometric mean of the candidate / baseline ratios of all run pairs, with a bootstrap confidence interval over the
+# run pairs. A one sided Wilcoxon signed rank test on the log ratios of the run pairs checks whether the candidate is
+# slower, pairing the runs removes the large runtime differences between models from the test. A component
+# counts as regression if it got slower by more than the threshold, the confidence interval lies above 1 and the test
+# is significant.
+#
+# Reconstruction quality is compared on the completeness curves of the paired runs. All runs of both campaigns are
+# evaluated at once on a common grid of image counts (a run keeps its last completeness after it terminated), which gives
+# the area under the completeness curve (as mean completeness over the grid), the number of images needed to exceed a
+# completeness of alpha and the final completeness of every run. Their paired differences are aggregated per metric and
+# over all runs with a bootstrap confidence interval and a one sided Wilcoxon signed rank test. A measure counts as
+# regression if it got worse by more than its tolerance, the confidence interval excludes 0 and the test is significant.
+
+# Number of bootstrap samples that are drawn at once
+BATCH_SIZE = 1000
+
+
+def get_pair_codes(iterations):
+    # Integer code per (model, metric, repetition) that is shared by both campaigns
+    keys = np.char.add(np.char.add(np.char.add(iterations["model"].astype(str), "|"),
+                                   np.char.add(iterations["metric"].astype(str), "|")), iterations["repetition"].astype(str))
+    _, codes = np.unique(keys, return_inverse=True)
+    return codes
+
+
+def calculate_group_medians(groups, values):
+    # Median of the values of every group, groups are given as integer codes. Returns the groups and their medians.
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+    counts = np.diff(np.append(starts, len(groups)))
+    medians = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+    return groups[starts], medians
+
+
+def bootstrap_mean(values, samples=10000, confidence=0.95, seed=0):
+    # Percentile bootstrap confidence interval of the mean of the values
+    rng = np.random.default_rng(seed)
+    means = []
+    for start in range(0, samples, BATCH_SIZE):
+        indices = rng.integers(0, len(values), (min(BATCH_SIZE, samples - start), len(values)))
+        means.append(np.mean(values[indices], axis=1))
+    means = np.concatenate(means)
+    return np.quantile(means, (1 - confidence) / 2), np.quantile(means, (1 + confidence) / 2)
+
+
+def compare_component(codes, campaigns, images, seconds, samples, confidence, seed):
+    # Paired comparison of one component, all arrays hold the records of both campaigns
+    valid = ~np.isnan(seconds) & (seconds > 0)
+    iteration_keys = codes * (int(np.max(images, initial=0)) + 1) + images.astype(np.int64)
+    baseline = np.flatnonzero(valid & (campaigns == 0))
+    candidate = np.flatnonzero(valid & (campaigns == 1))
+
+    # Iterations with the same run and number of images in both campaigns
+    _, baseline_index, candidate_index = np.intersect1d(iteration_keys[baseline], iteration_keys[candidate], return_indices=True)
+    if len(baseline_index) == 0:
+        return None
+    baseline, candidate = baseline[baseline_index], candidate[candidate_index]
+
+    pairs, baseline_medians = calculate_group_medians(codes[baseline], seconds[baseline])
+    _, candidate_medians = calculate_group_medians(codes[candidate], seconds[candidate])
+    log_ratios = np.log(candidate_medians / baseline_medians)
+
+    lower, upper = bootstrap_mean(log_ratios, samples, confidence, seed)
+    p_value = test_paired_differences(log_ratios, 1)
+
+    return {"pairs": len(pairs), "iterations": len(baseline), "baseline_median": float(np.median(baseline_medians)),
+            "candidate_median": float(np.median(candidate_medians)), "ratio": float(np.exp(np.mean(log_ratios))),
+            "ratio_lower": float(np.exp(lower)), "ratio_upper": float(np.exp(upper)), "p_value": p_value}
+
+
+def compare_runtimes(baseline_folder, candidate_folder, threshold=0.1, significance=0.05, samples=10000, confidence=0.95,
+                     seed=0):
+    # Compare the metric runtimes and the runtime stages (including the total iteration time) of two campaigns. Returns
+    # one result row per component that was measured in both campaigns.
+    iterations = load_runtime_iterations([baseline_folder, candidate_folder], update=False)
+    if len(iterations["seconds"]) == 0:
+        return []
+    codes = get_pair_codes(iterations)
+
+    rows = []
+    for source, component in get_components(iterations):
+        selected = (iterations["source"] == source) & (iterations["component"] == component)
+        result = compare_component(codes[selected], iterations["campaign"][selected], iterations["images"][selected],
+                                   iterations["seconds"][selected], samples, confidence, seed)
+        if result is None:
+            continue
+
+        result["source"] = source
+        result["component"] = component
+        result["regression"] = result["ratio"] > 1 + threshold and result["ratio_lower"] > 1 and result["p_value"] < significance
+        rows.append(result)
+
+    return rows
+
+
+def print_runtime_comparison(rows):
+    print("Component".ljust(40), "Pairs".rjust(6), "Baseline [s]".rjust(13), "Candidate [s]".rjust(14), "Ratio".rjust(7),
+          "CI".rjust(16), "p-value".rjust(8))
+    for row in rows:
+        print((row["source"] + "/" + row["component"]).ljust(40), str(row["pairs"]).rjust(6),
+              ("%.4f" % row["baseline_median"]).rjust(13), ("%.4f" % row["candidate_median"]).rjust(14),
+              ("%.3f" % row["ratio"]).rjust(7), ("[%.3f, %.3f]" % (row["ratio_lower"], row["ratio_upper"])).rjust(16),
+              ("%.4f" % row["p_value"]).rjust(8), "REGRESSION" if row["regression"] else "")
+
+
+# Quality measures with the direction in which they get worse
+QUALITY_MEASURES = [["auc", -1], ["final", -1], ["images_to_alpha", 1]]
+
+
+def load_completeness_runs(folder):
+    runs = {}
+    for run, lines in query_results(folder, "Metrics", ["Images", "Completeness [%]"], update=False):
+        images = lines.get("Images", np.zeros(0)).astype(np.int64)
+        completeness = lines.get("Completeness [%]", np.zeros(0))
+        order = np.argsort(images, kind="stable")
+        runs[(run["model"], run["metric"], run["repetition"])] = [images[order], completeness[order]]
+    return runs
+
+
+def calculate_quality_measures(runs, images, alpha):
+    # Area under the completeness curve, images needed to exceed alpha (NaN if never) and final completeness of every run
+    completeness = np.maximum(calculate_run_completeness(runs, images), 0.0)
+    reached = completeness > alpha
+    first = np.argmax(reached, axis=1)
+    return {"auc": np.mean(completeness, axis=1),
+            "images_to_alpha": np.where(np.any(reached, axis=1), images[first], np.nan),
+            "final": np.array([run[1][-1] if len(run[1]) > 0 else np.nan for run in runs])}
+
+
+def test_paired_differences(differences, direction):
+    # One sided Wilcoxon signed rank test whether the differences point into the given direction
+    from scipy.stats import wilcoxon
+    if len(differences) < 2 or np.all(differences == 0):
+        return 1.0
+    return float(wilcoxon(differences, alternative="greater" if direction > 0 else "less").pvalue)
+
+
+def compare_quality(baseline_folder, candidate_folder, alpha=90, tolerance=1.0, images_tolerance=5, significance=0.05,
+                    samples=10000, confidence=0.95, seed=0):
+    # Compare the completeness curves of the runs two campaigns have in common. Returns the measures of every run pair and
+    # the aggregated differences per metric and over all metrics.
+    baseline_runs = load_completeness_runs(baseline_folder)
+    candidate_runs = load_completeness_runs(candidate_folder)
+    keys = sorted(set(baseline_runs) & set(candidate_runs))
+    if len(keys) == 0:
+        return [], []
+
+    # All runs of both campaigns on a common grid of image counts
+    runs = [baseline_runs[key] for key in keys] + [candidate_runs[key] for key in keys]
+    images = np.arange(0, max(int(np.max(run[0], initial=0)) for run in runs) + 1)
+    measures = calculate_quality_measures(runs, images, alpha)
+
+    run_rows = []
+    for i in range(len(keys)):
+        row = {"model": keys[i][0], "metric": keys[i][1], "repetition": keys[i][2]}
+        for measure, _ in QUALITY_MEASURES:
+            row["baseline_" + measure] = float(measures[measure][i])
+            row["candidate_" + measure] = float(measures[measure][len(keys) + i])
+            row["delta_" + measure] = row["candidate_" + measure] - row["baseline_" + measure]
+        run_rows.append(row)
+
+    metrics = np.array([key[1] for key in keys])
+    rows = []
+    for group in sorted(set(metrics)) + ["All"]:
+        selected = np.ones(len(keys), dtype=bool) if group == "All" else metrics == group
+        for measure, direction in QUALITY_MEASURES:
+            baseline = measures[measure][:len(keys)][selected]
+            candidate = measures[measure][len(keys):][selected]
+
+            # Runs that never reached alpha have no image count, they are only counted
+            paired = ~np.isnan(baseline) & ~np.isnan(candidate)
+            row = {"metric": group, "measure": measure, "pairs": int(np.sum(selected)), "compared": int(np.sum(paired)),
+                   "baseline_missing": int(np.sum(np.isnan(baseline))), "candidate_missing": int(np.sum(np.isnan(candidate)))}
+            if row["compared"] == 0:
+                continue
+
+            differences = candidate[paired] - baseline[paired]
+            lower, upper = bootstrap_mean(differences, samples, confidence, seed)
+            row.update({"baseline_mean": float(np.mean(baseline[paired])), "candidate_mean": float(np.mean(candidate[paired])),
+                        "delta": float(np.mean(differences)), "delta_lower": float(lower), "delta_upper": float(upper),
+                        "p_value": test_paired_differences(differences, direction)})
+
+            limit = images_tolerance if measure == "images_to_alpha" else tolerance
+            worse_bound = lower if direction > 0 else -upper
+            row["regression"] = direction * row["delta"] > limit and worse_bound > 0 and row["p_value"] < significance
+            rows.append(row)
+
+    return run_rows, rows
+
+
+def print_quality_comparison(rows):
+    print("Metric".ljust(28), "Measure".ljust(16), "Pairs".rjust(6), "Baseline".rjust(9), "Candidate".rjust(10), "Delta".rjust(8),
+          "CI".rjust(18), "p-value".rjust(8))
+    for row in rows:
+        print(row["metric"].ljust(28), row["measure"].ljust(16), str(row["compared"]).rjust(6), ("%.2f" % row["baseline_mean"]).rjust(9),
+              ("%.2f" % row["candidate_mean"]).rjust(10), ("%.2f" % row["delta"]).rjust(8),
+              ("[%.2f, %.2f]" % (row["delta_lower"], row["delta_upper"])).rjust(18), ("%.4f" % row["p_value"]).rjust(8),
+              "REGRESSION" if row["regression"] else "")
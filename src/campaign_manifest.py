@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from src.file_lock import file_lock, get_node_name
+
+# Possible states of a single run in the campaign
+RUN_STATES = ["pending", "running", "done", "failed", "timeout"]
+
+# Serializes manifest updates of the worker threads
+manifest_lock = threading.Lock()
+
+
+def get_manifest_path(project_folder):
+    return project_folder + "/campaign_manifest.json"
+
+
+def manifest_file_lock(project_folder):
+    # Guards read-modify-write cycles of the manifest against other processes (also on other machines)
+    return file_lock(get_manifest_path(project_folder) + ".lock")
+
+
+def load_manifest(project_folder):
+    # Load the manifest of the campaign or create an empty one
+    manifest_path = get_manifest_path(project_folder)
+    if not os.path.exists(manifest_path):
+        return {"runs": {}}
+
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(project_folder, manifest):
+    # Write to a temporary file first and replace the manifest atomically, so a crash never leaves a broken manifest
+    manifest_path = get_manifest_path(project_folder)
+    temporary = manifest_path + "." + get_node_name() + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temporary, manifest_path)
+
+
+def calculate_checksum(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def outputs_are_valid(project_folder, entry):
+    # A finished run is only valid if all of its recorded outputs still exist with the recorded content
+    if len(entry.get("outputs", {})) == 0:
+        return False
+
+    for relative_path, checksum in entry["outputs"].items():
+        path = project_folder + "/" + relative_path
+        if not os.path.exists(path) or calculate_checksum(path) != checksum:
+            return False
+
+    return True
+
+
+def create_run_name(run_id, model_name, metric, repetition):
+    return str(run_id).zfill(3) + "_" + model_name + "_" + metric + "_" + str(repetition)
+
+
+def plan_campaign(project_folder, models, metrics, repetitions, shared=False):
+    # Register all model, metric and repetition combinations in the manifest and return the manifest together with the
+    # runs that still need to be simulated. Existing runs keep their id (and thereby their name), newly added ones are
+    # appended. In shared mode other nodes may currently work on the campaign, so their run states are left untouched.
+    with manifest_file_lock(project_folder):
+        manifest = load_manifest(project_folder)
+        jobs = plan_runs(project_folder, manifest, models, metrics, repetitions, shared)
+        save_manifest(project_folder, manifest)
+
+    return manifest, jobs
+
+
+def plan_runs(project_folder, manifest, models, metrics, repetitions, shared):
+    known_runs = {}
+    next_run_id = 0
+    for run_name, entry in manifest["runs"].items():
+        known_runs[(entry["model"], entry["metric"], entry["repetition"])] = run_name
+        next_run_id = max(next_run_id, entry["run_id"] + 1)
+
+    # Campaigns created before the manifest existed used a running counter over all combinations
+    adopt_existing = len(manifest["runs"]) == 0
+
+    jobs = []
+    counter = 0
+    for model in models:
+        for metric in metrics:
+            for i in range(repetitions):
+                key = (model[0], metric, i)
+
+                if key not in known_runs:
+                    run_id = counter if adopt_existing else next_run_id
+                    next_run_id = max(next_run_id, run_id + 1)
+                    run_name = create_run_name(run_id, model[0], metric, i)
+                    entry = {"run_id": run_id, "model": model[0], "metric": metric, "repetition": i,
+                             "status": "pending", "attempts": 0, "outputs": {}}
+
+                    # Adopt results that were produced by an older version of the runner
+                    metrics_file = "000_Results/Metrics/" + run_name + ".txt"
+                    if adopt_existing and os.path.exists(project_folder + "/" + metrics_file):
+                        entry["status"] = "done"
+                        entry["outputs"] = collect_output_checksums(project_folder, run_name)
+
+                    manifest["runs"][run_name] = entry
+                    known_runs[key] = run_name
+
+                counter = counter + 1
+
+                run_name = known_runs[key]
+                entry = manifest["runs"][run_name]
+
+                # Skip runs that finished and whose results are still intact
+                if entry["status"] == "done" and outputs_are_valid(project_folder, entry):
+                    continue
+
+                # Everything else (pending, interrupted, failed, timed out or modified results) is queued again
+                if not shared or entry["status"] != "running":
+                    entry["status"] = "pending"
+                jobs.append({"run_id": entry["run_id"], "run_name": run_name, "model": model, "metric": metric, "repetition": i})
+
+    return jobs
+
+
+def collect_output_checksums(project_folder, run_name):
+    # Checksums of all result files of the run, keyed by their path relative to the project folder
+    outputs = {}
+    for sub_folder in ["Metrics", "Termination", "Runtime", "MetricRuntime"]:
+        relative_path = "000_Results/" + sub_folder + "/" + run_name + ".txt"
+        if os.path.exists(project_folder + "/" + relative_path):
+            outputs[relative_path] = calculate_checksum(project_folder + "/" + relative_path)
+    return outputs
+
+
+def set_run_status(project_folder, manifest, run_name, status, duration=None):
+    # Update the state of a run and persist the manifest immediately. The manifest is reloaded under the lock, so
+    # updates of other processes working on the same campaign are kept.
+    with manifest_lock, manifest_file_lock(project_folder):
+        current = load_manifest(project_folder)
+        if run_name not in current["runs"]:
+            current["runs"][run_name] = manifest["runs"][run_name]
+        entry = current["runs"][run_name]
+        entry["status"] = status
+        entry["updated"] = time.time()
+
+        if status == "running":
+            entry["attempts"] = entry.get("attempts", 0) + 1
+        else:
+            entry["outputs"] = collect_output_checksums(project_folder, run_name)
+
+        if duration is not None:
+            entry["duration"] = duration
+
+        save_manifest(project_folder, current)
+        manifest["runs"] = current["runs"]
+
+
+def summarize_manifest(manifest):
+    # Number of runs of the campaign in every state
+    counts = {}
+    for state in RUN_STATES:
+        counts[state] = 0
+    for entry in manifest["runs"].values():
+        counts[entry["status"]] += 1
+    return counts
@@ -0,0 +1,225 @@
+import os
+import json
+import shutil
+from glob import glob
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from src.ply_reader import get_vertex_property_names, get_vertex_count, read_vertex_columns
+from src.campaign_manifest import load_manifest
+from src.file_lock import get_node_name
+from src.run_names import split_run_name
+
+
+def get_store_folder(project_folder):
+    return project_folder + "/000_Results/CloudStore"
+
+
+def get_image_number(cloud_path):
+    return int(os.path.basename(cloud_path).replace("dense_cloud_", "").replace(".ply", ""))
+
+
+def get_source_identity(cloud_path):
+    # Size and modification time of the dense cloud a stored cloud was converted from
+    stat = os.stat(cloud_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_run_index(store_folder, run_name):
+    index_path = store_folder + "/" + run_name + "/index.json"
+    if not os.path.exists(index_path):
+        return None
+
+    try:
+        with open(index_path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+
+def save_run_index(store_folder, run_name, index):
+    # The index is replaced atomically after all columns of a cloud are written, so readers never see partial clouds
+    index_path = store_folder + "/" + run_name + "/index.json"
+    temporary = index_path + "." + get_node_name() + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(temporary, index_path)
+
+
+def convert_dense_cloud(cloud_path, target, float32=False, compress=False):
+    # Convert a dense cloud into one array per vertex property. Uncompressed clouds are stored as a folder of .npy files,
+    # which can be memory mapped column by column, compressed clouds as a single .npz archive. A copy of the cloud in the
+    # other format is removed, so switching the format never leaves a stale copy behind.
+    names = get_vertex_property_names(cloud_path)
+    columns = read_vertex_columns(cloud_path, names)
+
+    arrays = {}
+    for name in names:
+        values = columns[name]
+        if float32 and values.dtype == np.float64:
+            values = values.astype(np.float32)
+        arrays[name] = values
+
+    temporary = target + "." + get_node_name() + ".tmp"
+    if compress:
+        with open(temporary, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temporary, target + ".npz")
+        shutil.rmtree(target, ignore_errors=True)
+    else:
+        os.makedirs(temporary, exist_ok=True)
+        for name in names:
+            np.save(temporary + "/" + name + ".npy", np.ascontiguousarray(arrays[name]))
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(temporary, target)
+        if os.path.exists(target + ".npz"):
+            os.remove(target + ".npz")
+
+    points = len(arrays[names[0]]) if len(names) > 0 else 0
+    return {"points": int(points),
+            "columns": {name: arrays[name].dtype.str for name in names},
+            "format": "npz" if compress else "npy"}
+
+
+def ingest_run(project_folder, run_name, model=None, metric=None, repetition=None, float32=False, compress=False):
+    # Add all dense clouds of a run to the store. Clouds that were already converted from an unchanged file are skipped,
+    # so the store can be filled incrementally. Clouds whose source file was deleted stay in the store.
+    store_folder = get_store_folder(project_folder)
+    cloud_folder = project_folder + "/000_Results/DenseClouds/" + run_name
+
+    index = load_run_index(store_folder, run_name)
+    if index is None:
+        if model is None or metric is None or repetition is None:
+            _, model, metric, repetition = split_run_name(run_name)
+        index = {"run_name": run_name, "model": model, "metric": metric, "repetition": repetition, "clouds": {}}
+
+    os.makedirs(store_folder + "/" + run_name, exist_ok=True)
+
+    converted = 0
+    for cloud_path in sorted(glob(cloud_folder + "/dense_cloud_*.ply")):
+        images = str(get_image_number(cloud_path))
+        source = get_source_identity(cloud_path)
+        if images in index["clouds"] and index["clouds"][images]["source"] == source:
+            continue
+
+        target = store_folder + "/" + run_name + "/dense_cloud_" + images
+        entry = convert_dense_cloud(cloud_path, target, float32, compress)
+        entry["source"] = source
+        index["clouds"][images] = entry
+        converted += 1
+
+        save_run_index(store_folder, run_name, index)
+
+    if converted == 0:
+        save_run_index(store_folder, run_name, index)
+
+    return converted
+
+
+def remove_run(project_folder, run_name):
+    shutil.rmtree(get_store_folder(project_folder) + "/" + run_name, ignore_errors=True)
+
+
+def ingest_results(project_folder, float32=False, compress=False, workers=1):
+    # Fill the store with the dense clouds of an existing campaign. Model and metric of a run are taken from the campaign
+    # manifest if there is one.
+    runs = load_manifest(project_folder)["runs"]
+
+    tasks = []
+    for cloud_folder in sorted(glob(project_folder + "/000_Results/DenseClouds/*")):
+        run_name = os.path.basename(cloud_folder)
+        entry = runs.get(run_name, {})
+        tasks.append([project_folder, run_name, entry.get("model"), entry.get("metric"), entry.get("repetition"), float32, compress])
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            converted = list(executor.map(ingest_run, *zip(*tasks))) if len(tasks) > 0 else []
+    else:
+        converted = [ingest_run(*task) for task in tasks]
+
+    return sum(converted)
+
+
+def list_dense_clouds(project_folder, runs=None, models=None, metrics=None):
+    # Describe every dense cloud of a campaign, optionally restricted to selected runs, models and metrics. Stored clouds
+    # come from the store index, clouds that were not converted (or changed since) are described by their ply header.
+    store_folder = get_store_folder(project_folder)
+    clouds = []
+
+    run_names = set(os.path.basename(folder) for folder in glob(project_folder + "/000_Results/DenseClouds/*"))
+    run_names.update(os.path.basename(folder) for folder in glob(store_folder + "/*"))
+
+    manifest_runs = None
+    for run_name in sorted(run_names):
+        if runs is not None and run_name not in runs:
+            continue
+
+        index = load_run_index(store_folder, run_name)
+        if index is None:
+            if manifest_runs is None:
+                manifest_runs = load_manifest(project_folder)["runs"]
+            if run_name in manifest_runs:
+                entry = manifest_runs[run_name]
+                index = {"model": entry["model"], "metric": entry["metric"], "repetition": entry["repetition"], "clouds": {}}
+            else:
+                _, model, metric, repetition = split_run_name(run_name)
+                index = {"model": model, "metric": metric, "repetition": repetition, "clouds": {}}
+
+        if models is not None and index["model"] not in models:
+            continue
+        if metrics is not None and index["metric"] not in metrics:
+            continue
+
+        description = {"run_name": run_name, "model": index["model"], "metric": index["metric"], "repetition": index["repetition"]}
+
+        # Use the stored version unless the dense cloud was replaced after it was converted
+        found = {}
+        for cloud_path in glob(project_folder + "/000_Results/DenseClouds/" + run_name + "/dense_cloud_*.ply"):
+            images = str(get_image_number(cloud_path))
+            stored = index["clouds"].get(images)
+            if stored is not None and stored["source"] == get_source_identity(cloud_path):
+                found[images] = dict(description, images=int(images), points=stored["points"], columns=list(stored["columns"]),
+                                     path=store_folder + "/" + run_name + "/dense_cloud_" + images, format=stored["format"])
+            else:
+                found[images] = dict(description, images=int(images), points=None, columns=None, path=cloud_path, format="ply")
+
+        for images, stored in index["clouds"].items():
+            if images not in found:
+                found[images] = dict(description, images=int(images), points=stored["points"], columns=list(stored["columns"]),
+                                     path=store_folder + "/" + run_name + "/dense_cloud_" + images, format=stored["format"])
+
+        clouds.extend(found[images] for images in sorted(found, key=int))
+
+    return clouds
+
+
+def get_cloud_columns(cloud):
+    # Property names of a listed cloud (read from the header for clouds that are not in the store)
+    if cloud["columns"] is None:
+        cloud["columns"] = get_vertex_property_names(os.path.abspath(cloud["path"]))
+    return cloud["columns"]
+
+
+def get_cloud_point_count(cloud):
+    if cloud["points"] is None:
+        cloud["points"] = get_vertex_count(os.path.abspath(cloud["path"]))
+    return cloud["points"]
+
+
+def read_cloud_columns(cloud, columns):
+    # Load selected properties of a listed cloud. Uncompressed stored columns are memory mapped, archives only decompress
+    # the requested columns and dense clouds that are not in the store are read from the ply file.
+    if cloud["format"] == "npy":
+        return {name: np.load(cloud["path"] + "/" + name + ".npy", mmap_mode="r") for name in columns}
+
+    if cloud["format"] == "npz":
+        with np.load(cloud["path"] + ".npz") as archive:
+            return {name: archive[name] for name in columns}
+
+    return read_vertex_columns(os.path.abspath(cloud["path"]), columns)
+
+
+def iterate_clouds(project_folder, columns, runs=None, models=None, metrics=None):
+    # Yield the description and the requested columns of every selected cloud
+    for cloud in list_dense_clouds(project_folder, runs, models, metrics):
+        yield cloud, read_cloud_columns(cloud, columns)
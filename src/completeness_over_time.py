@@ -1,16 +1,69 @@
 import os
-from matplotlib import pyplot as plt
-import matplotlib
-from glob import glob
 import numpy as np
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from src.results_catalog import query_results
+
+
+def load_global_metric_values(result_folder):
+    # Query the global metric results of all runs from the results catalog. Returns the runs (model, metric and
+    # repetition) and per line of the results ("Images", "Completeness [%]", ...) an array of the shape (runs, steps)
+    # that is padded with NaN.
+    results = query_results(result_folder, "Metrics")
+    runs = [dict(run, metric=run["metric"].replace("_", " ")) for run, _ in results]
+
+    values = {}
+    for i in range(len(results)):
+        for name, line in results[i][1].items():
+            values.setdefault(name, {})[i] = line
+
+    for name in values:
+        steps = max(len(line) for line in values[name].values())
+        padded = np.full((len(runs), steps), np.nan)
+        for i, line in values[name].items():
+            padded[i, :len(line)] = line
+        values[name] = padded
+
+    return runs, values
+
+
+def aggregate_global_metric_values(runs, values, run_groups, number_of_groups):
+    # Mean and standard deviation over the runs of every metric within every group (e.g. a model) at once. Runs with the
+    # group -1 are left out and steps that only some runs reached are averaged over these runs. Returns one dict per
+    # group in the layout {line name: {metric: [mean, std]}}.
+    metric_names = sorted(set(run["metric"] for run in runs))
+    metric_index = np.array([metric_names.index(run["metric"]) for run in runs], dtype=np.int64)
+    run_groups = np.asarray(run_groups, dtype=np.int64)
+    selected = run_groups >= 0
+    keys = run_groups[selected] * len(metric_names) + metric_index[selected]
+
+    group_values = [{} for _ in range(number_of_groups)]
+    for name in values:
+        line_values = values[name][selected]
+        valid = ~np.isnan(line_values)
+        counts = np.zeros((number_of_groups * len(metric_names), line_values.shape[1]))
+        sums = np.zeros_like(counts)
+        squares = np.zeros_like(counts)
+        np.add.at(counts, keys, valid)
+        np.add.at(sums, keys, np.where(valid, line_values, 0.0))
+        np.add.at(squares, keys, np.where(valid, line_values, 0.0) ** 2)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = sums / counts
+            std = np.sqrt(np.maximum(squares / counts - mean ** 2, 0.0))
+
+        for key in np.unique(keys):
+            # Only keep the steps that at least one run reached
+            length = np.max(np.flatnonzero(counts[key] > 0), initial=-1) + 1
+            group, metric = divmod(int(key), len(metric_names))
+            group_values[group].setdefault(name, {})[metric_names[metric]] = [mean[key, :length], std[key, :length]]
+
+    return group_values
 
 
 def summarize_simulation_global_metrics(result_folder, output_path):
     
-    # Get all global metric result files in the folder
-    result_files = glob(result_folder + "/000_Results/Metrics/[0-9][0-9][0-9]_*.txt")
-    #termination_files = glob(result_folder + "/../Termination/[0-9][0-9][0-9]_*.txt")
-
     # Define a list of valid models we want to evaluate in this run
     #valid_models = ["Suzanne"]
     #valid_models = ["Sphere"]
@@ -25,101 +78,38 @@ def summarize_simulation_global_metrics(result_folder, output_path):
     #ignored_metrics = ["Relative Coverage"]
     ignored_metrics = []
 
-    # Filter by valid models
-    filtered_files = []
-    for file in result_files:
-        for model in valid_models:
-            if model in os.path.basename(file):
-                filtered_files.append(file)
-                break
-
-    # Loop over all files and get the available local metrics
-    files_per_metric = {}
-    for file in filtered_files:
-        name = os.path.basename(file)
-        
-        # Remove model names
-        for model_name in valid_models:
-            name = name.replace(model_name, "")
-        
-        splitted = name[4:-4].split("_")
-        
-        metricNameComponents = splitted[1:-1]
-
-        metricName = metricNameComponents[0]
-        for component in metricNameComponents[1:]:
-            metricName += " " + component
-
-        if metricName not in files_per_metric:
-            files_per_metric[metricName] = [file]
-        else:
-            files_per_metric[metricName].append(file)
-
-    # Now average all global metrics per metric
-    global_metric_values = {}
-    for metric in files_per_metric:
-        print("Parsing '" + metric + "'")
-
-        if metric in ignored_metrics:
-            continue
-
-        # Read in all lines of the global metric file into a dict
-        metric_values = {}
-
-        # For each file of this metric
-        for file in files_per_metric[metric]:
-            with open(file, "r") as file:
-                for line in file:
-                    splitted = line.split(";")
-
-                    # Extract the name
-                    metric_name = splitted[0]
-
-                    # Extract the values
-                    values = []
-                    for val in splitted[1:]:
-                        values.append(float(val))
-
-                    if metric_name not in metric_values:
-                        metric_values[metric_name] = [values]
-                    else:
-                        metric_values[metric_name].append(values)
-                        
-        print("   - Read in Metric values")
-
-        for name in metric_values:
-            max_len = 0
-            for filearray in metric_values[name]:
-                if len(filearray) > max_len:
-                    max_len = len(filearray)
-                    
-            # Initialize the mean and std arrays
-            mean_array = np.zeros((max_len,))
-            std_array = np.zeros((max_len,))
-            
-            # Loop over all value entries
-            for i in range(max_len):
-                values = []
-                
-                # Collect all values for that entry
-                for filearray in metric_values[name]:
-                    if i <= len(filearray) - 1:
-                        values.append(filearray[i])
-                
-                # Calculate the mean and standard deviation
-                mean_array[i] = np.mean(np.array(values))
-                std_array[i] = np.std(np.array(values))
-            
-            metric_values[name] = [mean_array, std_array]
-
-        # Add to list of global values
-        for name in metric_values:
-            if name not in global_metric_values:
-                global_metric_values[name] = {metric: metric_values[name]}
-            else:
-                print("Adding '" + name + "' (" + metric + ")")
-                global_metric_values[name][metric] = metric_values[name]
-    
+    runs, values = load_global_metric_values(result_folder)
+
+    # Filter by valid models and ignored metrics
+    run_groups = []
+    for run in runs:
+        valid = any(model in run["model"] for model in valid_models) and run["metric"] not in ignored_metrics
+        run_groups.append(0 if valid else -1)
+
+    global_metric_values = aggregate_global_metric_values(runs, values, run_groups, 1)[0]
+    plot_global_metric_values(global_metric_values, output_path)
+
+
+def summarize_all_models(result_folder, output_folder, workers=1):
+    # Completeness over time of every model of the campaign, one figure per model. All metric files are read once and
+    # the averages of all models are computed together, only the figures are drawn by the worker processes.
+    runs, values = load_global_metric_values(result_folder)
+    models = sorted(set(run["model"] for run in runs))
+    run_groups = [models.index(run["model"]) for run in runs]
+    model_values = aggregate_global_metric_values(runs, values, run_groups, len(models))
+
+    os.makedirs(output_folder, exist_ok=True)
+    output_paths = [output_folder + "/" + model + ".png" for model in models]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(plot_global_metric_values, model_values, output_paths, repeat(False)))
+    else:
+        list(map(plot_global_metric_values, model_values, output_paths, repeat(False)))
+
+
+def plot_global_metric_values(global_metric_values, output_path, verbose=True):
+    # Plot the averaged completeness of all metrics over the number of images
+    from matplotlib import pyplot as plt
     our_metrics = ["RQF", "RQF V15", "Distance To Edge", "Normalized Density", "Coverage", "Initial Coverage", "Relative Coverage",  "Relative Density"]
     
     # Get an order for plotting (based on the end value)
@@ -170,7 +160,8 @@ def summarize_simulation_global_metrics(result_folder, output_path):
                 images = global_metric_values["Images"][local_metric][i]
                 
                 
-        print("Plotting", local_metric)
+        if verbose:
+            print("Plotting", local_metric)
         
         color = colors[metric_counter % len(colors)]
         if local_metric in our_metrics:
@@ -210,3 +201,4 @@ def summarize_simulation_global_metrics(result_folder, output_path):
     
     #plt.show()
     plt.savefig(output_path)
+    plt.close()
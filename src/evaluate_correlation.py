@@ -1,47 +1,39 @@
 import os
-from matplotlib import pyplot as plt
-import matplotlib
-from glob import glob
 import numpy as np
-from plyfile import PlyData, PlyElement, PlyProperty
-from tqdm import tqdm
-from scipy.stats import spearmanr
-from sklearn.manifold import MDS
-from matplotlib.colors import LinearSegmentedColormap, ListedColormap
-from adjustText import adjust_text
 import random
+import tempfile
 
-def get_metric_names(dense_cloud_path, ignore=None):
+from src.rank_correlation import calculate_spearman_correlation
+from src.mds_embedding import load_or_calculate_mds_embedding
+from src.cloud_store import list_dense_clouds, get_cloud_columns, get_cloud_point_count, read_cloud_columns
+
+# Properties of the dense clouds that are not correlated
+CORRELATION_IGNORE_LIST = ["view_id", "Depth_Map_Uncertainty", "Brightness_Index", "Distance_To_Vertices", "TSDF_Value", "Viewplanability", "Output", "confidence"]
+
+def get_metric_names(property_names, ignore=None):
     # Init the output list
     metric_names = []
 
-    # Load the dense cloud
-    pcl = PlyData.read(os.path.abspath(dense_cloud_path))
-
-    # Loop over all properties of the vertex element
-    for elem in pcl.elements:
-        elem : PlyElement
-        # Skip if the element is not
-        if elem.name != "vertex":
+    for name in property_names:
+        # Skip xyz, rgb and normal
+        if name in ["x", "y", "z", "red", "green", "blue", "nx", "ny", "nz", "confidence", "view_id"]:
             continue
 
-        for prop in elem.properties:
-            prop : PlyProperty
-
-            # Skip xyz, rgb and normal
-            if prop.name in ["x", "y", "z", "red", "green", "blue", "nx", "ny", "nz", "confidence", "view_id"]:
-                continue
-
-            if ignore is not None and prop.name in ignore:
-                continue
+        if ignore is not None and name in ignore:
+            continue
 
-            metric_names.append(prop.name)
+        metric_names.append(name)
 
     return metric_names
 
-# Load the metrics from a set of dense clouds into a large vector of values
-def load_metric_values(result_folder, maximum_number_of_files=-1):
-    dense_clouds = glob(result_folder + "/000_Results/DenseClouds/*/*.ply")
+# Load the metrics from a set of dense clouds into a large matrix of the size (#points, #metrics). The point counts are
+# read up front, so the matrix is allocated once and filled cloud by cloud. The matrix is stored column major, which
+# keeps the values of every metric contiguous. Passing a matrix path creates it as memory mapped .npy file on disk.
+def load_metric_values(result_folder, maximum_number_of_files=-1, dtype=np.float32, matrix_path=None):
+    from tqdm import tqdm
+
+    # Converted clouds are read from the cloud store, all others from their ply file
+    dense_clouds = list_dense_clouds(result_folder)
 
     # Limit the number of files (for testing)
     if maximum_number_of_files != -1:
@@ -49,62 +41,64 @@ def load_metric_values(result_folder, maximum_number_of_files=-1):
         dense_clouds = dense_clouds[:maximum_number_of_files]
 
     # Get the metric names
-    metric_names = get_metric_names(dense_clouds[0], ignore=["view_id", "Depth_Map_Uncertainty", "Brightness_Index", "Distance_To_Vertices", "TSDF_Value", "Viewplanability", "Output", "confidence"])
+    metric_names = get_metric_names(get_cloud_columns(dense_clouds[0]), ignore=CORRELATION_IGNORE_LIST)
     #metric_names = get_metric_names(dense_clouds[0])
     #metric_names = metric_names[:5]
 
-    # Store all values in a dict (with the metric name as key)
-    metric_dict = {}
+    # First pass: count the points of all clouds
+    number_of_points = 0
     for dense in dense_clouds:
-        # Try loading the point clouds
-        pcl = PlyData.read(os.path.abspath(dense))
-
-        # Extract the metrics
-        for metric in metric_names:
-            metric_values = pcl.elements[0].data[metric]
-
-            if metric not in metric_dict:
-                metric_dict[metric] = np.array(metric_values)
-            else:
-                metric_dict[metric] = np.hstack([metric_dict[metric], metric_values])
-
-    print("Loaded", metric_dict[metric_names[0]].shape[0], "points for", len(metric_names), "different metrics")
-    return metric_dict
-
-def calculate_correlation_matrix(metric_dict):
+        number_of_points += get_cloud_point_count(dense)
+
+    if matrix_path is None:
+        data_matrix = np.empty((number_of_points, len(metric_names)), dtype=dtype, order="F")
+    else:
+        data_matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=dtype, shape=(number_of_points, len(metric_names)), fortran_order=True)
+
+    # Second pass: copy the metric columns of every cloud into its rows of the matrix
+    row = 0
+    for dense in tqdm(dense_clouds, desc="Loading dense clouds"):
+        columns = read_cloud_columns(dense, metric_names)
+        count = len(columns[metric_names[0]])
+        for i in range(len(metric_names)):
+            data_matrix[row:row + count, i] = columns[metric_names[i]]
+        row += count
+
+    print("Loaded", number_of_points, "points for", len(metric_names), "different metrics")
+    return metric_names, data_matrix
+
+def calculate_correlation_matrix(data_matrix, mode="exact", work_folder=None):
     print("Calculating correlation matrix..")
 
-    # Extract the metric names into an array
-    metric_names = []
-    for name in metric_dict:
-        metric_names.append(name)
-
-    # Put all metrics into a large matrix of the size (#points, #variables)
-    data_matrix = np.zeros((metric_dict[metric_names[0]].shape[0], len(metric_names)))
-    for i in range(len(metric_names)):
-        data_matrix[:, i] = metric_dict[metric_names[i]]
-
-    # Calculate spearman correlation
-    correlation, p_value = spearmanr(data_matrix)
+    # Calculate spearman correlation in chunks, the matrix does not need to fit into memory
+    correlation, error_bound = calculate_spearman_correlation(data_matrix, mode, work_folder=work_folder)
+    if mode == "approximate":
+        print("Maximum error of the approximated correlation coefficients:", round(error_bound, 5))
 
     # Return the correlation
     return correlation
 
 
-def visualize_using_mds(metric_dict, correlation, output_path):
-    print("Visualizing metrics using multi dimensional scaling (MDS)..")
-
-    # Extract the metric names into an array
-    metric_names = []
-    for name in metric_dict:
-        metric_names.append(name.replace("_"," ").replace("Brightness Index", "Gray Index"))
-
+def calculate_metric_embedding(correlation, cache_folder=None):
     # Convert to dissimilarity matrix
     dissimilarity_mat = 1.0 - np.abs(correlation)
 
-    # Create an MDS object
-    mds = MDS(n_components=2, metric=True, dissimilarity="precomputed", max_iter=10000, n_init=1000, random_state=1)
-    embeddings = mds.fit_transform(dissimilarity_mat)
+    # Embed the metrics in 2D (the embedding is cached, so redrawing the figure does not recompute it)
+    return load_or_calculate_mds_embedding(dissimilarity_mat, cache_folder, n_init=1000, max_iter=10000, random_state=1)
+
+
+def visualize_using_mds(metric_names, correlation, output_path, cache_folder=None, embeddings=None):
+    from matplotlib import pyplot as plt
+    from matplotlib.colors import ListedColormap
+    from adjustText import adjust_text
+    print("Visualizing metrics using multi dimensional scaling (MDS)..")
+
+    # Format the metric names for display
+    metric_names = [name.replace("_"," ").replace("Brightness Index", "Gray Index") for name in metric_names]
+
+    # Embed the metrics unless the embedding was computed before
+    if embeddings is None:
+        embeddings = calculate_metric_embedding(correlation, cache_folder)
 
     # Create a new figure
     #fig = plt.figure(figsize=(8,6), dpi=200)
@@ -169,8 +163,19 @@ def visualize_using_mds(metric_dict, correlation, output_path):
 
 
 
-def create_correlation_plot(folder, output_path):
+def calculate_campaign_correlation(folder, mode="exact"):
+    # The values of all dense clouds are collected in a matrix on disk, so the correlation covers the whole campaign
+    cache_folder = folder + "/003_Cache"
+    os.makedirs(cache_folder, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="correlation_", dir=cache_folder) as work_folder:
+        metric_names, data_matrix = load_metric_values(folder, matrix_path=work_folder + "/metric_values.npy")
+        correlation = calculate_correlation_matrix(data_matrix, mode, work_folder)
+        del data_matrix
+    return metric_names, correlation
+
+
+def create_correlation_plot(folder, output_path, mode="exact"):
+    metric_names, correlation = calculate_campaign_correlation(folder, mode)
+
     # Use multi dimensional scaling to visualize the metrics similarity
-    metric_dict = load_metric_values(folder, 50)
-    correlation = calculate_correlation_matrix(metric_dict)
-    visualize_using_mds(metric_dict, correlation, output_path)
+    visualize_using_mds(metric_names, correlation, output_path, folder + "/003_Cache")
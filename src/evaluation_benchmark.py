@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import time
+import shutil
+import subprocess
+import tracemalloc
+import multiprocessing
+from glob import glob
+
+from src.synthetic_results import generate_synthetic_results
+from src.results_catalog import update_results_catalog
+
+
+def stage_time_dependent(folder, output_folder, state):
+    from src.time_dependent_behaviour import plot_metrics_over_time_with_averaging
+    plot_metrics_over_time_with_averaging(folder, output_folder + "/time_dependent_behaviour.png")
+
+
+def stage_load_metric_values(folder, output_folder, state):
+    from src.evaluate_correlation import load_metric_values
+    state["metric_names"], state["data_matrix"] = load_metric_values(folder)
+
+
+def stage_correlation_matrix(folder, output_folder, state):
+    from src.evaluate_correlation import calculate_correlation_matrix
+    state["correlation"] = calculate_correlation_matrix(state["data_matrix"])
+
+
+def stage_approximate_correlation_matrix(folder, output_folder, state):
+    from src.evaluate_correlation import calculate_correlation_matrix
+    state["correlation"] = calculate_correlation_matrix(state["data_matrix"], "approximate")
+
+
+def stage_mds(folder, output_folder, state):
+    from src.evaluate_correlation import visualize_using_mds
+    visualize_using_mds(state["metric_names"], state["correlation"], output_folder + "/mds_plot.png")
+
+
+def stage_metric_runtime(folder, output_folder, state):
+    from src.metric_runtime_table import evaluate_average_metric_runtime
+    evaluate_average_metric_runtime(folder, output_folder + "/metric_runtime.csv")
+
+
+def stage_runtime_report(folder, output_folder, state):
+    from src.runtime_analytics import write_runtime_report
+    write_runtime_report([folder], output_folder)
+
+
+def stage_completeness(folder, output_folder, state):
+    from src.completeness_over_time import summarize_simulation_global_metrics
+    summarize_simulation_global_metrics(folder, output_folder + "/completeness_single_model.png")
+
+
+def stage_completeness_per_model(folder, output_folder, state):
+    from src.completeness_over_time import summarize_all_models
+    summarize_all_models(folder, output_folder + "/completeness_per_model")
+
+
+def stage_alpha_completeness(folder, output_folder, state):
+    from src.alpha_completeness import plot_joint_alpha_completeness
+    plot_joint_alpha_completeness(folder, output_folder + "/alpha_completeness_plot.png")
+
+
+def stage_alpha_completeness_sweep(folder, output_folder, state):
+    from src.alpha_completeness import plot_alpha_completeness_sweep
+    plot_alpha_completeness_sweep(folder, output_folder + "/alpha_completeness_sweep.png")
+
+
+def stage_bootstrap_statistics(folder, output_folder, state):
+    from src.bootstrap_statistics import plot_bootstrap_statistics
+    plot_bootstrap_statistics(folder, output_folder)
+
+
+def import_evaluators():
+    # The evaluators import plotting and statistics libraries only when a stage needs them
+    import matplotlib.pyplot
+    import scipy.stats
+    import tqdm
+    import adjustText
+    import src.time_dependent_behaviour
+    import src.evaluate_correlation
+    import src.metric_runtime_table
+    import src.runtime_analytics
+    import src.completeness_over_time
+    import src.alpha_completeness
+    import src.bootstrap_statistics
+
+
+# All benchmarked stages with the stages whose results they need
+STAGES = {"time_dependent": [stage_time_dependent, []],
+          "load_metric_values": [stage_load_metric_values, []],
+          "calculate_correlation_matrix": [stage_correlation_matrix, ["load_metric_values"]],
+          "approximate_correlation_matrix": [stage_approximate_correlation_matrix, ["load_metric_values"]],
+          "visualize_using_mds": [stage_mds, ["load_metric_values", "calculate_correlation_matrix"]],
+          "metric_runtime": [stage_metric_runtime, []],
+          "runtime_report": [stage_runtime_report, []],
+          "completeness": [stage_completeness, []],
+          "completeness_per_model": [stage_completeness_per_model, []],
+          "alpha_completeness": [stage_alpha_completeness, []],
+          "alpha_completeness_sweep": [stage_alpha_completeness_sweep, []],
+          "bootstrap_statistics": [stage_bootstrap_statistics, []]}
+
+
+# Modules that are imported when a command line tool starts and libraries that must only be imported by the stages that
+# use them, as loading them takes seconds
+STARTUP_MODULES = ["src.evaluation_pipeline", "src.rank_correlation", "src.runtime_analytics", "src.metric_runtime_table",
+                   "src.alpha_completeness", "src.completeness_over_time", "src.bootstrap_statistics",
+                   "src.evaluate_correlation", "src.time_dependent_behaviour", "src.campaign_comparison",
+                   "src.simulation_scheduler", "src.cloud_store", "src.results_catalog", "src.live_evaluation"]
+HEAVY_MODULES = ["matplotlib", "scipy", "sklearn", "tqdm", "adjustText", "plyfile"]
+
+IMPORT_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": [name for name in {heavy} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module, repetitions=5):
+    # Import time of a module in fresh interpreters (the fastest of some repetitions, the first one also compiles the
+    # module) and the heavy libraries it loads
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = IMPORT_SCRIPT.format(module=module, heavy=repr(HEAVY_MODULES))
+    result = None
+    for _ in range(repetitions):
+        process = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=root)
+        if process.returncode != 0:
+            return {"error": process.stderr.strip().split("\n")[-1]}
+        measured = json.loads(process.stdout.strip().split("\n")[-1])
+        if result is None or measured["seconds"] < result["seconds"]:
+            result = measured
+    return result
+
+
+def run_import_benchmarks(history_path, maximum_seconds):
+    # Measure the import time of every startup module, append it to the history and return the modules that load a
+    # heavy library or take longer than the maximum
+    revision = get_git_revision()
+    results = []
+    violations = []
+    for module in STARTUP_MODULES:
+        result = measure_import(module)
+        result.update({"stage": "import:" + module, "scale": "startup", "revision": revision, "timestamp": time.time()})
+        results.append(result)
+
+        if "error" in result:
+            print(module.ljust(40), "failed:", result["error"])
+            violations.append(module)
+            continue
+
+        print(module.ljust(40), str(round(1000 * result["seconds"], 1)).rjust(10), "ms", " ".join(result["heavy"]))
+        if len(result["heavy"]) > 0 or result["seconds"] > maximum_seconds:
+            violations.append(module)
+
+    with open(history_path, "a") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+    return violations
+
+
+def parse_scale(scale):
+    # Scales are given as "{models}x{clouds per run}x{points per cloud}"
+    models, clouds, points = scale.split("x")
+    return int(models), int(clouds), int(points)
+
+
+def prepare_dataset(work_folder, scale):
+    # Generate the synthetic dataset of a scale once and reuse it for later benchmarks
+    models, clouds, points = parse_scale(scale)
+    folder = work_folder + "/dataset_" + scale
+    if not os.path.exists(folder + "/complete"):
+        print("Generating dataset", scale, "..")
+        generate_synthetic_results(folder, number_of_models=models, clouds_per_run=clouds, points_per_cloud=points,
+                                   workers=os.cpu_count())
+        open(folder + "/complete", "w").close()
+
+    # The results catalog is filled by the runner as runs finish, so it is part of the dataset and not of the measurement
+    update_results_catalog(folder)
+    return folder
+
+
+def remove_derived_files(folder):
+    # Remove the sidecars and caches the evaluation writes into the dataset, so every measurement starts cold
+    shutil.rmtree(folder + "/003_Cache", ignore_errors=True)
+    for path in glob(folder + "/000_Results/DenseClouds/*/*.pooled.json"):
+        os.remove(path)
+
+
+def measure_stage(stage_name, folder, output_folder, trace_memory, connection):
+    # Runs in a fresh process, so no stage profits from data cached by an earlier one
+    os.environ["MPLBACKEND"] = "Agg"
+    state = {}
+    try:
+        # Module imports are not part of the measurement
+        import_evaluators()
+
+        for prerequisite in STAGES[stage_name][1]:
+            STAGES[prerequisite][0](folder, output_folder, state)
+        remove_derived_files(folder)
+
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        STAGES[stage_name][0](folder, output_folder, state)
+        seconds = time.perf_counter() - start
+
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            connection.send({"peak_mb": peak / 1024 ** 2})
+        else:
+            connection.send({"seconds": seconds})
+    except Exception as e:
+        connection.send({"error": type(e).__name__ + ": " + str(e)})
+
+
+def run_stage(stage_name, folder, output_folder):
+    # Tracing allocations slows down allocation heavy code considerably, so the wall time and the peak memory are
+    # measured in two separate runs
+    result = {}
+    context = multiprocessing.get_context("spawn")
+    for trace_memory in [False, True]:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=measure_stage, args=(stage_name, folder, output_folder, trace_memory, sender))
+        process.start()
+        # Only the child may hold the sending end, otherwise a crashed child leaves the receiver waiting forever
+        sender.close()
+        try:
+            result.update(receiver.recv())
+        except EOFError:
+            pass
+        receiver.close()
+        process.join()
+        if process.exitcode != 0 and "error" not in result:
+            result["error"] = "Stage process exited with code " + str(process.exitcode)
+        if "error" in result:
+            break
+    return result
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_benchmarks(work_folder, scales, stages, history_path):
+    # Measure wall time and peak memory of every stage at every scale and append them to the history
+    os.makedirs(work_folder, exist_ok=True)
+    revision = get_git_revision()
+
+    results = []
+    for scale in scales:
+        folder = prepare_dataset(work_folder, scale)
+        output_folder = work_folder + "/figures_" + scale
+        os.makedirs(output_folder, exist_ok=True)
+
+        for stage_name in stages:
+            result = run_stage(stage_name, folder, output_folder)
+            result.update({"stage": stage_name, "scale": scale, "revision": revision, "timestamp": time.time()})
+            results.append(result)
+
+            if "error" in result:
+                print(stage_name.ljust(30), scale.ljust(20), "failed:", result["error"])
+            else:
+                print(stage_name.ljust(30), scale.ljust(20), str(round(result["seconds"], 3)).rjust(10), "s",
+                      str(round(result["peak_mb"], 1)).rjust(10), "MB")
+
+    with open(history_path, "a") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+    return results
+
+
+def save_baseline(results, baseline_path):
+    baseline = {}
+    for result in results:
+        if "error" not in result:
+            baseline[result["stage"] + "|" + result["scale"]] = result
+    with open(baseline_path, "w") as f:
+        json.dump(baseline, f, indent=1)
+
+
+def find_regressions(results, baseline_path, tolerance):
+    # A stage regressed if it got slower or needs more memory than the baseline by more than the tolerance. Tiny absolute
+    # differences are ignored, as they are dominated by measurement noise.
+    minimum_difference = {"seconds": 0.05, "peak_mb": 1.0}
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for result in results:
+        key = result["stage"] + "|" + result["scale"]
+        if key not in baseline or "error" in result:
+            continue
+
+        for measure in ["seconds", "peak_mb"]:
+            difference = result[measure] - baseline[key][measure]
+            if result[measure] > baseline[key][measure] * (1.0 + tolerance) and difference > minimum_difference[measure]:
+                regressions.append([key, measure, baseline[key][measure], result[measure]])
+                print("Regression:", key, measure, round(baseline[key][measure], 3), "->", round(result[measure], 3))
+
+    return regressions
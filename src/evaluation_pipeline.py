@@ -0,0 +1,340 @@
+import os
+import ast
+import json
+import shutil
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from src.results_catalog import update_results_catalog, connect_catalog, get_catalog_path
+from src.cloud_store import list_dense_clouds
+from src.pooled_stats import get_cloud_identity
+from src.file_lock import get_node_name
+
+# The evaluation as a graph of stages. The inputs of the campaign are described first: the result files of every kind
+# by the size and modification time the results catalog stores for them and the dense clouds by the identity of their
+# files. The key of a stage is a hash of the inputs it reads, its parameters, the source code of its modules (and of all
+# src modules they import) and the keys of the stages it needs, so a stage is only computed again if one of them changed. The results of a stage are
+# stored in 003_Cache/evaluation/{stage}/{key} and copied into the figure folder, stale stages whose dependencies are
+# done are run in parallel by a pool of processes.
+
+# Number of older results that are kept per stage besides the current one
+KEPT_VERSIONS = 2
+
+SOURCE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def stage_time_dependent(folder, stage_folder, inputs, parameters):
+    from src.time_dependent_behaviour import plot_metrics_over_time_with_averaging
+    plot_metrics_over_time_with_averaging(folder, stage_folder + "/time_dependent_behaviour.png", workers=parameters["workers"])
+
+
+def stage_correlate(folder, stage_folder, inputs, parameters):
+    from src.evaluate_correlation import calculate_campaign_correlation
+    metric_names, correlation = calculate_campaign_correlation(folder, parameters["correlation_mode"])
+    np.savez(stage_folder + "/correlation.npz", metric_names=np.array(metric_names), correlation=correlation)
+
+
+def stage_embed(folder, stage_folder, inputs, parameters):
+    from src.evaluate_correlation import calculate_metric_embedding
+    with np.load(inputs["correlate"] + "/correlation.npz") as data:
+        np.save(stage_folder + "/embedding.npy", calculate_metric_embedding(data["correlation"]))
+
+
+def stage_mds_plot(folder, stage_folder, inputs, parameters):
+    from src.evaluate_correlation import visualize_using_mds
+    with np.load(inputs["correlate"] + "/correlation.npz") as data:
+        metric_names, correlation = [str(name) for name in data["metric_names"]], data["correlation"]
+    visualize_using_mds(metric_names, correlation, stage_folder + "/mds_plot.png", embeddings=np.load(inputs["embed"] + "/embedding.npy"))
+
+
+def stage_metric_runtime(folder, stage_folder, inputs, parameters):
+    from src.metric_runtime_table import evaluate_average_metric_runtime
+    evaluate_average_metric_runtime(folder, stage_folder + "/metric_runtime.csv")
+
+
+def stage_runtime_report(folder, stage_folder, inputs, parameters):
+    from src.runtime_analytics import write_runtime_report
+    write_runtime_report([folder], stage_folder)
+
+
+def stage_completeness(folder, stage_folder, inputs, parameters):
+    from src.completeness_over_time import summarize_simulation_global_metrics
+    summarize_simulation_global_metrics(folder, stage_folder + "/completeness_single_model.png")
+
+
+def stage_completeness_per_model(folder, stage_folder, inputs, parameters):
+    from src.completeness_over_time import summarize_all_models
+    summarize_all_models(folder, stage_folder + "/completeness_per_model", parameters["workers"])
+
+
+def stage_alpha_completeness(folder, stage_folder, inputs, parameters):
+    from src.alpha_completeness import plot_joint_alpha_completeness
+    plot_joint_alpha_completeness(folder, stage_folder + "/alpha_completeness_plot.png")
+
+
+def stage_alpha_completeness_sweep(folder, stage_folder, inputs, parameters):
+    from src.alpha_completeness import plot_alpha_completeness_sweep
+    plot_alpha_completeness_sweep(folder, stage_folder + "/alpha_completeness_sweep.png")
+
+
+def stage_bootstrap_statistics(folder, stage_folder, inputs, parameters):
+    from src.bootstrap_statistics import plot_bootstrap_statistics
+    plot_bootstrap_statistics(folder, stage_folder, parameters["bootstrap_samples"], parameters["workers"])
+
+
+# All stages with the inputs of the campaign they read ("clouds" or a result kind), the parameters and source modules
+# their results depend on (the keys also cover all src modules these import), the stages they need and the files they
+# add to the figure folder. Stages are listed after the stages they need. The number of workers is no parameter, as the
+# results do not depend on it.
+STAGES = {"time_dependent": {"function": stage_time_dependent, "sources": ["clouds", "Termination"], "parameters": [],
+                             "modules": ["time_dependent_behaviour", "pooled_stats"], "after": [],
+                             "outputs": ["time_dependent_behaviour.png"]},
+          "correlate": {"function": stage_correlate, "sources": ["clouds"], "parameters": ["correlation_mode"],
+                        "modules": ["evaluate_correlation", "rank_correlation"], "after": [], "outputs": []},
+          "embed": {"function": stage_embed, "sources": [], "parameters": [],
+                    "modules": ["evaluate_correlation", "mds_embedding"], "after": ["correlate"], "outputs": []},
+          "mds_plot": {"function": stage_mds_plot, "sources": [], "parameters": [],
+                       "modules": ["evaluate_correlation"], "after": ["correlate", "embed"], "outputs": ["mds_plot.png"]},
+          "metric_runtime": {"function": stage_metric_runtime, "sources": ["MetricRuntime"], "parameters": [],
+                             "modules": ["metric_runtime_table"], "after": [], "outputs": ["metric_runtime.csv"]},
+          "runtime_report": {"function": stage_runtime_report, "sources": ["Metrics", "Runtime", "MetricRuntime"], "parameters": [],
+                             "modules": ["runtime_analytics"], "after": [],
+                             "outputs": ["runtime_percentiles.csv", "runtime_scaling.csv", "runtime_scaling.png"]},
+          "completeness": {"function": stage_completeness, "sources": ["Metrics"], "parameters": [],
+                           "modules": ["completeness_over_time"], "after": [], "outputs": ["completeness_single_model.png"]},
+          "completeness_per_model": {"function": stage_completeness_per_model, "sources": ["Metrics"], "parameters": [],
+                                     "modules": ["completeness_over_time"], "after": [], "outputs": ["completeness_per_model"]},
+          "alpha_completeness": {"function": stage_alpha_completeness, "sources": ["Metrics"], "parameters": [],
+                                 "modules": ["alpha_completeness"], "after": [], "outputs": ["alpha_completeness_plot.png"]},
+          "alpha_completeness_sweep": {"function": stage_alpha_completeness_sweep, "sources": ["Metrics"], "parameters": [],
+                                       "modules": ["alpha_completeness"], "after": [], "outputs": ["alpha_completeness_sweep.png"]},
+          "bootstrap_statistics": {"function": stage_bootstrap_statistics, "sources": ["Metrics"], "parameters": ["bootstrap_samples"],
+                                   "modules": ["bootstrap_statistics", "alpha_completeness"], "after": [],
+                                   "outputs": ["alpha_completeness_bootstrap.png", "completeness_bootstrap.png",
+                                               "completeness_significance.csv"]}}
+
+
+# Stages that are brought up to date by the evaluation commands of the command line interface
+COMMAND_STAGES = {"evaluate": list(STAGES.keys()),
+                  "runtime": ["metric_runtime", "runtime_report"],
+                  "alpha": ["alpha_completeness", "alpha_completeness_sweep"],
+                  "completeness": ["completeness", "completeness_per_model", "bootstrap_statistics"],
+                  "correlation": ["mds_plot"],
+                  "time-dependent": ["time_dependent"]}
+
+
+def get_stage_folder(project_folder, stage_name, key):
+    return project_folder + "/003_Cache/evaluation/" + stage_name + "/" + key
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def hash_module(module_name):
+    with open(SOURCE_FOLDER + "/" + module_name + ".py", "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def find_imported_modules(module_name):
+    # Names of the src modules a module imports, including the imports within its functions
+    with open(SOURCE_FOLDER + "/" + module_name + ".py", "r") as f:
+        tree = ast.parse(f.read())
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name[4:] for alias in node.names if alias.name.startswith("src."))
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+            if node.module == "src":
+                names.update(alias.name for alias in node.names)
+            elif node.module.startswith("src."):
+                names.add(node.module[4:])
+    return names
+
+
+def get_module_closure(module_names):
+    # The modules and all src modules they import directly or indirectly, sorted by name
+    closure = set()
+    pending = list(module_names)
+    while len(pending) > 0:
+        name = pending.pop()
+        if name in closure or not os.path.exists(SOURCE_FOLDER + "/" + name + ".py"):
+            continue
+        closure.add(name)
+        pending.extend(find_imported_modules(name))
+    return sorted(closure)
+
+
+def describe_results(project_folder, kind):
+    # Hash of the runs and the file identities of all result files of a kind in the catalog
+    connection = connect_catalog(project_folder)
+    try:
+        rows = connection.execute("SELECT runs.run_name, runs.model, runs.metric, runs.repetition, files.size, files.mtime_ns "
+                                  "FROM files JOIN runs USING (run_id) WHERE files.kind = ? ORDER BY runs.run_name", (kind,)).fetchall()
+    finally:
+        connection.close()
+    return hash_text(json.dumps(rows))
+
+
+def describe_clouds(project_folder):
+    # Hash of the listed dense clouds and the identities of the files they are read from
+    description = []
+    for cloud in list_dense_clouds(project_folder):
+        identity = get_cloud_identity(cloud)
+        description.append([cloud["run_name"], cloud["model"], cloud["metric"], cloud["repetition"], cloud["images"],
+                            cloud["format"], identity["size"], identity["mtime_ns"]])
+    return hash_text(json.dumps(description))
+
+
+def select_stages(stage_names=None):
+    # The requested stages together with all stages they need, in the order of STAGES
+    if stage_names is None:
+        return list(STAGES.keys())
+    selected = set()
+    pending = list(stage_names)
+    while len(pending) > 0:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(STAGES[name]["after"])
+    return [name for name in STAGES if name in selected]
+
+
+def calculate_stage_keys(project_folder, stage_names, parameters):
+    # Describe the inputs the stages read and derive the key of every stage from them
+    update_results_catalog(project_folder)
+    sources = set(source for name in stage_names for source in STAGES[name]["sources"])
+    descriptions = {}
+    for source in sorted(sources):
+        if source == "clouds":
+            descriptions[source] = describe_clouds(project_folder)
+        elif os.path.exists(get_catalog_path(project_folder)):
+            descriptions[source] = describe_results(project_folder, source)
+        else:
+            descriptions[source] = None
+
+    # A stage depends on its modules and on all src modules these import directly or indirectly
+    pipeline_hash = hash_module("evaluation_pipeline")
+    module_hashes = {}
+    keys = {}
+    for name in stage_names:
+        stage = STAGES[name]
+        modules = get_module_closure(stage["modules"])
+        for module in modules:
+            if module not in module_hashes:
+                module_hashes[module] = hash_module(module)
+        keys[name] = hash_text(json.dumps({"stage": name, "pipeline": pipeline_hash,
+                                           "sources": [descriptions[source] for source in stage["sources"]],
+                                           "parameters": {key: parameters[key] for key in stage["parameters"]},
+                                           "modules": {module: module_hashes[module] for module in modules},
+                                           "after": [keys[dependency] for dependency in stage["after"]]}))
+    return keys
+
+
+def run_stage(stage_name, project_folder, stage_folder, inputs, parameters, force=False):
+    # Runs in a worker process. The results are written into a temporary folder that becomes the cached result once the
+    # stage is complete, so an interrupted stage never counts as done. With force an existing result is replaced.
+    os.environ["MPLBACKEND"] = "Agg"
+    temporary = stage_folder + "." + get_node_name() + ".tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    try:
+        STAGES[stage_name]["function"](project_folder, temporary, inputs, parameters)
+    finally:
+        from matplotlib import pyplot as plt
+        plt.close("all")
+
+    if force and os.path.exists(stage_folder):
+        # A folder can only be renamed onto a missing or empty one, so the old result is moved aside first
+        previous = stage_folder + "." + get_node_name() + ".old.tmp"
+        shutil.rmtree(previous, ignore_errors=True)
+        os.replace(stage_folder, previous)
+        os.replace(temporary, stage_folder)
+        shutil.rmtree(previous, ignore_errors=True)
+        return
+
+    try:
+        os.replace(temporary, stage_folder)
+    except OSError:
+        shutil.rmtree(temporary, ignore_errors=True)
+        # Another evaluation of the same campaign stored the stage in the meantime
+        if not os.path.isdir(stage_folder):
+            raise
+
+
+def publish_stage_outputs(stage_name, stage_folder, figure_folder):
+    # Copy the results of a stage into the figure folder. Stages only write files for which the campaign has results.
+    for name in STAGES[stage_name]["outputs"]:
+        source = stage_folder + "/" + name
+        target = figure_folder + "/" + name
+        if os.path.isdir(source):
+            shutil.rmtree(target, ignore_errors=True)
+            shutil.copytree(source, target)
+        elif os.path.exists(source):
+            shutil.copy2(source, target)
+
+
+def remove_old_versions(project_folder, stage_name, key):
+    # Keep the current and the most recently used older results of a stage
+    folder = project_folder + "/003_Cache/evaluation/" + stage_name
+    versions = [entry for entry in os.scandir(folder) if entry.is_dir() and entry.name != key and not entry.name.endswith(".tmp")]
+    versions = sorted(versions, key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[KEPT_VERSIONS:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def run_evaluation(project_folder, parameters, stage_names=None, jobs=1, force=False):
+    # Bring the selected stages (all by default) up to date and copy their results into the figure folder. Returns the
+    # names of the stages that failed or could not run because a stage they need failed.
+    figure_folder = project_folder + "/001_Figures"
+    os.makedirs(figure_folder, exist_ok=True)
+
+    selected = select_stages(stage_names)
+    keys = calculate_stage_keys(project_folder, selected, parameters)
+    stage_folders = {name: get_stage_folder(project_folder, name, keys[name]) for name in selected}
+
+    pending = [name for name in selected if force or not os.path.exists(stage_folders[name])]
+    done = set(name for name in selected if name not in pending)
+    for name in selected:
+        print(("Rebuilding " if name in pending else "Up to date: ") + name)
+
+    # Start every stale stage as soon as the stages it needs are done
+    failed = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        running = {}
+        while len(pending) > 0 or len(running) > 0:
+            for name in list(pending):
+                after = STAGES[name]["after"]
+                if any(dependency in failed for dependency in after):
+                    print("Skipping", name, "as a stage it needs failed")
+                    pending.remove(name)
+                    failed.append(name)
+                elif all(dependency in done for dependency in after):
+                    os.makedirs(os.path.dirname(stage_folders[name]), exist_ok=True)
+                    inputs = {dependency: stage_folders[dependency] for dependency in after}
+                    running[executor.submit(run_stage, name, project_folder, stage_folders[name], inputs, parameters, force)] = name
+                    pending.remove(name)
+
+            if len(running) == 0:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    done.add(name)
+                except Exception as e:
+                    print("Stage", name, "failed:", repr(e))
+                    failed.append(name)
+
+    for name in selected:
+        if name in done:
+            # Mark the result as used, so it is the last one to be removed
+            os.utime(stage_folders[name])
+            publish_stage_outputs(name, stage_folders[name], figure_folder)
+            remove_old_versions(project_folder, name, keys[name])
+
+    return failed
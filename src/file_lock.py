@@ -0,0 +1,66 @@
+import os
+import time
+import socket
+from contextlib import contextmanager
+
+
+def get_node_name():
+    # Unique name of this process, also across machines that share the same file system
+    return socket.gethostname() + "-" + str(os.getpid())
+
+
+def try_create_exclusive(path, content):
+    # Atomically create a file that must not exist yet. Returns False if another process was faster.
+    try:
+        handle = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+
+    with os.fdopen(handle, "w") as f:
+        f.write(content)
+    return True
+
+
+def remove_if_stale(path, stale_after):
+    # Remove a lock or claim file whose owner stopped refreshing it. The file is first renamed to a unique name,
+    # which only one of several competing processes can succeed in.
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        return True
+
+    if age < stale_after:
+        return False
+
+    stale_path = path + ".stale." + get_node_name() + "." + str(time.time())
+    try:
+        os.rename(path, stale_path)
+    except FileNotFoundError:
+        return True
+
+    # Another process might have replaced the stale file in the meantime, give a fresh file back to its owner
+    if time.time() - os.path.getmtime(stale_path) < stale_after:
+        try:
+            os.link(stale_path, path)
+        except FileExistsError:
+            pass
+        os.remove(stale_path)
+        return False
+
+    os.remove(stale_path)
+    return True
+
+
+@contextmanager
+def file_lock(path, stale_after=60.0, poll_interval=0.05):
+    # Simple lock file that works across processes and machines on a shared file system
+    while not try_create_exclusive(path, get_node_name()):
+        if not remove_if_stale(path, stale_after):
+            time.sleep(poll_interval)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
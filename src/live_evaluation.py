@@ -0,0 +1,440 @@
+import os
+import time
+import numpy as np
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from src.results_catalog import RESULT_KINDS, read_result_file
+from src.campaign_manifest import load_manifest
+from src.run_names import split_run_name
+from src.cloud_store import list_dense_clouds, get_cloud_columns, read_cloud_columns
+from src.alpha_completeness import MAXIMUM_IMAGES, JOINT_ALPHA_VALUES, IGNORED_METRICS, calculate_run_completeness
+from src.time_dependent_behaviour import POOLING_IGNORE_LIST, pool_dense_cloud
+from src.evaluate_correlation import CORRELATION_IGNORE_LIST, get_metric_names
+from src.runtime_analytics import PERCENTILES, split_runtime_lines, write_table
+from src.mds_embedding import calculate_mds_embedding, refine_mds_embedding
+from src.file_lock import get_node_name
+
+# Evaluation of a running campaign. The result folders are polled for new, changed or removed result files (only the
+# directory entries are listed) and only those files are folded into aggregates that are kept in memory: the number of
+# complete runs per metric, alpha and image count, the sums of the pooled metric values per image count, histograms and
+# log-linear regression sums of the runtimes and joint histograms of the binned metric values of all dense clouds. A
+# changed file is first folded out with its previous content, so the cost of an update scales with the new results.
+# The affected figures are drawn again at most once per refresh interval.
+#
+# The runtime percentiles are read from histograms with 100 bins per decade. The Spearman correlation is computed from
+# the average ranks of 64 bins per metric, whose bounds are the quantiles of the first dense cloud. Dense clouds can not
+# be folded out of the joint histograms, so they are rebuilt if the results of a run that was folded in are replaced. The
+# MDS embedding is refined from the one of the previous refresh and kept in a single cache file, so a watch that is
+# started again continues from it.
+
+# Power of the Minkowski pooling of the dense clouds
+POOLING_POWER = 3
+
+# Number of bins per metric of the correlation histograms
+CORRELATION_BINS = 64
+
+# Runtime histograms cover 1 microsecond to 1 million seconds
+RUNTIME_BINS_PER_DECADE = 100
+RUNTIME_DECADES = [-6, 6]
+
+# Name of the Minkowski pooled RQF values of the termination files
+RQF_NAME = "RQF (ours)"
+
+
+def create_live_state():
+    return {"files": {}, "lines": {}, "runs": {}, "dirty": set(),
+            "alpha": {"counts": {}, "totals": {}},
+            "pooled": {"clouds": {}, "sums": {}},
+            "runtime": {"histograms": {}, "sums": {}, "maxima": {}, "fits": {}},
+            "correlation": create_correlation_state()}
+
+
+def create_correlation_state():
+    return {"runs": {}, "names": None, "cuts": None, "pairs": None, "marginal": None, "joint": None, "embedding": None}
+
+
+def scan_result_files(project_folder):
+    # Size and modification time of every result file as {(kind, run name): identity}
+    files = {}
+    for kind in RESULT_KINDS:
+        folder = project_folder + "/000_Results/" + kind
+        if not os.path.exists(folder):
+            continue
+
+        for entry in os.scandir(folder):
+            if not entry.name.endswith(".txt") or not entry.name[:3].isdigit():
+                continue
+            stat = entry.stat()
+            files[(kind, entry.name[:-4])] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def describe_run(run_name, manifest_runs):
+    if run_name in manifest_runs:
+        entry = manifest_runs[run_name]
+        return {"model": entry["model"], "metric": entry["metric"], "repetition": entry["repetition"]}
+    _, model, metric, repetition = split_run_name(run_name)
+    return {"model": model, "metric": metric, "repetition": repetition}
+
+
+def fold_alpha_completeness(state, metric, lines, sign):
+    # Add (sign 1) or remove (sign -1) a run from the number of complete runs of its metric
+    if any(ignored_name in metric for ignored_name in IGNORED_METRICS):
+        return
+
+    images = lines.get("Images", np.zeros(0)).astype(np.int64)
+    order = np.argsort(images, kind="stable")
+    run = [images[order], lines.get("Completeness [%]", np.zeros(0))[order]]
+    completeness = calculate_run_completeness([run], np.arange(MAXIMUM_IMAGES))[0]
+
+    alpha = state["alpha"]
+    if metric not in alpha["counts"]:
+        alpha["counts"][metric] = np.zeros((len(JOINT_ALPHA_VALUES), MAXIMUM_IMAGES), dtype=np.int64)
+        alpha["totals"][metric] = 0
+    alpha["counts"][metric] += sign * (completeness[None, :] > np.array(JOINT_ALPHA_VALUES)[:, None])
+    alpha["totals"][metric] += sign
+
+
+def fold_pooled_values(state, name, images, values, sign):
+    # Count, sum and sum of squares of the pooled values of a metric per number of images
+    sums = state["pooled"]["sums"].setdefault(name, {})
+    for img, value in zip(images, values):
+        if name != RQF_NAME and (value > 1 or value < 0):
+            continue
+        if img not in sums:
+            sums[img] = np.zeros(3)
+        sums[img] += sign * np.array([1.0, value, value * value])
+
+
+def get_runtime_bins(seconds):
+    logarithm = np.log10(np.maximum(seconds, 1e-300))
+    bins = np.floor((logarithm - RUNTIME_DECADES[0]) * RUNTIME_BINS_PER_DECADE).astype(np.int64)
+    return np.clip(bins, 0, (RUNTIME_DECADES[1] - RUNTIME_DECADES[0]) * RUNTIME_BINS_PER_DECADE - 1)
+
+
+def fold_runtime(state, source, run_name, lines, sign):
+    # Histogram, count, sum and the sums of the regression of log(seconds) on log(images) of every component. Maxima can
+    # not be folded out, so the maximum of every run is kept.
+    if "Images" not in lines:
+        return
+    runtime = state["runtime"]
+    number_of_bins = (RUNTIME_DECADES[1] - RUNTIME_DECADES[0]) * RUNTIME_BINS_PER_DECADE
+
+    for component, seconds in split_runtime_lines(source, lines):
+        key = (source, component)
+        images = lines["Images"][:len(seconds)]
+        valid = ~np.isnan(seconds)
+        images, seconds = images[valid], seconds[valid]
+
+        if key not in runtime["histograms"]:
+            runtime["histograms"][key] = np.zeros(number_of_bins, dtype=np.int64)
+            runtime["sums"][key] = np.zeros(2)
+            runtime["fits"][key] = np.zeros(6)
+            runtime["maxima"][key] = {}
+        np.add.at(runtime["histograms"][key], get_runtime_bins(seconds), sign)
+        runtime["sums"][key] += sign * np.array([len(seconds), np.sum(seconds)])
+        if sign < 0:
+            runtime["maxima"][key].pop(run_name, None)
+        elif len(seconds) > 0:
+            runtime["maxima"][key][run_name] = float(np.max(seconds))
+
+        positive = (seconds > 0) & (images > 0)
+        x, y = np.log(images[positive]), np.log(seconds[positive])
+        runtime["fits"][key] += sign * np.array([len(x), np.sum(x), np.sum(y), np.sum(x * x), np.sum(x * y), np.sum(y * y)])
+
+
+def fold_result_file(state, kind, run_name, lines, sign):
+    run = state["runs"][run_name]
+    if kind == "Metrics":
+        fold_alpha_completeness(state, run["metric"], lines, sign)
+        state["dirty"].add("alpha_completeness")
+    elif kind == "Termination":
+        images = [int(img) for img in lines.get("Images", [])]
+        fold_pooled_values(state, RQF_NAME, images, lines.get("Pooled Value", []), sign)
+        state["dirty"].add("time_dependent")
+    else:
+        fold_runtime(state, kind, run_name, lines, sign)
+        state["dirty"].add("runtime")
+
+
+def fold_correlation_cloud(state, cloud):
+    # Add the binned metric values of a dense cloud to the marginal and joint histograms
+    correlation = state["correlation"]
+    available = get_cloud_columns(cloud)
+    if correlation["names"] is None:
+        correlation["names"] = get_metric_names(available, ignore=CORRELATION_IGNORE_LIST)
+    names = correlation["names"]
+    if len(names) == 0 or any(name not in available for name in names):
+        print("Skipping the correlation of", cloud["path"], "as metrics are missing")
+        return
+
+    columns = read_cloud_columns(cloud, names)
+    values = np.stack([np.asarray(columns[name], dtype=np.float64) for name in names])
+    if values.shape[1] == 0:
+        return
+
+    # The bin bounds are the quantiles of the first cloud, values outside of them fall into the outer bins
+    if correlation["cuts"] is None:
+        correlation["cuts"] = np.quantile(values, np.arange(1, CORRELATION_BINS) / CORRELATION_BINS, axis=1).T
+        correlation["pairs"] = np.array([[i, j] for i in range(len(names)) for j in range(i + 1, len(names))], dtype=np.int64).reshape(-1, 2)
+        correlation["marginal"] = np.zeros((len(names), CORRELATION_BINS), dtype=np.int64)
+        correlation["joint"] = np.zeros((len(correlation["pairs"]), CORRELATION_BINS * CORRELATION_BINS), dtype=np.int64)
+
+    bins = np.stack([np.searchsorted(correlation["cuts"][i], values[i]) for i in range(len(names))])
+    for i in range(len(names)):
+        correlation["marginal"][i] += np.bincount(bins[i], minlength=CORRELATION_BINS)
+    for p in range(len(correlation["pairs"])):
+        i, j = correlation["pairs"][p]
+        correlation["joint"][p] += np.bincount(bins[i] * CORRELATION_BINS + bins[j], minlength=CORRELATION_BINS * CORRELATION_BINS)
+
+
+def calculate_histogram_correlation(marginal, joint, pairs):
+    # Spearman correlation of binned values: every value gets the average rank of its bin
+    number_of_points = np.sum(marginal[0])
+    ranks = np.cumsum(marginal, axis=1) - marginal + (marginal + 1) / 2
+    mean = (number_of_points + 1) / 2
+    variance = np.sum(marginal * ranks ** 2, axis=1) / number_of_points - mean ** 2
+
+    joint = joint.reshape(len(pairs), CORRELATION_BINS, CORRELATION_BINS)
+    covariance = np.einsum("pa,pab,pb->p", ranks[pairs[:, 0]], joint, ranks[pairs[:, 1]]) / number_of_points - mean ** 2
+
+    correlation = np.eye(len(marginal))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = covariance / np.sqrt(variance[pairs[:, 0]] * variance[pairs[:, 1]])
+    correlation[pairs[:, 0], pairs[:, 1]] = values
+    correlation[pairs[:, 1], pairs[:, 0]] = values
+    return np.nan_to_num(correlation)
+
+
+def get_cloud_identities(clouds):
+    # Number of images, size and modification time of the dense clouds of every run as {run name: identities}
+    identities = {}
+    for cloud in clouds:
+        path = cloud["path"] + (".npz" if cloud["format"] == "npz" else "")
+        identity = [cloud["images"], None, None]
+        if os.path.exists(path):
+            stat = os.stat(path)
+            identity = [cloud["images"], stat.st_size, stat.st_mtime_ns]
+        identities.setdefault(cloud["run_name"], []).append(identity)
+    return identities
+
+
+def update_live_state(project_folder, state, workers=1):
+    # Fold all result files and dense clouds that changed since the last update into the aggregates. Returns the number
+    # of result files that were folded in or out.
+    files = scan_result_files(project_folder)
+    changed = sorted((key for key in files if state["files"].get(key) != files[key]), key=lambda x: (x[1], x[0]))
+    removed = [key for key in state["files"] if key not in files]
+    if len(changed) == 0 and len(removed) == 0:
+        return 0
+
+    # Fold out the previous content of changed and removed files
+    for key in changed + removed:
+        if key in state["lines"]:
+            fold_result_file(state, key[0], key[1], state["lines"].pop(key), -1)
+        state["files"].pop(key, None)
+
+    manifest_runs = None
+    for kind, run_name in changed:
+        if run_name not in state["runs"]:
+            if manifest_runs is None:
+                manifest_runs = load_manifest(project_folder)["runs"]
+            state["runs"][run_name] = describe_run(run_name, manifest_runs)
+
+        # Files that vanish while they are read are picked up by the next update
+        try:
+            lines = dict(read_result_file(project_folder + "/000_Results/" + kind + "/" + run_name + ".txt"))
+        except OSError:
+            continue
+        fold_result_file(state, kind, run_name, lines, 1)
+        state["lines"][(kind, run_name)] = lines
+        state["files"][(kind, run_name)] = files[(kind, run_name)]
+
+    # The dense clouds of a run are complete once its metrics were harvested
+    replaced_runs = set(run_name for kind, run_name in changed + removed if kind == "Metrics")
+    for key in [key for key in state["pooled"]["clouds"] if key[0] in replaced_runs]:
+        pooled_values = state["pooled"]["clouds"].pop(key)
+        for name in pooled_values:
+            fold_pooled_values(state, name, [key[1]], [pooled_values[name]], -1)
+        state["dirty"].add("time_dependent")
+
+    pooling_runs = set(run_name for kind, run_name in changed if kind == "Metrics" and (kind, run_name) in state["files"])
+    correlation_runs = pooling_runs - set(state["correlation"]["runs"])
+
+    # Runs whose dense clouds were folded into the correlation before are only folded again if their clouds changed
+    folded_runs = replaced_runs & set(state["correlation"]["runs"])
+    if len(folded_runs) > 0:
+        identities = get_cloud_identities(list_dense_clouds(project_folder, runs=folded_runs))
+        if any(state["correlation"]["runs"][run_name] != identities.get(run_name, []) or run_name not in pooling_runs
+               for run_name in folded_runs):
+            print("Rebuilding the correlation histograms, as the dense clouds of a run were replaced")
+            state["correlation"] = create_correlation_state()
+            correlation_runs = set(run_name for kind, run_name in state["files"] if kind == "Metrics")
+            state["dirty"].add("correlation")
+
+    if len(pooling_runs | correlation_runs) > 0:
+        clouds = list_dense_clouds(project_folder, runs=pooling_runs | correlation_runs)
+        pooled_clouds = [cloud for cloud in clouds if cloud["run_name"] in pooling_runs]
+        if workers > 1 and len(pooled_clouds) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pooled = list(executor.map(pool_dense_cloud, pooled_clouds, repeat(POOLING_IGNORE_LIST), repeat(POOLING_POWER), chunksize=4))
+        else:
+            pooled = [pool_dense_cloud(cloud, POOLING_IGNORE_LIST, POOLING_POWER) for cloud in pooled_clouds]
+
+        for cloud, pooled_values in zip(pooled_clouds, pooled):
+            state["pooled"]["clouds"][(cloud["run_name"], cloud["images"])] = pooled_values
+            for name in pooled_values:
+                fold_pooled_values(state, name, [cloud["images"]], [pooled_values[name]], 1)
+            state["dirty"].add("time_dependent")
+
+        correlation_clouds = [cloud for cloud in clouds if cloud["run_name"] in correlation_runs]
+        for cloud in correlation_clouds:
+            fold_correlation_cloud(state, cloud)
+            state["dirty"].add("correlation")
+        state["correlation"]["runs"].update(get_cloud_identities(correlation_clouds))
+
+    return len(changed) + len(removed)
+
+
+def render_alpha_completeness(project_folder, state, output_folder):
+    from src.alpha_completeness import draw_joint_alpha_completeness
+    alpha = state["alpha"]
+    metric_names = [name for name in alpha["totals"] if alpha["totals"][name] > 0]
+    if len(metric_names) == 0:
+        return
+    percentage = np.stack([100 * alpha["counts"][name] / alpha["totals"][name] for name in metric_names], axis=2)
+    draw_joint_alpha_completeness(metric_names, np.arange(MAXIMUM_IMAGES), percentage, JOINT_ALPHA_VALUES,
+                                  output_folder + "/alpha_completeness_plot.png")
+
+
+def render_time_dependent(project_folder, state, output_folder):
+    from src.time_dependent_behaviour import draw_metrics_over_time
+    summaries = {}
+    names = [name for name in state["pooled"]["sums"] if name != RQF_NAME] + [RQF_NAME]
+    for name in names:
+        sums = state["pooled"]["sums"].get(name, {})
+        images = sorted(img for img in sums if sums[img][0] > 0)
+        if len(images) == 0:
+            continue
+        counts = np.array([sums[img][0] for img in images])
+        means = np.array([sums[img][1] for img in images]) / counts
+        variances = np.array([sums[img][2] for img in images]) / counts - means ** 2
+        summaries[name] = [images, list(means), list(np.sqrt(np.maximum(variances, 0)))]
+    if len(summaries) > 0:
+        draw_metrics_over_time(summaries, output_folder + "/time_dependent_behaviour.png")
+
+
+def calculate_histogram_percentiles(histogram, percentiles):
+    # Geometric center of the bin that contains every percentile
+    cumulative = np.cumsum(histogram)
+    bins = np.searchsorted(cumulative, np.asarray(percentiles) / 100 * cumulative[-1])
+    return 10 ** (RUNTIME_DECADES[0] + (bins + 0.5) / RUNTIME_BINS_PER_DECADE)
+
+
+def render_runtime(project_folder, state, output_folder):
+    runtime = state["runtime"]
+    keys = sorted((key for key in runtime["sums"] if runtime["sums"][key][0] > 0), key=lambda x: (x[0] != "MetricRuntime", x[1]))
+
+    percentile_rows = []
+    scaling_rows = []
+    for source, component in keys:
+        count, total = runtime["sums"][(source, component)]
+        row = {"source": source, "component": component, "count": int(count), "mean": total / count,
+               "max": max(runtime["maxima"][(source, component)].values(), default=np.nan)}
+        for percentile, value in zip(PERCENTILES, calculate_histogram_percentiles(runtime["histograms"][(source, component)], PERCENTILES)):
+            row["p" + str(percentile)] = float(value)
+        percentile_rows.append(row)
+
+        # Power law seconds = scale * images^b from the regression sums
+        n, sx, sy, sxx, sxy, syy = runtime["fits"][(source, component)]
+        denominator = n * sxx - sx * sx
+        if n < 3 or denominator <= 1e-9 * max(n * sxx, 1.0):
+            continue
+        exponent = (n * sxy - sx * sy) / denominator
+        total_variance = n * syy - sy * sy
+        scaling_rows.append({"source": source, "component": component, "scale": float(np.exp((sy - exponent * sx) / n)),
+                             "images_exponent": float(exponent), "count": int(n),
+                             "r2": float((n * sxy - sx * sy) ** 2 / (denominator * total_variance)) if total_variance > 0 else 1.0})
+
+    if len(percentile_rows) > 0:
+        write_table(percentile_rows, ["source", "component", "count", "mean"] + ["p" + str(p) for p in PERCENTILES] + ["max"],
+                    output_folder + "/runtime_percentiles.csv")
+        write_table(scaling_rows, ["source", "component", "scale", "images_exponent", "r2", "count"],
+                    output_folder + "/runtime_scaling.csv")
+
+
+def update_live_embedding(project_folder, dissimilarity, embedding):
+    # Refine the embedding of the previous refresh (or of the previous watch of the campaign) and store it as the only
+    # live cache entry. Only the first embedding of a campaign is searched with all restarts.
+    cache_path = project_folder + "/003_Cache/mds/live.npy"
+    if embedding is None and os.path.exists(cache_path):
+        embedding = np.load(cache_path)
+
+    if embedding is None or embedding.shape[0] != dissimilarity.shape[0]:
+        embedding, _ = calculate_mds_embedding(dissimilarity, n_init=1000, max_iter=10000, random_state=1)
+    else:
+        embedding = refine_mds_embedding(dissimilarity, embedding)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temporary = cache_path + "." + get_node_name() + ".tmp.npy"
+    np.save(temporary, embedding)
+    os.replace(temporary, cache_path)
+    return embedding
+
+
+def render_correlation(project_folder, state, output_folder):
+    from src.evaluate_correlation import visualize_using_mds
+    correlation = state["correlation"]
+    if correlation["marginal"] is None or len(correlation["names"]) < 2:
+        return
+    matrix = calculate_histogram_correlation(correlation["marginal"], correlation["joint"], correlation["pairs"])
+    correlation["embedding"] = update_live_embedding(project_folder, 1.0 - np.abs(matrix), correlation["embedding"])
+    visualize_using_mds(correlation["names"], matrix, output_folder + "/mds_plot.png", embeddings=correlation["embedding"])
+
+
+RENDERERS = {"alpha_completeness": render_alpha_completeness, "time_dependent": render_time_dependent,
+             "runtime": render_runtime, "correlation": render_correlation}
+
+
+def render_live_figures(project_folder, state, figure_names, output_folder):
+    from matplotlib import pyplot as plt
+    for name in figure_names:
+        start = time.perf_counter()
+        RENDERERS[name](project_folder, state, output_folder)
+        plt.close("all")
+        state["dirty"].discard(name)
+        print("Updated", name, "in", round(time.perf_counter() - start, 3), "s")
+
+
+def watch_campaign(project_folder, poll_interval=10.0, refresh_interval=60.0, workers=1, once=False):
+    # Keep the figures of a running campaign in 001_Figures/live up to date until interrupted. With once, the results
+    # are folded in and drawn a single time.
+    os.environ["MPLBACKEND"] = "Agg"
+    output_folder = project_folder + "/001_Figures/live"
+    os.makedirs(output_folder, exist_ok=True)
+
+    state = create_live_state()
+    last_render = {}
+    try:
+        while True:
+            start = time.perf_counter()
+            folded = update_live_state(project_folder, state, workers)
+            if folded > 0:
+                print("Folded", folded, "result files in", round(time.perf_counter() - start, 3), "s")
+
+            # Every figure is drawn at most once per refresh interval
+            now = time.time()
+            due = [name for name in RENDERERS if name in state["dirty"] and (once or now - last_render.get(name, -np.inf) >= refresh_interval)]
+            render_live_figures(project_folder, state, due, output_folder)
+            last_render.update((name, now) for name in due)
+
+            if once:
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        # Figures that were held back by the refresh interval are drawn with the last folded results
+        render_live_figures(project_folder, state, [name for name in RENDERERS if name in state["dirty"]], output_folder)
+        print("Stopped watching", project_folder)
+
+    return state
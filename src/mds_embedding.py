@@ -0,0 +1,128 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from src.file_lock import get_node_name
+
+# Metric multi dimensional scaling of a small precomputed dissimilarity matrix with SMACOF, equivalent to
+# sklearn.manifold.MDS(metric=True, dissimilarity="precomputed"). The first restart starts from the classical (Torgerson)
+# solution, which usually is already close to the optimum, all others from random positions. As the matrices only have
+# a few dozen rows, restarts are not distributed over processes but run together as one batch of stacked arrays.
+
+# Number of restarts that are run at once
+BATCH_SIZE = 100
+
+
+def calculate_classical_mds(dissimilarity, number_of_components=2):
+    # Torgerson scaling: eigen decomposition of the double centered squared dissimilarities
+    n = dissimilarity.shape[0]
+    centering = np.eye(n) - np.ones((n, n)) / n
+    b = -0.5 * centering @ (dissimilarity ** 2) @ centering
+    eigenvalues, eigenvectors = np.linalg.eigh(b)
+    order = np.argsort(eigenvalues)[::-1][:number_of_components]
+    return eigenvectors[:, order] * np.sqrt(np.maximum(eigenvalues[order], 0))
+
+
+def calculate_pairwise_distances(positions):
+    difference = positions[:, :, None, :] - positions[:, None, :, :]
+    return np.sqrt(np.sum(difference ** 2, axis=-1))
+
+
+def calculate_stress(positions, dissimilarity):
+    return np.sum((calculate_pairwise_distances(positions) - dissimilarity) ** 2, axis=(1, 2)) / 2
+
+
+def run_smacof_batch(dissimilarity, initial_positions, max_iter, eps):
+    # SMACOF on a batch of starting positions of the shape (restarts, points, components). Like in sklearn, every restart
+    # stops on its own once its stress improved by less than eps relative to the sum of the squared distances.
+    positions = initial_positions.copy()
+    n = dissimilarity.shape[0]
+    active = np.ones(len(positions), dtype=bool)
+    old_stress = np.full(len(positions), np.inf)
+    distances = calculate_pairwise_distances(positions)
+
+    for iteration in range(max_iter):
+        # Guttman transform of the active restarts
+        current_distances = distances[active]
+        current_distances[current_distances == 0] = 1e-5
+        ratio = dissimilarity / current_distances
+        b = -ratio
+        b[:, np.arange(n), np.arange(n)] += ratio.sum(axis=2)
+        positions[active] = b @ positions[active] / n
+
+        distances[active] = calculate_pairwise_distances(positions[active])
+        stress = np.sum((distances[active] - dissimilarity) ** 2, axis=(1, 2)) / 2
+
+        converged = (old_stress[active] - stress) / (np.sum(distances[active] ** 2, axis=(1, 2)) / 2) < eps
+        old_stress[active] = stress
+        active[np.flatnonzero(active)[converged]] = False
+        if not np.any(active):
+            break
+
+    return positions, calculate_stress(positions, dissimilarity)
+
+
+def calculate_mds_embedding(dissimilarity, number_of_components=2, n_init=1000, max_iter=10000, eps=1e-6, random_state=1,
+                            tolerance=1e-6):
+    # Run up to n_init SMACOF restarts in batches and return the embedding with the lowest stress. The restarts stop
+    # early once a whole batch could not lower the best stress by more than the relative tolerance.
+    n = dissimilarity.shape[0]
+    rng = np.random.default_rng(random_state)
+
+    best_positions = None
+    best_stress = np.inf
+    started = 0
+    while started < n_init:
+        batch_size = min(BATCH_SIZE, n_init - started)
+        initial_positions = rng.uniform(0, 1, (batch_size, n, number_of_components))
+        if started == 0:
+            initial_positions[0] = calculate_classical_mds(dissimilarity, number_of_components)
+        started += batch_size
+
+        positions, stress = run_smacof_batch(dissimilarity, initial_positions, max_iter, eps)
+        best = np.argmin(stress)
+        improved = stress[best] < best_stress * (1.0 - tolerance)
+        if stress[best] < best_stress:
+            best_positions, best_stress = positions[best], stress[best]
+
+        if not improved and started > BATCH_SIZE:
+            break
+
+    return best_positions, best_stress
+
+
+def refine_mds_embedding(dissimilarity, previous_embedding, max_iter=10000, eps=1e-6):
+    # Continue SMACOF from the embedding of similar dissimilarities, which only needs a few iterations when they changed
+    # little. The classical solution is run alongside in case the previous embedding is far off.
+    initial_positions = np.stack([previous_embedding, calculate_classical_mds(dissimilarity, previous_embedding.shape[1])])
+    positions, stress = run_smacof_batch(dissimilarity, initial_positions, max_iter, eps)
+    return positions[np.argmin(stress)]
+
+
+def get_embedding_cache_path(cache_folder, dissimilarity, parameters):
+    sha = hashlib.sha256(np.ascontiguousarray(dissimilarity, dtype=np.float64).tobytes())
+    sha.update(json.dumps(parameters, sort_keys=True).encode())
+    return cache_folder + "/mds/" + sha.hexdigest() + ".npy"
+
+
+def load_or_calculate_mds_embedding(dissimilarity, cache_folder=None, number_of_components=2, n_init=1000, max_iter=10000,
+                                    eps=1e-6, random_state=1):
+    # The embedding only depends on the dissimilarities and the parameters, so it is stored under their hash and reused
+    # when the figure is drawn again
+    parameters = {"number_of_components": number_of_components, "n_init": n_init, "max_iter": max_iter, "eps": eps,
+                  "random_state": random_state}
+    if cache_folder is not None:
+        cache_path = get_embedding_cache_path(cache_folder, dissimilarity, parameters)
+        if os.path.exists(cache_path):
+            return np.load(cache_path)
+
+    embedding, stress = calculate_mds_embedding(dissimilarity, number_of_components, n_init, max_iter, eps, random_state)
+
+    if cache_folder is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temporary = cache_path + "." + get_node_name() + ".tmp.npy"
+        np.save(temporary, embedding)
+        os.replace(temporary, cache_path)
+
+    return embedding
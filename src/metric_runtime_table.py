@@ -1,42 +1,36 @@
 import numpy as np
 import os
-import glob
+
+from src.results_catalog import query_results
 
 def evaluate_average_metric_runtime(simulation_directory, output_path):
-    # Check if the metric runtime sudirectory exists
-    runtime_dir = simulation_directory + "\\000_Results\\MetricRuntime"
+    # Check if the simulation directory exists
     if not os.path.exists(simulation_directory):
         print("Error: Invalid directory for evaluating metric runtime")
-        
-    # Get all files
-    runtime_files = glob.glob(runtime_dir + "/*.txt")
     
     # Assemble the metric runtimes in a dict
     metrics = {}
-    for runtime_file in runtime_files:
-        # Read in the runtimes line by line
-        with open(runtime_file, "r") as f:
-            for line in f:
-                splitted = line.rstrip().split(";")
-                
-                # Get the metric name
-                metric_name = splitted[0].replace(" [s]", "").replace("_", " ").replace("Brightness Index", "Gray Index").replace("Combined Metrics", "RQF (ours)").replace("Normalized Density", "Relative Density")
-                
-                # Check if this is the total or images entry
-                if metric_name == "TOTAL" or metric_name == "Images" or metric_name == "Output":
-                    continue
-                
-                # Also ignore some of the less important metrics
-                if metric_name in ["Depth Map Uncertainty", "Brightness Index", "Distance To Vertices", "TSDF Value", "Viewplanability", "Gray Index"]:
-                    continue
-                
-                # Init the dict entry if necessary
-                if metric_name not in metrics:
-                    metrics[metric_name] = []
-                
-                # Collect the runtimes
-                for value in splitted[1:]:
-                    metrics[metric_name].append(float(value))
+    for run, lines in query_results(simulation_directory, "MetricRuntime"):
+        # Loop over the runtimes line by line
+        for line_name, line_values in lines.items():
+            # Get the metric name
+            metric_name = line_name.replace(" [s]", "").replace("_", " ").replace("Brightness Index", "Gray Index").replace("Combined Metrics", "RQF (ours)").replace("Normalized Density", "Relative Density")
+            
+            # Check if this is the total or images entry
+            if metric_name == "TOTAL" or metric_name == "Images" or metric_name == "Output":
+                continue
+            
+            # Also ignore some of the less important metrics
+            if metric_name in ["Depth Map Uncertainty", "Brightness Index", "Distance To Vertices", "TSDF Value", "Viewplanability", "Gray Index"]:
+                continue
+            
+            # Init the dict entry if necessary
+            if metric_name not in metrics:
+                metrics[metric_name] = []
+            
+            # Collect the runtimes
+            for value in line_values:
+                metrics[metric_name].append(float(value))
                     
                     
     # Calculate RQF based on its four component metrics ("Coverage", "Saliency2D", "Distance To Edge", "Relative Density")
@@ -0,0 +1,97 @@
+import os
+import numpy as np
+
+# Mapping of the ply property types to numpy types
+PLY_TYPES = {"char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+             "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+             "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+             "float": "f4", "float32": "f4", "double": "f8", "float64": "f8"}
+
+
+def read_ply_header(path):
+    # Parse only the header of a ply file. Returns the format, the elements with their properties and the byte offset
+    # at which the body starts.
+    header = {"format": None, "elements": [], "body_offset": 0}
+    with open(path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise ValueError("Not a ply file: " + path)
+
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError("Incomplete ply header: " + path)
+
+            words = line.decode("ascii").split()
+            if len(words) == 0 or words[0] in ["comment", "obj_info"]:
+                continue
+
+            if words[0] == "format":
+                header["format"] = words[1]
+            elif words[0] == "element":
+                header["elements"].append({"name": words[1], "count": int(words[2]), "properties": []})
+            elif words[0] == "property":
+                # List properties have a variable size and are stored with their count and item types
+                if words[1] == "list":
+                    header["elements"][-1]["properties"].append([words[4], None])
+                else:
+                    header["elements"][-1]["properties"].append([words[2], PLY_TYPES[words[1]]])
+            elif words[0] == "end_header":
+                header["body_offset"] = f.tell()
+                return header
+
+
+def get_element(header, name):
+    for element in header["elements"]:
+        if element["name"] == name:
+            return element
+    raise ValueError("The ply file has no element '" + name + "'")
+
+
+def get_vertex_property_names(path):
+    # Header-only access to the per-vertex property names
+    return [prop[0] for prop in get_element(read_ply_header(path), "vertex")["properties"]]
+
+
+def get_vertex_count(path):
+    return get_element(read_ply_header(path), "vertex")["count"]
+
+
+def create_element_dtype(element, byte_order):
+    return np.dtype([(name, byte_order + ply_type) for name, ply_type in element["properties"]])
+
+
+def read_vertex_columns(path, columns=None):
+    # Return the requested vertex properties of a dense cloud as dict of arrays. Binary files are memory mapped and the
+    # columns are strided views into the mapping, so only the pages that are actually accessed are read from disk.
+    header = read_ply_header(path)
+    if columns is None:
+        columns = [prop[0] for prop in get_element(header, "vertex")["properties"]]
+
+    byte_orders = {"binary_little_endian": "<", "binary_big_endian": ">"}
+
+    # Elements in front of the vertices need a fixed size to compute the offset of the vertex data
+    offset = header["body_offset"]
+    mappable = header["format"] in byte_orders
+    for element in header["elements"]:
+        if element["name"] == "vertex":
+            break
+        if any(ply_type is None for _, ply_type in element["properties"]):
+            mappable = False
+            break
+        if mappable:
+            offset += element["count"] * create_element_dtype(element, byte_orders[header["format"]]).itemsize
+
+    vertex = get_element(header, "vertex")
+    if not mappable or any(ply_type is None for _, ply_type in vertex["properties"]):
+        # Fall back to plyfile for ascii files and list properties
+        from plyfile import PlyData
+        pcl = PlyData.read(os.path.abspath(path))
+        return {name: np.asarray(pcl["vertex"].data[name]) for name in columns}
+
+    vertex_dtype = create_element_dtype(vertex, byte_orders[header["format"]])
+    if vertex["count"] == 0:
+        return {name: np.zeros(0, dtype=vertex_dtype[name]) for name in columns}
+
+    data = np.memmap(path, dtype=vertex_dtype, mode="r", offset=offset, shape=(vertex["count"],))
+
+    return {name: data[name] for name in columns}
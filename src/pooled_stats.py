@@ -0,0 +1,117 @@
+import os
+import json
+import numpy as np
+
+from src.cloud_store import read_cloud_columns, get_cloud_point_count
+from src.file_lock import get_node_name
+
+# Power sums that are always collected, mean and standard deviation are derived from them
+BASE_POWERS = [1, 2]
+
+# Number of values that are pooled at once. Small chunks stay in the CPU cache while all powers are computed.
+CHUNK_SIZE = 1 << 16
+
+
+def get_sidecar_path(cloud):
+    if cloud["format"] == "npy":
+        return cloud["path"] + "/pooled.json"
+    return cloud["path"] + ".pooled.json"
+
+
+def get_cloud_identity(cloud):
+    # Size and modification time of the file the values are read from. A replaced cloud invalidates its sidecar.
+    path = cloud["path"] + ".npz" if cloud["format"] == "npz" else cloud["path"]
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def format_power(power):
+    return str(int(power)) if float(power).is_integer() else str(float(power))
+
+
+def calculate_pooled_stats(columns, metric_names, powers):
+    # Mean, standard deviation and power sums of all metric columns in one pass over chunks of rows. The chunk holds one
+    # contiguous row per metric and integer powers are built up by repeated multiplication.
+    number_of_points = len(columns[metric_names[0]]) if len(metric_names) > 0 else 0
+    powers = sorted(set(float(p) for p in list(powers) + BASE_POWERS))
+    integer_powers = [int(p) for p in powers if p.is_integer() and p > 0]
+    other_powers = [p for p in powers if not (p.is_integer() and p > 0)]
+
+    power_sums = {format_power(p): np.zeros(len(metric_names)) for p in powers}
+    chunk_rows = max(1, CHUNK_SIZE // max(1, len(metric_names)))
+    for start in range(0, number_of_points, chunk_rows):
+        end = min(start + chunk_rows, number_of_points)
+        values = np.empty((len(metric_names), end - start))
+        for i in range(len(metric_names)):
+            values[i] = columns[metric_names[i]][start:end]
+
+        current = values.copy()
+        exponent = 1
+        for p in integer_powers:
+            while exponent < p:
+                current *= values
+                exponent += 1
+            power_sums[format_power(p)] += current.sum(axis=1)
+        for p in other_powers:
+            power_sums[format_power(p)] += np.power(values, p).sum(axis=1)
+
+    stats = {}
+    for i in range(len(metric_names)):
+        mean = power_sums["1"][i] / number_of_points if number_of_points > 0 else float("nan")
+        variance = power_sums["2"][i] / number_of_points - mean ** 2 if number_of_points > 0 else float("nan")
+        stats[metric_names[i]] = {"mean": float(mean), "std": float(np.sqrt(max(variance, 0.0))),
+                                  "power_sums": {key: float(sums[i]) for key, sums in power_sums.items()}}
+    return number_of_points, stats
+
+
+def load_sidecar(cloud):
+    path = get_sidecar_path(cloud)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+
+def save_sidecar(cloud, sidecar):
+    path = get_sidecar_path(cloud)
+    temporary = path + "." + get_node_name() + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(sidecar, f)
+    os.replace(temporary, path)
+
+
+def get_pooled_stats(cloud, metric_names, powers=None):
+    # Pooled statistics of the metric columns of a listed dense cloud. They are stored in a small sidecar file next to
+    # the cloud and only recomputed if the cloud changed or a metric or power is requested for the first time. Returns
+    # the number of points and a dict with mean, std and the sums of the requested powers per metric.
+    if powers is None:
+        powers = []
+
+    identity = get_cloud_identity(cloud)
+    sidecar = load_sidecar(cloud)
+    if sidecar is None or sidecar["identity"] != identity:
+        sidecar = {"identity": identity, "points": get_cloud_point_count(cloud), "metrics": {}}
+
+    missing = [name for name in metric_names if name not in sidecar["metrics"]
+               or any(format_power(p) not in sidecar["metrics"][name]["power_sums"] for p in powers)]
+    if len(missing) > 0:
+        # Recompute the missing metrics with the requested powers and the powers already stored for these metrics, so
+        # they keep all of their power sums
+        known_powers = set(format_power(p) for p in powers)
+        for name in missing:
+            known_powers.update(sidecar["metrics"].get(name, {}).get("power_sums", {}).keys())
+
+        columns = read_cloud_columns(cloud, missing)
+        sidecar["points"], stats = calculate_pooled_stats(columns, missing, sorted(float(p) for p in known_powers))
+        sidecar["metrics"].update(stats)
+        save_sidecar(cloud, sidecar)
+
+    return sidecar["points"], {name: sidecar["metrics"][name] for name in metric_names}
+
+
+def calculate_minkowski_pooling(points, stats, power):
+    # Minkowski mean (sum(x^p) / n)^(1/p) of a metric from its pooled statistics
+    return np.power(stats["power_sums"][format_power(power)] / points, 1 / power)
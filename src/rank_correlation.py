@@ -0,0 +1,258 @@
+import os
+import math
+import shutil
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Spearman's rank correlation of all columns of a (points, metrics) matrix that does not need to fit into memory. The
+# matrix is read in chunks of rows (it may be a memory mapped .npy file) and the correlation is the Pearson correlation
+# of the ranks, accumulated chunk by chunk as the Gram matrix of the centered ranks.
+#
+# Exact mode ranks every column with an external distribution sort: the values are split by sampled quantiles into
+# buckets on disk that fit into memory, every bucket is sorted on its own and the ranks are written back in bucket order.
+# Tied values always end up in the same bucket and get their average rank like in scipy.stats.spearmanr. Values that fill
+# more than a bucket get a bucket of their own, whose rows are given their shared rank without loading the bucket, so
+# heavily tied columns stay within the memory of a chunk as well. Ranks are stored doubled as integers, so the result only differs from spearmanr by floating point rounding (~1e-12).
+#
+# Approximate mode replaces every value by the average rank of its quantile bin. Bin edges come from a sample, bin counts
+# are exact and values that fill more than one bin get a bin of their own. A value of a bin with c members is off from its exact rank by less than c / 2 and not at all if all values
+# of the bin are equal (which makes tied, discrete and constant columns exact), so the ranks of a metric are
+# perturbed by a vector e with ||e|| <= rms_error * ||1||. Perturbing a vector x by e turns it by at most
+# arcsin(||e|| / ||x||), and as the correlation is the cosine of the angle between the centered rank vectors, every
+# coefficient is off by at most arcsin(eps_i) + arcsin(eps_j) with eps = rms_error / (std_binned - rms_error). For
+# continuous values and equally filled bins (bin fraction delta) this is about 2 * sqrt(3) * delta, e.g. 0.0009 for 4096
+# bins. The bound is computed from the actual bin counts and returned together with the correlation.
+#
+# Values are expected to be finite, NaNs are not handled like in spearmanr.
+
+# Number of values that are processed (and sorted) at once. Matrix chunks hold CHUNK_SIZE values in total.
+CHUNK_SIZE = 1 << 22
+
+# Number of rank bins per metric in approximate mode
+NUMBER_OF_BINS = 4096
+
+CORRELATION_MODES = ["exact", "approximate"]
+
+
+def get_row_chunks(number_of_rows, chunk_size):
+    return [[start, min(start + chunk_size, number_of_rows)] for start in range(0, number_of_rows, chunk_size)]
+
+
+def draw_sample(values, sample_size, seed=0):
+    # Random values of a column, read in ascending order to keep memory mapped reads sequential
+    if len(values) <= sample_size:
+        return np.array(values)
+    rng = np.random.default_rng(seed)
+    return values[np.sort(rng.integers(0, len(values), sample_size))]
+
+
+def get_quantile_edges(values, number_of_edges, separate_ties=False):
+    # Edges in the type of the values, searching with edges of another type would convert every value. With
+    # separate_ties, values that fill more than one quantile bin get a bin of their own that holds no other values.
+    edges = np.quantile(draw_sample(values, CHUNK_SIZE), np.linspace(0, 1, number_of_edges + 2)[1:-1])
+    edges, repetitions = np.unique(edges.astype(values.dtype), return_counts=True)
+    if separate_ties:
+        repeated = edges[repetitions > 1]
+        if np.issubdtype(values.dtype, np.floating):
+            upper = np.nextafter(repeated, np.inf)
+        else:
+            upper = repeated[repeated < np.iinfo(values.dtype).max] + 1
+        edges = np.unique(np.concatenate([edges, upper.astype(values.dtype)]))
+    return edges
+
+
+def get_doubled_average_ranks(sorted_values, offset):
+    # Twice the 1-based average rank of every value of a sorted array that has `offset` values ranked in front of it.
+    # Tied values share the average of their ranks, doubling keeps these half ranks exact as integers.
+    starts = np.flatnonzero(np.concatenate([[True], sorted_values[1:] != sorted_values[:-1]]))
+    ends = np.append(starts[1:], len(sorted_values))
+    return np.repeat(2 * offset + starts + ends + 1, ends - starts)
+
+
+def rank_column(data_matrix, column, ranks, chunk_size, work_folder):
+    values = data_matrix[:, column]
+    number_of_rows = len(values)
+
+    # Columns that fit into a single chunk are sorted in memory
+    if number_of_rows <= chunk_size:
+        order = np.argsort(values)
+        ranks[order, column] = get_doubled_average_ranks(np.asarray(values)[order], 0)
+        return
+
+    # Distribute the values with their row index into buckets of about half a chunk, equal values share a bucket
+    splitters = get_quantile_edges(values, 2 * number_of_rows // chunk_size, separate_ties=True)
+    record_dtype = np.dtype([("value", values.dtype), ("row", "<i8")])
+    bucket_folder = work_folder + "/column_" + str(column)
+    os.makedirs(bucket_folder)
+
+    minima = {}
+    maxima = {}
+    for start, end in get_row_chunks(number_of_rows, chunk_size):
+        records = np.empty(end - start, dtype=record_dtype)
+        records["value"] = values[start:end]
+        records["row"] = np.arange(start, end)
+
+        buckets = np.searchsorted(splitters, records["value"], side="right")
+        order = np.argsort(buckets)
+        records, buckets = records[order], buckets[order]
+        bounds = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1], [True]]))
+        for i in range(len(bounds) - 1):
+            bucket = buckets[bounds[i]]
+            bucket_values = records["value"][bounds[i]:bounds[i + 1]]
+            minima[bucket] = min(minima.get(bucket, bucket_values[0]), bucket_values.min())
+            maxima[bucket] = max(maxima.get(bucket, bucket_values[0]), bucket_values.max())
+            with open(bucket_folder + "/" + str(bucket), "ab") as f:
+                records[bounds[i]:bounds[i + 1]].tofile(f)
+
+    # Rank the buckets in value order
+    offset = 0
+    for bucket in range(len(splitters) + 1):
+        path = bucket_folder + "/" + str(bucket)
+        if not os.path.exists(path):
+            continue
+
+        # All rows of a bucket of equal values share their average rank, which is written chunk by chunk
+        if minima[bucket] == maxima[bucket]:
+            count = os.path.getsize(path) // record_dtype.itemsize
+            with open(path, "rb") as f:
+                for _ in get_row_chunks(count, chunk_size):
+                    ranks[np.fromfile(f, dtype=record_dtype, count=chunk_size)["row"], column] = 2 * offset + count + 1
+            offset += count
+            os.remove(path)
+            continue
+
+        records = np.fromfile(path, dtype=record_dtype)
+        order = np.argsort(records["value"])
+        ranks[records["row"][order], column] = get_doubled_average_ranks(records["value"][order], offset)
+        offset += len(records)
+        os.remove(path)
+
+    os.rmdir(bucket_folder)
+
+
+def accumulate_gram_matrix(get_centered_chunk, number_of_rows, number_of_columns, chunk_size, workers):
+    # Sum of the outer products of the centered rows, computed on chunks of rows in parallel
+    def process(chunk):
+        centered = get_centered_chunk(chunk[0], chunk[1])
+        return centered.T @ centered
+
+    gram = np.zeros((number_of_columns, number_of_columns))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for partial in executor.map(process, get_row_chunks(number_of_rows, max(1, chunk_size // number_of_columns))):
+            gram += partial
+    return gram
+
+
+def normalize_gram_matrix(gram):
+    scale = np.sqrt(np.diag(gram))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlation = gram / np.outer(scale, scale)
+    np.fill_diagonal(correlation, 1.0)
+    return np.clip(correlation, -1.0, 1.0)
+
+
+def calculate_exact_correlation(data_matrix, chunk_size, workers, work_folder):
+    number_of_rows, number_of_columns = data_matrix.shape
+    rank_dtype = np.uint32 if 2 * number_of_rows + 1 < 2 ** 32 else np.uint64
+    ranks = np.lib.format.open_memmap(work_folder + "/ranks.npy", mode="w+", dtype=rank_dtype,
+                                      shape=(number_of_rows, number_of_columns), fortran_order=True)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda column: rank_column(data_matrix, column, ranks, chunk_size, work_folder), range(number_of_columns)))
+
+    # Doubled ranks centered around their mean (n + 1) and scaled into [-1, 1]
+    def get_centered_chunk(start, end):
+        return (ranks[start:end].astype(np.float64) - (number_of_rows + 1)) / number_of_rows
+
+    correlation = normalize_gram_matrix(accumulate_gram_matrix(get_centered_chunk, number_of_rows, number_of_columns, chunk_size, workers))
+    del ranks
+    return correlation
+
+
+def count_sorted_bins(sorted_values, edges):
+    # Bin k holds the values in [edges[k - 1], edges[k]). Searching the few edges in the sorted values is much faster than
+    # searching every value in the edges.
+    bounds = np.concatenate([[0], np.searchsorted(sorted_values, edges, side="left"), [len(sorted_values)]])
+    return np.diff(bounds)
+
+
+def count_bins(values, edges, chunk_size):
+    # Number of values of every bin and whether all values of a bin are equal
+    counts = np.zeros(len(edges) + 1, dtype=np.int64)
+    minima = np.full(len(edges) + 1, np.inf)
+    maxima = np.full(len(edges) + 1, -np.inf)
+    for start, end in get_row_chunks(len(values), chunk_size):
+        sorted_values = np.sort(values[start:end])
+        chunk_counts = count_sorted_bins(sorted_values, edges)
+        ends = np.cumsum(chunk_counts)
+        filled = chunk_counts > 0
+        minima[filled] = np.minimum(minima[filled], sorted_values[(ends - chunk_counts)[filled]])
+        maxima[filled] = np.maximum(maxima[filled], sorted_values[ends[filled] - 1])
+        counts += chunk_counts
+    return counts, minima == maxima
+
+
+def calculate_approximate_correlation(data_matrix, chunk_size, workers, number_of_bins):
+    number_of_rows, number_of_columns = data_matrix.shape
+
+    def create_bins(column):
+        values = data_matrix[:, column]
+        edges = get_quantile_edges(values, number_of_bins - 1, separate_ties=True)
+        counts, tied = count_bins(values, edges, chunk_size)
+
+        # Centered and scaled doubled average rank of every bin and its error bound. The values of a bin in which all
+        # values are equal share their exact rank.
+        starts = np.cumsum(counts) - counts
+        centered = (2 * starts + counts + 1 - (number_of_rows + 1)) / number_of_rows
+        binned_std = math.sqrt(np.sum(counts * centered ** 2) / number_of_rows)
+        spread = np.where(tied, 0, np.maximum(counts, 1) - 1)
+        rms_error = math.sqrt(np.sum(counts * (spread / number_of_rows) ** 2) / number_of_rows)
+        if rms_error == 0:
+            epsilon = 0.0
+        else:
+            epsilon = rms_error / (binned_std - rms_error) if binned_std > rms_error else 1.0
+        return edges, centered, epsilon
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        bins = list(executor.map(create_bins, range(number_of_columns)))
+
+    def get_centered_chunk(start, end):
+        chunk = data_matrix[start:end]
+        centered = np.empty((end - start, number_of_columns))
+        for column in range(number_of_columns):
+            edges, centered_ranks, _ = bins[column]
+            order = np.argsort(chunk[:, column])
+            centered[order, column] = np.repeat(centered_ranks, count_sorted_bins(chunk[order, column], edges))
+        return centered
+
+    correlation = normalize_gram_matrix(accumulate_gram_matrix(get_centered_chunk, number_of_rows, number_of_columns, chunk_size, workers))
+
+    angles = [math.asin(min(1.0, epsilon)) for _, _, epsilon in bins]
+    error_bound = 0.0
+    for i in range(number_of_columns):
+        for j in range(i + 1, number_of_columns):
+            error_bound = max(error_bound, angles[i] + angles[j])
+
+    return correlation, error_bound
+
+
+def calculate_spearman_correlation(data_matrix, mode="exact", chunk_size=CHUNK_SIZE, workers=None, work_folder=None,
+                                   number_of_bins=NUMBER_OF_BINS):
+    # Spearman correlation matrix of the columns of data_matrix and the maximum absolute error of its coefficients
+    # (0 in exact mode, apart from rounding). Temporary rank files are written to a sub folder of work_folder.
+    if mode not in CORRELATION_MODES:
+        raise ValueError("Unknown correlation mode: " + mode)
+    if workers is None:
+        workers = os.cpu_count()
+
+    if mode == "approximate":
+        return calculate_approximate_correlation(data_matrix, chunk_size, workers, number_of_bins)
+
+    if work_folder is not None:
+        os.makedirs(work_folder, exist_ok=True)
+    temporary_folder = tempfile.mkdtemp(prefix="ranks_", dir=work_folder)
+    try:
+        return calculate_exact_correlation(data_matrix, chunk_size, workers, temporary_folder), 0.0
+    finally:
+        shutil.rmtree(temporary_folder, ignore_errors=True)
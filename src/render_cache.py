@@ -0,0 +1,258 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import subprocess
+
+from src.file_lock import file_lock, get_node_name
+
+# Options of blender that are followed by the location of the rendered images
+OUTPUT_OPTIONS = ["-o", "--render-output"]
+
+
+def hash_file(path, cache_folder):
+    # Content hash of an input file. Hashes are memorized by path, size and modification time, as models and blend
+    # files are passed to blender over and over again.
+    stat = os.stat(path)
+    identity = os.path.abspath(path) + "|" + str(stat.st_size) + "|" + str(stat.st_mtime_ns)
+    memo_path = cache_folder + "/hashes/" + hashlib.sha1(identity.encode()).hexdigest()
+
+    if os.path.exists(memo_path):
+        with open(memo_path, "r") as f:
+            return f.read()
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    os.makedirs(cache_folder + "/hashes", exist_ok=True)
+    temporary = memo_path + "." + get_node_name() + ".tmp"
+    with open(temporary, "w") as f:
+        f.write(digest)
+    os.replace(temporary, memo_path)
+
+    return digest
+
+
+def hash_folder(path, cache_folder):
+    # Content hash of an input folder from the relative paths and content hashes of all files within it
+    description = []
+    for root, folders, files in os.walk(path):
+        folders.sort()
+        for name in sorted(files):
+            file_path = root + "/" + name
+            description.append([os.path.relpath(file_path, path).replace("\\", "/"), hash_file(file_path, cache_folder)])
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+
+def get_output_options():
+    # Options whose value is a location the renderer writes to: blender's own ones and those listed in
+    # BLENDER_CACHE_OUTPUT_OPTIONS (separated by ",")
+    options = list(OUTPUT_OPTIONS)
+    options += [option for option in os.environ.get("BLENDER_CACHE_OUTPUT_OPTIONS", "").split(",") if option != ""]
+    return options
+
+
+def looks_like_path(value):
+    return ("/" in value or "\\" in value) and os.path.isdir(os.path.dirname(os.path.abspath(value)))
+
+
+def classify_arguments(arguments, cache_folder):
+    # Turn the command line into a location independent description of the render request. Existing files and folders
+    # (model, scene, scripts, camera poses, textures) are described by their content. Output locations, i.e. the values
+    # of output options and paths that do not exist yet, are only described by their file type, as they differ
+    # between runs.
+    output_options = get_output_options()
+    tokens = []
+    for i in range(len(arguments)):
+        # Blender also accepts "--option=value" arguments
+        prefix, value = "", arguments[i]
+        if arguments[i].startswith("-") and "=" in arguments[i]:
+            prefix, value = arguments[i].split("=", 1)
+            prefix += "="
+
+        is_output = prefix[:-1] in output_options or (i > 0 and prefix == "" and arguments[i - 1] in output_options)
+        if is_output and os.path.isdir(value):
+            tokens.append(["output_folder", prefix])
+        elif is_output:
+            tokens.append(["output", prefix, os.path.splitext(value)[1]])
+        elif os.path.isfile(value):
+            tokens.append(["file", prefix, hash_file(value, cache_folder)])
+        elif os.path.isdir(value):
+            tokens.append(["folder", prefix, hash_folder(value, cache_folder)])
+        elif looks_like_path(value):
+            tokens.append(["output", prefix, os.path.splitext(value)[1]])
+        else:
+            tokens.append(["value", prefix, value])
+    return tokens
+
+
+def calculate_request_key(real_blender, tokens):
+    # The renderer itself is part of the key, so a blender update invalidates the cache
+    stat = os.stat(real_blender)
+    description = json.dumps([os.path.basename(real_blender), stat.st_size, tokens])
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def get_output_locations(arguments, tokens):
+    # Folders in which the renderer might write its results, keyed by the index of the argument they stem from: the
+    # folders of output paths and folder arguments. The folders of input files are left out, as other renders might
+    # write into them at the same time.
+    locations = {}
+    for i in range(len(arguments)):
+        value = arguments[i][len(tokens[i][1]):]
+        if tokens[i][0] in ["folder", "output_folder"]:
+            locations[i] = os.path.abspath(value)
+        elif tokens[i][0] == "output":
+            locations[i] = os.path.dirname(os.path.abspath(value))
+    return locations
+
+
+def snapshot_folders(folders):
+    snapshot = {}
+    for folder in set(folders):
+        if not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            path = folder + "/" + name
+            if os.path.isfile(path):
+                snapshot[path] = os.stat(path).st_mtime_ns
+    return snapshot
+
+
+def find_outputs(arguments, tokens, locations, before):
+    # Collect all files that were created or modified by the renderer. Files written exactly to an output argument are
+    # remembered by that argument, all others by their name relative to the folder the argument points to.
+    outputs = []
+    after = snapshot_folders(locations.values())
+    for path, modified in after.items():
+        if path in before and before[path] == modified:
+            continue
+
+        matches = [i for i in locations if tokens[i][0] == "output" and os.path.abspath(arguments[i][len(tokens[i][1]):]) == os.path.abspath(path)]
+        if len(matches) > 0:
+            outputs.append({"argument": matches[0], "name": None, "path": path})
+            continue
+
+        for i, folder in locations.items():
+            if os.path.dirname(os.path.abspath(path)) == folder:
+                outputs.append({"argument": i, "name": os.path.basename(path), "path": path})
+                break
+    return outputs
+
+
+def get_entry_folder(cache_folder, key):
+    return cache_folder + "/entries/" + key[:2] + "/" + key
+
+
+def store_entry(cache_folder, key, outputs, result):
+    # Write the entry into a temporary folder first and move it in place, so concurrent renders never see partial
+    # entries. If another process stored the same request in the meantime, its entry is kept.
+    entry_folder = get_entry_folder(cache_folder, key)
+    temporary = cache_folder + "/tmp/" + key + "." + get_node_name()
+    os.makedirs(temporary + "/files")
+
+    files = []
+    size = 0
+    for i in range(len(outputs)):
+        stored_name = str(i) + "_" + os.path.basename(outputs[i]["path"])
+        shutil.copy(outputs[i]["path"], temporary + "/files/" + stored_name)
+        size += os.path.getsize(outputs[i]["path"])
+        files.append({"argument": outputs[i]["argument"], "name": outputs[i]["name"], "stored": stored_name})
+
+    with open(temporary + "/entry.json", "w") as f:
+        json.dump({"files": files, "size": size, "stdout": result.stdout, "stderr": result.stderr}, f)
+
+    os.makedirs(os.path.dirname(entry_folder), exist_ok=True)
+    try:
+        os.rename(temporary, entry_folder)
+    except OSError:
+        shutil.rmtree(temporary, ignore_errors=True)
+
+
+def restore_entry(cache_folder, key, arguments, tokens):
+    # Copy the cached renderings to the locations requested by the current call. Returns None on a cache miss.
+    entry_folder = get_entry_folder(cache_folder, key)
+    try:
+        with open(entry_folder + "/entry.json", "r") as f:
+            entry = json.load(f)
+
+        for stored in entry["files"]:
+            i = stored["argument"]
+            value = arguments[i][len(tokens[i][1]):]
+            if stored["name"] is None:
+                target = os.path.abspath(value)
+            elif tokens[i][0] in ["folder", "output_folder"]:
+                target = os.path.abspath(value) + "/" + stored["name"]
+            else:
+                target = os.path.dirname(os.path.abspath(value)) + "/" + stored["name"]
+
+            temporary = target + "." + get_node_name() + ".tmp"
+            shutil.copy(entry_folder + "/files/" + stored["stored"], temporary)
+            os.replace(temporary, target)
+
+        # Mark the entry as recently used
+        os.utime(entry_folder + "/entry.json", None)
+    except (OSError, ValueError):
+        return None
+
+    return entry
+
+
+def evict_entries(cache_folder, maximum_size):
+    # Remove the least recently used entries until the cache fits into its size limit
+    with file_lock(cache_folder + "/eviction.lock"):
+        entries = []
+        total_size = 0
+        for prefix in os.listdir(cache_folder + "/entries"):
+            prefix_folder = cache_folder + "/entries/" + prefix
+            for key in os.listdir(prefix_folder):
+                entry_folder = prefix_folder + "/" + key
+                try:
+                    with open(entry_folder + "/entry.json", "r") as f:
+                        size = json.load(f)["size"]
+                    last_used = os.path.getmtime(entry_folder + "/entry.json")
+                except (OSError, ValueError):
+                    continue
+                entries.append([last_used, size, entry_folder])
+                total_size += size
+
+        entries.sort()
+        for last_used, size, entry_folder in entries:
+            if total_size <= maximum_size:
+                break
+            shutil.rmtree(entry_folder, ignore_errors=True)
+            total_size -= size
+
+
+def run_cached_render(real_blender, arguments, cache_folder, maximum_size):
+    # Serve a blender call from the cache or forward it to the real blender and cache its results
+    os.makedirs(cache_folder + "/entries", exist_ok=True)
+    os.makedirs(cache_folder + "/tmp", exist_ok=True)
+
+    tokens = classify_arguments(arguments, cache_folder)
+    key = calculate_request_key(real_blender, tokens)
+
+    entry = restore_entry(cache_folder, key, arguments, tokens)
+    if entry is not None:
+        sys.stdout.write(entry["stdout"])
+        sys.stderr.write(entry["stderr"])
+        return 0
+
+    locations = get_output_locations(arguments, tokens)
+    before = snapshot_folders(locations.values())
+
+    result = subprocess.run([real_blender] + arguments, capture_output=True, text=True, errors="replace")
+    sys.stdout.write(result.stdout)
+    sys.stderr.write(result.stderr)
+
+    # Only cache successful renders that produced something
+    outputs = find_outputs(arguments, tokens, locations, before)
+    if result.returncode == 0 and len(outputs) > 0:
+        store_entry(cache_folder, key, outputs, result)
+        evict_entries(cache_folder, maximum_size)
+
+    return result.returncode
@@ -0,0 +1,271 @@
+import os
+import sqlite3
+import numpy as np
+
+from src.campaign_manifest import load_manifest
+from src.file_lock import file_lock
+from src.run_names import split_run_name
+
+# Index of the ";" separated result files of a campaign. Every run is stored once with its model, metric and repetition
+# and every line of its result files ("Images", "Completeness [%]", ...) as a series of float64 values, so evaluators
+# get all series of a kind with a single indexed query instead of opening and parsing thousands of files. The catalog
+# is filled by the runner as runs finish and brought up to date before every evaluation: result files whose size or
+# modification time changed are parsed again, removed ones are dropped.
+#
+# Writes are serialized with a lock file, as SQLite locking is not reliable on network file systems.
+
+# Result sub folders that are indexed
+RESULT_KINDS = ["Metrics", "Termination", "Runtime", "MetricRuntime"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, run_name TEXT UNIQUE NOT NULL, model TEXT NOT NULL,
+                                 metric TEXT NOT NULL, repetition INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS runs_by_model ON runs (model);
+CREATE INDEX IF NOT EXISTS runs_by_metric ON runs (metric);
+CREATE TABLE IF NOT EXISTS files (run_id INTEGER NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+                                  PRIMARY KEY (run_id, kind));
+CREATE TABLE IF NOT EXISTS series (kind TEXT NOT NULL, run_id INTEGER NOT NULL, line INTEGER NOT NULL, name TEXT NOT NULL,
+                                   steps INTEGER NOT NULL, vals BLOB NOT NULL, PRIMARY KEY (kind, run_id, line)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS series_by_name ON series (kind, name);
+"""
+
+
+def get_catalog_path(project_folder):
+    return project_folder + "/000_Results/results_catalog.sqlite"
+
+
+def connect_catalog(project_folder, read_only=False):
+    # A read only connection neither creates the catalog nor changes it
+    if read_only:
+        return sqlite3.connect("file:" + os.path.abspath(get_catalog_path(project_folder)) + "?mode=ro", uri=True, timeout=60)
+    connection = sqlite3.connect(get_catalog_path(project_folder), timeout=60)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def catalog_lock(project_folder):
+    # Indexing a whole campaign can take a while, so the lock is only considered stale after ten minutes
+    return file_lock(get_catalog_path(project_folder) + ".lock", stale_after=600.0)
+
+
+def read_result_file(path):
+    # All lines of a result file as [name, values], empty values are NaN and lines that are not numeric are skipped
+    lines = []
+    with open(path, "r") as f:
+        for line in f:
+            splitted = line.rstrip().split(";")
+            if len(splitted) < 2:
+                continue
+            try:
+                lines.append([splitted[0], np.array([float(val) if val != "" else np.nan for val in splitted[1:]])])
+            except ValueError:
+                continue
+    return lines
+
+
+def get_result_identity(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_run_id(connection, run_name, model, metric, repetition):
+    row = connection.execute("SELECT run_id FROM runs WHERE run_name = ?", (run_name,)).fetchone()
+    if row is not None:
+        return row[0]
+    return connection.execute("INSERT INTO runs (run_name, model, metric, repetition) VALUES (?, ?, ?, ?)",
+                              (run_name, model, metric, repetition)).lastrowid
+
+
+def store_result_file(connection, run_id, kind, path):
+    size, mtime_ns = get_result_identity(path)
+    lines = read_result_file(path)
+
+    connection.execute("DELETE FROM series WHERE kind = ? AND run_id = ?", (kind, run_id))
+    connection.executemany("INSERT INTO series (kind, run_id, line, name, steps, vals) VALUES (?, ?, ?, ?, ?, ?)",
+                           [(kind, run_id, i, lines[i][0], len(lines[i][1]), lines[i][1].astype("<f8").tobytes())
+                            for i in range(len(lines))])
+    connection.execute("INSERT OR REPLACE INTO files (run_id, kind, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                       (run_id, kind, size, mtime_ns))
+
+
+def remove_result_file(connection, run_id, kind):
+    connection.execute("DELETE FROM series WHERE kind = ? AND run_id = ?", (kind, run_id))
+    connection.execute("DELETE FROM files WHERE kind = ? AND run_id = ?", (kind, run_id))
+
+
+def ingest_run_results(project_folder, run_name, model=None, metric=None, repetition=None):
+    # Add (or replace) all result files of a single run, called by the runner after the results were harvested
+    if model is None or metric is None or repetition is None:
+        _, model, metric, repetition = split_run_name(run_name)
+
+    with catalog_lock(project_folder):
+        connection = connect_catalog(project_folder)
+        try:
+            with connection:
+                run_id = get_run_id(connection, run_name, model, metric, repetition)
+                for kind in RESULT_KINDS:
+                    path = project_folder + "/000_Results/" + kind + "/" + run_name + ".txt"
+                    if os.path.exists(path):
+                        store_result_file(connection, run_id, kind, path)
+                    else:
+                        remove_result_file(connection, run_id, kind)
+        finally:
+            connection.close()
+
+
+def remove_run_results(project_folder, run_name):
+    if not os.path.exists(get_catalog_path(project_folder)):
+        return
+
+    with catalog_lock(project_folder):
+        connection = connect_catalog(project_folder)
+        try:
+            with connection:
+                row = connection.execute("SELECT run_id FROM runs WHERE run_name = ?", (run_name,)).fetchone()
+                if row is not None:
+                    connection.execute("DELETE FROM series WHERE run_id = ?", row)
+                    connection.execute("DELETE FROM files WHERE run_id = ?", row)
+                    connection.execute("DELETE FROM runs WHERE run_id = ?", row)
+        finally:
+            connection.close()
+
+
+def find_changed_files(connection, project_folder):
+    # Compare the result folders with the catalog, only the directory entries are read. Returns the new or changed files
+    # as [run_name, kind, path] and the removed ones as [run_id, kind].
+    known = {}
+    for run_name, run_id, kind, size, mtime_ns in connection.execute(
+            "SELECT runs.run_name, runs.run_id, files.kind, files.size, files.mtime_ns FROM files JOIN runs USING (run_id)"):
+        known[(run_name, kind)] = [run_id, size, mtime_ns]
+
+    changed = []
+    for kind in RESULT_KINDS:
+        folder = project_folder + "/000_Results/" + kind
+        if not os.path.exists(folder):
+            continue
+
+        for entry in os.scandir(folder):
+            if not entry.name.endswith(".txt") or not entry.name[:3].isdigit():
+                continue
+
+            run_name = entry.name[:-4]
+            stat = entry.stat()
+            stored = known.pop((run_name, kind), None)
+            if stored is None or stored[1] != stat.st_size or stored[2] != stat.st_mtime_ns:
+                changed.append([run_name, kind, entry.path])
+
+    removed = [[run_id, kind] for (_, kind), (run_id, _, _) in known.items()]
+    return changed, removed
+
+
+def update_results_catalog(project_folder):
+    # Bring the catalog up to date with the result folders and return the number of files that were (re)indexed
+    if not os.path.exists(project_folder + "/000_Results"):
+        return 0
+
+    # The result folders are scanned under the lock, so retried runs do not remove files between the scan and the update
+    connection = connect_catalog(project_folder)
+    try:
+        with catalog_lock(project_folder), connection:
+            changed, removed = find_changed_files(connection, project_folder)
+            if len(changed) == 0 and len(removed) == 0:
+                return 0
+
+            # Model and metric come from the campaign manifest and are only derived from the run name without one
+            manifest_runs = load_manifest(project_folder)["runs"]
+            run_ids = {}
+            for run_name, kind, path in changed:
+                if run_name not in run_ids:
+                    if run_name in manifest_runs:
+                        entry = manifest_runs[run_name]
+                        run_ids[run_name] = get_run_id(connection, run_name, entry["model"], entry["metric"], entry["repetition"])
+                    else:
+                        _, model, metric, repetition = split_run_name(run_name)
+                        run_ids[run_name] = get_run_id(connection, run_name, model, metric, repetition)
+
+                # Runners delete the files of a run before retrying it without holding the lock
+                try:
+                    store_result_file(connection, run_ids[run_name], kind, path)
+                except FileNotFoundError:
+                    remove_result_file(connection, run_ids[run_name], kind)
+
+            for run_id, kind in removed:
+                remove_result_file(connection, run_id, kind)
+            connection.execute("DELETE FROM runs WHERE run_id NOT IN (SELECT run_id FROM files)")
+
+        return len(changed)
+    finally:
+        connection.close()
+
+
+def is_catalog_current(project_folder):
+    # Check without writing to the campaign folder whether the catalog exists and indexes all result files as they are
+    if not os.path.exists(get_catalog_path(project_folder)):
+        return False
+    try:
+        connection = connect_catalog(project_folder, read_only=True)
+        try:
+            changed, removed = find_changed_files(connection, project_folder)
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return False
+    return len(changed) == 0 and len(removed) == 0
+
+
+def read_result_files(project_folder, kind, names=None):
+    # Parse the result files of a kind directly, in the same form as query_results
+    folder = project_folder + "/000_Results/" + kind
+    if not os.path.exists(folder):
+        return []
+
+    manifest_runs = load_manifest(project_folder)["runs"]
+    results = []
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.endswith(".txt") or not file_name[:3].isdigit():
+            continue
+
+        run_name = file_name[:-4]
+        if run_name in manifest_runs:
+            entry = manifest_runs[run_name]
+            run = {"run_name": run_name, "model": entry["model"], "metric": entry["metric"], "repetition": entry["repetition"]}
+        else:
+            _, model, metric, repetition = split_run_name(run_name)
+            run = {"run_name": run_name, "model": model, "metric": metric, "repetition": repetition}
+
+        lines = {name: values for name, values in read_result_file(folder + "/" + file_name) if names is None or name in names}
+        if len(lines) > 0:
+            results.append([run, lines])
+    return results
+
+
+def query_results(project_folder, kind, names=None, update=True):
+    # All runs that have a result file of the given kind, ordered by run name, as a list of [run, lines]. run is a dict
+    # with run_name, model, metric and repetition, lines a dict {line name: values} in the order of the file. Only the
+    # lines in names are returned if given. Without update, nothing is written to the campaign folder (e.g. for the
+    # baseline of a comparison or archived campaigns): an up to date catalog is read and the files are parsed otherwise.
+    if update:
+        update_results_catalog(project_folder)
+    elif not is_catalog_current(project_folder):
+        return read_result_files(project_folder, kind, names)
+    if not os.path.exists(get_catalog_path(project_folder)):
+        return []
+
+    query = "SELECT runs.run_name, runs.model, runs.metric, runs.repetition, series.name, series.vals FROM series " \
+            "JOIN runs USING (run_id) WHERE series.kind = ?"
+    parameters = [kind]
+    if names is not None:
+        query += " AND series.name IN (" + ",".join("?" * len(names)) + ")"
+        parameters += list(names)
+    query += " ORDER BY runs.run_name, series.line"
+
+    connection = connect_catalog(project_folder, read_only=not update)
+    try:
+        results = []
+        for run_name, model, metric, repetition, name, values in connection.execute(query, parameters):
+            if len(results) == 0 or results[-1][0]["run_name"] != run_name:
+                results.append([{"run_name": run_name, "model": model, "metric": metric, "repetition": repetition}, {}])
+            results[-1][1][name] = np.frombuffer(values, dtype="<f8")
+        return results
+    finally:
+        connection.close()
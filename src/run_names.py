@@ -0,0 +1,34 @@
+import os
+
+# All metrics that are evaluated by the simulation runner
+SIMULATION_METRICS = ["Distance_To_Sparse_Cloud", "Density", "Normalized_Density", "Coverage", "Initial_Coverage", "Relative_Coverage",
+                      "Angle_Of_Incidence", "Baseline_Height_Ratio", "Camera_Standoff_Distance", "Triangulation_Uncertainty",
+                      "Saliency2D", "Mean_Curvature", "Plane_Local_Roughness", "Quadratic_Local_Roughness", "Saliency3D",
+                      "Unified", "RQF_V15", "Random"]
+
+
+def split_run_name(run_name, known_metrics=None):
+    # Split a run name of the form "{id}_{model}_{metric}_{repetition}" into its components. As model and metric names
+    # both contain underscores, the metric is identified as the longest known metric name at the end of the name.
+    if known_metrics is None:
+        known_metrics = SIMULATION_METRICS
+
+    run_name = os.path.basename(run_name)
+    if run_name.endswith(".txt"):
+        run_name = run_name[:-4]
+
+    id_string, remainder = run_name.split("_", 1)
+    model_and_metric, repetition = remainder.rsplit("_", 1)
+
+    metric = ""
+    for candidate in known_metrics:
+        if model_and_metric.endswith("_" + candidate) and len(candidate) > len(metric):
+            metric = candidate
+
+    # Fall back to the last name component for unknown metrics
+    if metric == "":
+        metric = model_and_metric.rsplit("_", 1)[-1]
+
+    model = model_and_metric[:-len(metric) - 1]
+
+    return int(id_string), model, metric, int(repetition)
@@ -0,0 +1,184 @@
+import os
+import re
+import time
+import signal
+import asyncio
+import subprocess
+
+# Patterns for picking up the progress of a run from the console output of the simulation executable
+PROGRESS_PATTERNS = {"images": re.compile(r"Images\D{0,3}(\d+)"),
+                     "completeness": re.compile(r"Completeness[^\d-]{0,8}(-?\d+(?:\.\d+)?)"),
+                     "pooled": re.compile(r"Pooled Value\D{0,3}(-?\d+(?:\.\d+)?(?:[eE]-?\d+)?)")}
+
+
+def create_progress():
+    # Per-iteration progress of a run keyed by the number of images
+    return {"iterations": {}, "latest_images": None}
+
+
+def update_progress(progress, images, completeness=None, pooled=None):
+    if images not in progress["iterations"]:
+        progress["iterations"][images] = {"completeness": None, "pooled": None}
+
+    iteration = progress["iterations"][images]
+    if completeness is not None:
+        iteration["completeness"] = completeness
+    if pooled is not None:
+        iteration["pooled"] = pooled
+    progress["latest_images"] = max(images, progress["latest_images"] or images)
+
+
+def parse_progress_line(progress, line):
+    # Extract image count, completeness and pooled value from a line of console output. Values without an image count
+    # belong to the latest iteration.
+    values = {}
+    for name, pattern in PROGRESS_PATTERNS.items():
+        match = pattern.search(line)
+        if match:
+            values[name] = float(match.group(1))
+
+    if "images" in values:
+        images = int(values["images"])
+    elif progress["latest_images"] is not None and len(values) > 0:
+        images = progress["latest_images"]
+    else:
+        return
+
+    update_progress(progress, images, values.get("completeness"), values.get("pooled"))
+
+
+def read_series(path, row_names):
+    # Read selected rows of a ";" separated result file that is possibly still being written
+    rows = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                splitted = line.rstrip().split(";")
+                for row_name in row_names:
+                    if splitted[0].startswith(row_name):
+                        rows[row_name] = [float(val) for val in splitted[1:] if val != ""]
+    except (OSError, ValueError):
+        pass
+    return rows
+
+
+def poll_result_files(progress, reco_folder):
+    # The executable updates its result files after every iteration, which is the most reliable progress source
+    global_metrics = read_series(reco_folder + "/global_metrics.txt", ["Images", "Completeness"])
+    if "Images" in global_metrics and "Completeness" in global_metrics:
+        for images, completeness in zip(global_metrics["Images"], global_metrics["Completeness"]):
+            update_progress(progress, int(images), completeness=completeness)
+
+    termination = read_series(reco_folder + "/termination.txt", ["Images", "Pooled Value"])
+    if "Images" in termination and "Pooled Value" in termination:
+        for images, pooled in zip(termination["Images"], termination["Pooled Value"]):
+            update_progress(progress, int(images), pooled=pooled)
+
+
+def completeness_has_plateaued(progress, patience, min_delta):
+    # The completeness plateaued if it improved by less than min_delta over the last `patience` iterations
+    completeness = [progress["iterations"][img]["completeness"] for img in sorted(progress["iterations"])]
+    completeness = [val for val in completeness if val is not None]
+
+    if len(completeness) <= patience:
+        return False
+
+    return max(completeness[-patience:]) - completeness[-patience - 1] < min_delta
+
+
+def format_progress(progress):
+    if progress["latest_images"] is None:
+        return "no progress yet"
+
+    iteration = progress["iterations"][progress["latest_images"]]
+    text = str(progress["latest_images"]) + " images"
+    if iteration["completeness"] is not None:
+        text += ", completeness " + str(round(iteration["completeness"], 2)) + "%"
+    if iteration["pooled"] is not None:
+        text += ", pooled value " + str(round(iteration["pooled"], 4))
+    return text
+
+
+def kill_process_tree(pid):
+    # The executable starts blender as a child process, so the whole tree needs to be stopped
+    if os.name == "nt":
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+async def stream_output(stream, log_file, prefix, progress):
+    # Forward the output of the process into the log file and parse the progress of every line
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+
+        text = line.decode(errors="replace")
+        log_file.write(prefix + text)
+        log_file.flush()
+        parse_progress_line(progress, text)
+
+
+async def start_supervised_process(call_args):
+    # Start the process in its own process group to be able to kill it including its children
+    if os.name == "nt":
+        return await asyncio.create_subprocess_exec(*call_args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                    creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+    return await asyncio.create_subprocess_exec(*call_args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                start_new_session=True)
+
+
+async def supervise_process(call_args, log_path, reco_folder, timeout=None, early_stopping=None, report=print, run_name="",
+                            poll_interval=5.0):
+    # Run the simulation executable while following its progress. Returns the reason the process ended ("exited",
+    # "timeout" or "stopped"), its return code and the collected per-iteration progress.
+    progress = create_progress()
+    start = time.time()
+    reason = "exited"
+
+    with open(log_path, "a") as log_file:
+        process = await start_supervised_process(call_args)
+        readers = [asyncio.ensure_future(stream_output(process.stdout, log_file, "", progress)),
+                   asyncio.ensure_future(stream_output(process.stderr, log_file, "[stderr] ", progress))]
+
+        waiter = asyncio.ensure_future(process.wait())
+        reported_images = None
+        while not waiter.done():
+            # Wake up at the timeout at the latest, so runs do not overshoot it by up to a poll interval
+            wait_time = poll_interval
+            if timeout is not None:
+                wait_time = max(0.0, min(poll_interval, timeout - (time.time() - start)))
+            await asyncio.wait([waiter], timeout=wait_time)
+            poll_result_files(progress, reco_folder)
+
+            # Report every new iteration
+            if progress["latest_images"] != reported_images:
+                reported_images = progress["latest_images"]
+                report("Run", run_name + ":", format_progress(progress))
+
+            if waiter.done():
+                break
+
+            if timeout is not None and time.time() - start >= timeout:
+                report("Run", run_name, "exceeded the timeout of", timeout, "seconds, killing it.")
+                reason = "timeout"
+                break
+
+            if early_stopping is not None and completeness_has_plateaued(progress, early_stopping["patience"], early_stopping["min_delta"]):
+                report("Run", run_name, "plateaued for", early_stopping["patience"], "iterations, stopping it early.")
+                reason = "stopped"
+                break
+
+        if not waiter.done():
+            kill_process_tree(process.pid)
+        await waiter
+        await asyncio.gather(*readers)
+
+    # Pick up the final state of the result files
+    poll_result_files(progress, reco_folder)
+
+    return reason, process.returncode, progress
@@ -0,0 +1,263 @@
+import numpy as np
+
+from src.results_catalog import query_results
+from src.runtime_prediction import predict_makespan
+
+# Runtime analytics on the iteration level. Every value of metric_runtimes.txt (MetricRuntime) and time_measurements.txt
+# (Runtime) is one record with the run it belongs to, the number of images of the iteration and the number of points of
+# the reconstruction at that time (from the Points line of the global metrics). The runtime of a component (a metric or a
+# stage like Rendering) is modelled as a power law seconds = scale * images^b * points^c, fitted by least squares on the
+# logarithms. The total iteration time is TOTAL if the runtime file has it and the sum of all stages otherwise.
+
+PERCENTILES = [50, 95, 99]
+
+# Aggregate lines of the metric runtime files that are no metric, skipped like in evaluate_average_metric_runtime
+METRIC_RUNTIME_AGGREGATES = ["TOTAL", "Output"]
+
+# Image step between two iterations if it can not be derived from the results
+DEFAULT_IMAGE_STEP = 5
+
+
+def split_runtime_lines(source, lines):
+    # Runtime values of every component of a result file as [component, seconds], aligned with its Images line. Runtime
+    # files without a TOTAL line get the sum of all stages as total, aggregates of metric runtime files are skipped.
+    images = lines["Images"]
+    components = []
+    stage_sum = np.zeros(len(images))
+    for line_name, values in lines.items():
+        component = line_name.replace(" [s]", "")
+        if component == "Images" or (source == "MetricRuntime" and component in METRIC_RUNTIME_AGGREGATES):
+            continue
+        values = values[:len(images)]
+        components.append([component, values])
+        if source == "Runtime" and component != "TOTAL":
+            stage_sum[:len(values)] += np.nan_to_num(values)
+
+    if source == "Runtime" and "TOTAL [s]" not in lines and "TOTAL" not in lines:
+        components.append(["TOTAL", stage_sum])
+    return components
+
+
+def load_runtime_iterations(campaign_folders, update=True):
+    # All runtime values of the campaigns as a dict of arrays with one entry per (run, component, iteration). Without
+    # update, the results catalogs of the campaigns are not created or updated.
+    records = {"campaign": [], "run_name": [], "model": [], "metric": [], "repetition": [], "source": [], "component": [],
+               "images": [], "points": [], "seconds": []}
+
+    def add(campaign, run, source, component, images, points, seconds):
+        count = len(seconds)
+        records["campaign"].extend([campaign] * count)
+        records["run_name"].extend([run["run_name"]] * count)
+        records["model"].extend([run["model"]] * count)
+        records["metric"].extend([run["metric"]] * count)
+        records["repetition"].extend([run["repetition"]] * count)
+        records["source"].extend([source] * count)
+        records["component"].extend([component] * count)
+        records["images"].append(np.asarray(images[:count], dtype=np.float64))
+        records["points"].append(np.asarray(points[:count], dtype=np.float64))
+        records["seconds"].append(np.asarray(seconds, dtype=np.float64))
+
+    for campaign in range(len(campaign_folders)):
+        folder = campaign_folders[campaign]
+
+        # Number of points per run and image count
+        points_per_run = {}
+        for run, lines in query_results(folder, "Metrics", ["Images", "Points"], update=update):
+            if "Images" in lines and "Points" in lines:
+                points_per_run[run["run_name"]] = dict(zip(lines["Images"], lines["Points"]))
+
+        for source in ["MetricRuntime", "Runtime"]:
+            for run, lines in query_results(folder, source, update=update):
+                if "Images" not in lines:
+                    continue
+                images = lines["Images"]
+                known_points = points_per_run.get(run["run_name"], {})
+                points = np.array([known_points.get(img, np.nan) for img in images])
+
+                for component, values in split_runtime_lines(source, lines):
+                    add(campaign, run, source, component, images, points, values)
+
+    arrays = {}
+    for key in ["campaign", "run_name", "model", "metric", "repetition", "source", "component"]:
+        arrays[key] = np.array(records[key])
+    for key in ["images", "points", "seconds"]:
+        arrays[key] = np.concatenate(records[key]) if len(records[key]) > 0 else np.zeros(0)
+    return arrays
+
+
+def select_iterations(iterations, mask):
+    return {key: values[mask] for key, values in iterations.items()}
+
+
+def get_components(iterations):
+    # Components in the order metric runtimes first, then stages, each sorted by name
+    pairs = sorted(set(zip(iterations["source"], iterations["component"])), key=lambda x: (x[0] != "MetricRuntime", x[1]))
+    return [list(pair) for pair in pairs]
+
+
+def calculate_runtime_percentiles(iterations):
+    # Count, mean, percentiles and maximum of the iteration runtime of every component
+    rows = []
+    for source, component in get_components(iterations):
+        seconds = iterations["seconds"][(iterations["source"] == source) & (iterations["component"] == component)]
+        seconds = seconds[~np.isnan(seconds)]
+        if len(seconds) == 0:
+            continue
+        row = {"source": source, "component": component, "count": len(seconds), "mean": float(np.mean(seconds)),
+               "max": float(np.max(seconds))}
+        for percentile, value in zip(PERCENTILES, np.percentile(seconds, PERCENTILES)):
+            row["p" + str(percentile)] = float(value)
+        rows.append(row)
+    return rows
+
+
+def fit_power_law(images, points, seconds):
+    # Fit seconds = scale * images^b * points^c on the logarithms. The point term is left out if the number of points is
+    # not known for all records or does not vary. Returns None if there are not enough positive values.
+    valid = (seconds > 0) & (images > 0)
+    if np.sum(valid) < 3 or np.ptp(np.log(images[valid])) == 0:
+        return None
+    use_points = bool(np.all(points[valid] > 0)) and np.ptp(np.log(points[valid])) > 0
+
+    columns = [np.ones(np.sum(valid)), np.log(images[valid])]
+    if use_points:
+        columns.append(np.log(points[valid]))
+    design = np.stack(columns, axis=1)
+    target = np.log(seconds[valid])
+
+    coefficients = np.linalg.lstsq(design, target, rcond=None)[0]
+    residual = target - design @ coefficients
+    total = np.sum((target - np.mean(target)) ** 2)
+    return {"scale": float(np.exp(coefficients[0])), "images_exponent": float(coefficients[1]),
+            "points_exponent": float(coefficients[2]) if use_points else 0.0,
+            "r2": float(1 - np.sum(residual ** 2) / total) if total > 0 else 1.0, "count": int(np.sum(valid))}
+
+
+def fit_scaling_models(iterations):
+    # Power law of every component over the number of images and points
+    rows = []
+    for source, component in get_components(iterations):
+        selected = (iterations["source"] == source) & (iterations["component"] == component)
+        fit = fit_power_law(iterations["images"][selected], iterations["points"][selected], iterations["seconds"][selected])
+        if fit is not None:
+            rows.append(dict(fit, source=source, component=component))
+    return rows
+
+
+def get_image_step(iterations):
+    # Most common difference between the image counts of two consecutive iterations
+    images = np.unique(iterations["images"][iterations["images"] > 0])
+    if len(images) < 2:
+        return DEFAULT_IMAGE_STEP
+    steps, counts = np.unique(np.diff(images), return_counts=True)
+    return int(steps[np.argmax(counts)])
+
+
+def create_iteration_time_predictor(iterations):
+    # Predict the total time of an iteration with a given number of images for a model and metric. As the number of
+    # points is not known before a campaign runs, the fits only use the number of images: per model and metric if that
+    # combination was observed, per metric otherwise and over all runs as the last resort.
+    totals = select_iterations(iterations, (iterations["source"] == "Runtime") & (iterations["component"] == "TOTAL"))
+    no_points = np.full(len(totals["seconds"]), np.nan)
+
+    pair_fits = {}
+    for model, metric in set(zip(totals["model"], totals["metric"])):
+        selected = (totals["model"] == model) & (totals["metric"] == metric)
+        pair_fits[(model, metric)] = fit_power_law(totals["images"][selected], no_points[selected], totals["seconds"][selected])
+
+    metric_fits = {}
+    for metric in set(totals["metric"]):
+        selected = totals["metric"] == metric
+        metric_fits[metric] = fit_power_law(totals["images"][selected], no_points[selected], totals["seconds"][selected])
+
+    global_fit = fit_power_law(totals["images"], no_points, totals["seconds"])
+
+    def predict(model, metric, images):
+        fit = pair_fits.get((model, metric))
+        if fit is None:
+            fit = metric_fits.get(metric)
+        if fit is None:
+            fit = global_fit
+        if fit is None:
+            return np.zeros(len(images))
+        return fit["scale"] * np.power(np.asarray(images, dtype=np.float64), fit["images_exponent"])
+
+    return predict
+
+
+def project_campaign(iterations, models, metrics, repetitions=1, maximum_images=300, image_step=None, workers=1):
+    # Predicted runtime of every run of a planned campaign that adds image_step images per iteration up to
+    # maximum_images, the summed runtime and the makespan on a pool of workers with the longest runs started first
+    if image_step is None:
+        image_step = get_image_step(iterations)
+    predict = create_iteration_time_predictor(iterations)
+    images = np.arange(image_step, maximum_images + 1, image_step)
+
+    jobs = []
+    for model in models:
+        for metric in metrics:
+            seconds = float(np.sum(predict(model, metric, images)))
+            for repetition in range(repetitions):
+                jobs.append({"model": model, "metric": metric, "repetition": repetition, "predicted_runtime": seconds})
+
+    jobs = sorted(jobs, key=lambda job: job["predicted_runtime"], reverse=True)
+    return jobs, sum(job["predicted_runtime"] for job in jobs), predict_makespan(jobs, workers)
+
+
+def write_table(rows, keys, output_path):
+    with open(output_path, "w") as f:
+        f.write(";".join(keys) + "\n")
+        for row in rows:
+            f.write(";".join(str(row[key]) for key in keys) + "\n")
+
+
+def plot_runtime_scaling(iterations, scaling, output_path):
+    # Median runtime per image count of every component with its fitted power law (for the median number of points)
+    from matplotlib import pyplot as plt
+    fits = {(row["source"], row["component"]): row for row in scaling}
+    components = [pair for pair in get_components(iterations) if tuple(pair) in fits]
+
+    cols = 6
+    rows = max(1, (len(components) + cols - 1) // cols)
+    plt.figure(figsize=(4.5 * 3.2, 2.2 * rows), dpi=150)
+    for i in range(len(components)):
+        source, component = components[i]
+        selected = (iterations["source"] == source) & (iterations["component"] == component)
+        images = iterations["images"][selected]
+        seconds = iterations["seconds"][selected]
+        fit = fits[(source, component)]
+
+        unique_images = np.unique(images[images > 0])
+        medians = [np.nanmedian(seconds[images == img]) for img in unique_images]
+        points = np.nanmedian(iterations["points"][selected]) if fit["points_exponent"] != 0 else 1.0
+
+        plt.subplot(rows, cols, i + 1)
+        plt.grid(alpha=0.5)
+        plt.loglog(unique_images, medians, "o", ms=2)
+        plt.loglog(unique_images, fit["scale"] * unique_images ** fit["images_exponent"] * points ** fit["points_exponent"], lw=1)
+        plt.title(component.replace("_", " ") + " ($b=" + str(round(fit["images_exponent"], 2)) + "$)", fontsize=8)
+        plt.xlabel("Images", fontsize=7)
+        plt.ylabel("Seconds", fontsize=7)
+        plt.tick_params(labelsize=6)
+
+    plt.tight_layout()
+    plt.savefig(output_path)
+    plt.close()
+
+
+def write_runtime_report(campaign_folders, output_folder, update=True):
+    # Percentiles and scaling models of all components as tables and the scaling figure
+    iterations = load_runtime_iterations(campaign_folders, update)
+    if len(iterations["seconds"]) == 0:
+        print("No runtime measurements found")
+        return iterations
+
+    percentiles = calculate_runtime_percentiles(iterations)
+    write_table(percentiles, ["source", "component", "count", "mean"] + ["p" + str(p) for p in PERCENTILES] + ["max"],
+                output_folder + "/runtime_percentiles.csv")
+
+    scaling = fit_scaling_models(iterations)
+    write_table(scaling, ["source", "component", "scale", "images_exponent", "points_exponent", "r2", "count"],
+                output_folder + "/runtime_scaling.csv")
+    plot_runtime_scaling(iterations, scaling, output_folder + "/runtime_scaling.png")
+    return iterations
@@ -0,0 +1,95 @@
+import heapq
+import numpy as np
+
+from src.campaign_manifest import load_manifest
+from src.run_names import split_run_name
+from src.results_catalog import query_results
+
+
+def calculate_total_runtime(lines):
+    # Total runtime in seconds of the lines of a time_measurements.txt file. If there is no explicit total, all measured
+    # entries are summed up.
+    total = None
+    summed = 0.0
+    for line_name, values in lines.items():
+        name = line_name.replace(" [s]", "")
+        if name == "Images":
+            continue
+
+        if name == "TOTAL":
+            total = np.nansum(values)
+        else:
+            summed += np.nansum(values)
+
+    if total is not None:
+        return float(total)
+    return float(summed)
+
+
+def collect_runtime_history(campaign_folders, known_metrics=None):
+    # Collect the observed runtime of every finished run as (model, metric, seconds). The wall-clock duration recorded
+    # in the campaign manifest is preferred, the runtime files are used for campaigns without one. Timed out runs are the
+    # longest ones, so they are included with the time until they were killed as a lower bound of their runtime.
+    observations = []
+    for folder in campaign_folders:
+        manifest = load_manifest(folder)
+        recorded = set()
+        for run_name, entry in manifest["runs"].items():
+            if entry["status"] in ["done", "timeout"] and entry.get("duration", 0) > 0:
+                observations.append([entry["model"], entry["metric"], entry["duration"]])
+                recorded.add(run_name)
+
+        for run, lines in query_results(folder, "Runtime", update=False):
+            if run["run_name"] in recorded:
+                continue
+
+            # Runs that are not in the manifest are identified by their name
+            _, model, metric, _ = split_run_name(run["run_name"], known_metrics)
+            seconds = calculate_total_runtime(lines)
+            if seconds > 0:
+                observations.append([model, metric, seconds])
+
+    return observations
+
+
+def create_runtime_predictor(observations):
+    # Predict the runtime of a model and metric combination. Combinations that were observed before use their mean
+    # runtime, unseen ones are estimated from a multiplicative model and metric factor relative to the global mean.
+    pair_values = {}
+    model_values = {}
+    metric_values = {}
+    for model, metric, seconds in observations:
+        pair_values.setdefault((model, metric), []).append(seconds)
+        model_values.setdefault(model, []).append(seconds)
+        metric_values.setdefault(metric, []).append(seconds)
+
+    global_mean = np.mean([obs[2] for obs in observations]) if len(observations) > 0 else 1.0
+
+    def predict(model, metric):
+        if (model, metric) in pair_values:
+            return float(np.mean(pair_values[(model, metric)]))
+
+        prediction = global_mean
+        if model in model_values:
+            prediction *= np.mean(model_values[model]) / global_mean
+        if metric in metric_values:
+            prediction *= np.mean(metric_values[metric]) / global_mean
+        return float(prediction)
+
+    return predict
+
+
+def order_longest_first(jobs, predict):
+    # Longest processing time first: starting the expensive runs early avoids a single long straggler at the end
+    for job in jobs:
+        job["predicted_runtime"] = predict(job["model"][0], job["metric"])
+    return sorted(jobs, key=lambda job: job["predicted_runtime"], reverse=True)
+
+
+def predict_makespan(jobs, number_of_workers):
+    # Simulate the greedy assignment of the pool: every job starts on the worker that becomes free first
+    workers = [0.0] * max(1, min(number_of_workers, len(jobs)))
+    for job in jobs:
+        earliest = heapq.heappop(workers)
+        heapq.heappush(workers, earliest + job.get("predicted_runtime", 0.0))
+    return max(workers)
@@ -0,0 +1,77 @@
+import os
+import threading
+
+from src.file_lock import try_create_exclusive, remove_if_stale, get_node_name
+
+
+def create_queue(project_folder, node_id=None, heartbeat_interval=30.0, stale_after=300.0, report=print):
+    # A coordinator-free work queue on a shared file system. Every node claims a run by atomically creating a claim
+    # file in the queue folder and refreshes the claims it holds while working on them. Claims that were not refreshed
+    # for a while belong to dead nodes and are taken over by the remaining ones. Messages of the worker threads and the
+    # heartbeat go through report.
+    queue_folder = project_folder + "/002_Queue"
+    os.makedirs(queue_folder, exist_ok=True)
+
+    if node_id is None:
+        node_id = get_node_name()
+
+    return {"folder": queue_folder,
+            "node_id": node_id,
+            "heartbeat_interval": heartbeat_interval,
+            "stale_after": stale_after,
+            "report": report,
+            "held": set(),
+            "lock": threading.Lock(),
+            "stopped": threading.Event()}
+
+
+def get_claim_path(queue, run_name):
+    return queue["folder"] + "/" + run_name + ".claim"
+
+
+def claim_run(queue, run_name):
+    # Try to claim a run for this node. Returns False if a live node already works on it.
+    claim_path = get_claim_path(queue, run_name)
+
+    while not try_create_exclusive(claim_path, queue["node_id"]):
+        if not remove_if_stale(claim_path, queue["stale_after"]):
+            return False
+        queue["report"]("Reclaiming abandoned run", run_name)
+
+    with queue["lock"]:
+        queue["held"].add(run_name)
+    return True
+
+
+def release_run(queue, run_name):
+    with queue["lock"]:
+        queue["held"].discard(run_name)
+
+    try:
+        os.remove(get_claim_path(queue, run_name))
+    except FileNotFoundError:
+        pass
+
+
+def heartbeat(queue):
+    # Refresh the modification time of all claims held by this node until the queue is stopped
+    while not queue["stopped"].wait(queue["heartbeat_interval"]):
+        with queue["lock"]:
+            held = list(queue["held"])
+
+        for run_name in held:
+            try:
+                os.utime(get_claim_path(queue, run_name), None)
+            except FileNotFoundError:
+                queue["report"]("Lost the claim of run", run_name)
+
+
+def start_heartbeat(queue):
+    thread = threading.Thread(target=heartbeat, args=(queue,), daemon=True)
+    thread.start()
+    return thread
+
+
+def stop_heartbeat(queue, thread):
+    queue["stopped"].set()
+    thread.join()
@@ -0,0 +1,278 @@
+import os
+import shutil
+import sqlite3
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.campaign_manifest import set_run_status, load_manifest
+from src.file_lock import get_node_name
+from src.shared_queue import claim_run, release_run, start_heartbeat, stop_heartbeat
+from src.run_supervisor import supervise_process
+from src.cloud_store import ingest_run, remove_run
+from src.results_catalog import ingest_run_results, remove_run_results
+
+# Files written by the simulation executable into the Reco folder and the result sub folder they are collected into
+HARVESTED_FILES = [["global_metrics.txt", "Metrics"],
+                   ["termination.txt", "Termination"],
+                   ["time_measurements.txt", "Runtime"],
+                   ["metric_runtimes.txt", "MetricRuntime"]]
+
+# Serializes the console output of the worker threads
+print_lock = threading.Lock()
+
+
+def log(*args):
+    with print_lock:
+        print(*args, flush=True)
+
+
+def create_result_folders(project_folder):
+    # Create the result folder structure (if it does not exist yet)
+    results_folder = project_folder + "/000_Results"
+    for sub_folder in ["", "/Metrics", "/Termination", "/MetricRuntime", "/Runtime", "/DenseClouds", "/Logs"]:
+        os.makedirs(results_folder + sub_folder, exist_ok=True)
+
+
+def build_call_args(job, settings):
+    # Assemble the command line of the simulation executable for a single run
+    model = job["model"]
+    return [settings["executable_folder"] + "/orthosfm-simulation-executable.exe",
+            "--currentRunID", str(job["run_id"]),
+            "--projectFolder", os.path.abspath(settings["project_folder"]).replace("\\", "\\\\"),
+            "--tripletName", job["run_name"],
+            "--modelName", model[0],
+            "--modelPath", os.path.abspath(model[1]).replace("\\", "\\\\"),
+            "--modelReferencePath", os.path.abspath(model[2]).replace("\\", "\\\\"),
+            "--scanZone", model[3],
+            "--metricName", job["metric"],
+            "--blenderPath", os.path.abspath(settings["blender"]).replace("\\", "\\\\"),
+            "--blenderFilePath", os.path.abspath(settings["blender_file"]).replace("\\", "\\\\"),
+            "--resourceFolder", os.path.abspath(settings["resource_folder"]).replace("\\", "\\\\")
+            ]
+
+
+def harvest_results(project_folder, run_name):
+    # Copy the results of a finished triplet into the shared result folders. Every file is first copied under a
+    # temporary name and then atomically moved in place, so runs finishing at the same time never see partial files.
+    reco_folder = project_folder + "/" + run_name + "/Reco"
+    results_folder = project_folder + "/000_Results"
+
+    harvested = []
+    for file_name, sub_folder in HARVESTED_FILES:
+        source = reco_folder + "/" + file_name
+        if not os.path.exists(source):
+            continue
+
+        target = results_folder + "/" + sub_folder + "/" + run_name + ".txt"
+        temporary = target + "." + get_node_name() + "_" + str(threading.get_ident()) + ".tmp"
+        shutil.copy(source, temporary)
+        os.replace(temporary, target)
+        harvested.append(target)
+
+    return harvested
+
+
+def remove_triplet_folder(project_folder, run_name):
+    triplet_folder = project_folder + "/" + run_name
+    if not os.path.exists(triplet_folder):
+        return
+
+    try:
+        shutil.rmtree(triplet_folder)
+    except OSError:
+        log("Failed to delete triplet folder!", triplet_folder)
+
+
+def remove_run_outputs(project_folder, run_name):
+    # Remove everything a previous attempt of the run left behind, as harvesting only overwrites the files a new attempt
+    # produces
+    remove_triplet_folder(project_folder, run_name)
+    shutil.rmtree(project_folder + "/000_Results/DenseClouds/" + run_name, ignore_errors=True)
+    remove_run(project_folder, run_name)
+    remove_run_results(project_folder, run_name)
+    for file_name, sub_folder in HARVESTED_FILES:
+        path = project_folder + "/000_Results/" + sub_folder + "/" + run_name + ".txt"
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def run_simulation_once(job, settings):
+    # Run the executable a single time under supervision and return "done", "failed" or "timeout"
+    call_args = build_call_args(job, settings)
+    log_path = settings["project_folder"] + "/000_Results/Logs/" + job["run_name"] + ".txt"
+    reco_folder = settings["project_folder"] + "/" + job["run_name"] + "/Reco"
+
+    # Only apply early stopping to the selected metrics
+    early_stopping = settings.get("early_stopping")
+    if early_stopping is not None and len(early_stopping["metrics"]) > 0 and job["metric"] not in early_stopping["metrics"]:
+        early_stopping = None
+
+    reason, return_code, progress = asyncio.run(supervise_process(call_args, log_path, reco_folder, settings["timeout"], early_stopping,
+                                                                  log, job["run_name"], settings.get("poll_interval", 5.0)))
+
+    if reason == "timeout":
+        return "timeout"
+
+    # Only count runs as successful if they produced the global metrics. Runs stopped on a completeness plateau count as
+    # finished, their partial results are harvested as usual.
+    if not os.path.exists(reco_folder + "/global_metrics.txt"):
+        return "failed"
+    if reason != "stopped" and return_code != 0:
+        return "failed"
+
+    return "done"
+
+
+def run_simulation(job, settings):
+    # Run a single simulation with the configured retry policy and collect its results
+    run_name = job["run_name"]
+    manifest = settings.get("manifest")
+    status = "failed"
+    duration = 0.0
+
+    for attempt in range(settings["retries"] + 1):
+        # Start every attempt without outputs of previous attempts, including the ones of an earlier campaign invocation
+        # that put the run back into the queue, so no stale output is harvested and reported as the output of this run
+        remove_run_outputs(settings["project_folder"], run_name)
+        if attempt > 0:
+            log("Retrying", run_name, "(attempt " + str(attempt + 1) + " of " + str(settings["retries"] + 1) + ")")
+            time.sleep(settings["retry_delay"])
+
+        log("========= Running Configuration:", run_name, "==========")
+        if manifest is not None:
+            set_run_status(settings["project_folder"], manifest, run_name, "running")
+
+        start = time.time()
+        status = run_simulation_once(job, settings)
+        duration = time.time() - start
+        log("Finished", run_name, "with status '" + status + "' after", round(duration, 1), "seconds")
+
+        if status == "done":
+            break
+
+    # Collect whatever the executable produced, even for failed runs
+    harvest_results(settings["project_folder"], run_name)
+
+    # Index the harvested result files, so the evaluation does not need to parse them
+    try:
+        ingest_run_results(settings["project_folder"], run_name, job["model"][0], job["metric"], job["repetition"])
+    except (OSError, sqlite3.Error) as e:
+        log("Failed to add the results of", run_name, "to the results catalog:", e)
+
+    # Convert the dense clouds of the run into the columnar cloud store, so the evaluation does not need to parse them
+    if settings.get("cloud_store") is not None:
+        try:
+            ingest_run(settings["project_folder"], run_name, job["model"][0], job["metric"], job["repetition"],
+                       settings["cloud_store"]["float32"], settings["cloud_store"]["compress"])
+        except (OSError, ValueError) as e:
+            log("Failed to add the dense clouds of", run_name, "to the cloud store:", e)
+
+    # Clean up the triplet folder
+    remove_triplet_folder(settings["project_folder"], run_name)
+
+    # Record the final state including the checksums of the harvested files
+    if manifest is not None:
+        set_run_status(settings["project_folder"], manifest, run_name, status, duration)
+
+    return status
+
+
+def run_simulations_in_parallel(jobs, settings, number_of_workers):
+    # Run all jobs on a pool of workers. The actual work happens in the simulation processes, so threads are sufficient.
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=number_of_workers) as executor:
+        futures = {}
+        for job in jobs:
+            futures[executor.submit(run_simulation, job, settings)] = job
+
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                statuses[job["run_name"]] = future.result()
+            except Exception as e:
+                log("Run", job["run_name"], "crashed:", e)
+                statuses[job["run_name"]] = "failed"
+
+            log("Progress:", len(statuses), "/", len(jobs), "runs finished")
+
+    summarize_statuses(statuses)
+    return statuses
+
+
+def take_next_job(remaining, remaining_lock, settings, queue):
+    # Claim the next run that is neither finished nor claimed by another node. Returns None if no runs are left and
+    # "wait" if all remaining runs are currently being worked on by other nodes.
+    with remaining_lock:
+        runs = load_manifest(settings["project_folder"])["runs"]
+        for job in list(remaining):
+            if runs[job["run_name"]]["status"] in ["done", "failed", "timeout"]:
+                remaining.remove(job)
+                continue
+
+            if not claim_run(queue, job["run_name"]):
+                continue
+
+            # Another node might have finished the run just before it released the claim
+            if load_manifest(settings["project_folder"])["runs"][job["run_name"]]["status"] in ["done", "failed", "timeout"]:
+                release_run(queue, job["run_name"])
+                remaining.remove(job)
+                continue
+
+            remaining.remove(job)
+            return job
+
+        if len(remaining) == 0:
+            return None
+        return "wait"
+
+
+def queue_worker(remaining, remaining_lock, settings, queue, statuses, poll_interval):
+    while True:
+        job = take_next_job(remaining, remaining_lock, settings, queue)
+        if job is None:
+            return
+        if job == "wait":
+            time.sleep(poll_interval)
+            continue
+
+        try:
+            statuses[job["run_name"]] = run_simulation(job, settings)
+        except Exception as e:
+            log("Run", job["run_name"], "crashed:", e)
+            statuses[job["run_name"]] = "failed"
+        finally:
+            release_run(queue, job["run_name"])
+
+
+def run_simulations_from_queue(jobs, settings, number_of_workers, queue, poll_interval=10.0):
+    # Work on a campaign that is shared with other nodes. Every worker claims runs from the shared queue until all
+    # runs of the campaign are finished, including the ones abandoned by nodes that died.
+    log("Node", queue["node_id"], "joined the campaign with", number_of_workers, "workers")
+    heartbeat_thread = start_heartbeat(queue)
+
+    remaining = list(jobs)
+    remaining_lock = threading.Lock()
+    statuses = {}
+    workers = []
+    for i in range(number_of_workers):
+        worker = threading.Thread(target=queue_worker, args=(remaining, remaining_lock, settings, queue, statuses, poll_interval))
+        worker.start()
+        workers.append(worker)
+
+    for worker in workers:
+        worker.join()
+
+    stop_heartbeat(queue, heartbeat_thread)
+
+    log("Node", queue["node_id"], "finished", len(statuses), "runs")
+    summarize_statuses(statuses)
+    return statuses
+
+
+def summarize_statuses(statuses):
+    for status in ["done", "failed", "timeout"]:
+        count = list(statuses.values()).count(status)
+        if count > 0:
+            log(count, "runs", status)
@@ -0,0 +1,203 @@
+import os
+import zlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from src.run_names import SIMULATION_METRICS
+from src.campaign_manifest import collect_output_checksums, save_manifest, create_run_name
+
+# Names of the models in the dataset, used for the first synthetic models
+DATASET_MODELS = ["Aphrodite_of_melos", "Bust_of_roza_loewenfeld", "Sculpture_st_anna", "Carved_perfum_bottle",
+                  "Coffin_from_el_hiba", "Dinosaur_footprint", "Fragment_plaque", "Funerary_stela",
+                  "Antique_figure", "Wooden_apothecary_vessel", "Baba", "Bike", "Candlestick", "Storm_Bird"]
+
+# Per-vertex properties of the dense clouds written by the simulation executable
+POINT_METRICS = ["Distance_To_Edge", "Density", "Normalized_Density", "Coverage", "Initial_Coverage", "Relative_Coverage",
+                 "Angle_Of_Incidence", "Baseline_Height_Ratio", "Camera_Standoff_Distance", "Triangulation_Uncertainty",
+                 "Saliency2D", "Mean_Curvature", "Plane_Local_Roughness", "Quadratic_Local_Roughness", "Saliency3D",
+                 "Unified", "Combined_Metrics", "Depth_Map_Uncertainty", "Brightness_Index", "Distance_To_Vertices",
+                 "TSDF_Value", "Viewplanability"]
+
+# Number of points that are generated and written at once
+CHUNK_SIZE = 1 << 20
+
+
+def get_model_names(number_of_models):
+    names = DATASET_MODELS[:number_of_models]
+    for i in range(len(names), number_of_models):
+        names.append("Synthetic_model_" + str(i).zfill(3))
+    return names
+
+
+def create_vertex_dtype(point_metrics):
+    fields = [("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("nx", "<f4"), ("ny", "<f4"), ("nz", "<f4"),
+              ("red", "u1"), ("green", "u1"), ("blue", "u1")]
+    for metric in point_metrics:
+        fields.append((metric, "<f4"))
+    fields.append(("confidence", "<f4"))
+    fields.append(("view_id", "<i4"))
+    return np.dtype(fields)
+
+
+def write_ply_header(f, vertex_dtype, number_of_points):
+    ply_types = {"<f4": "float", "u1": "uchar", "<i4": "int"}
+    header = "ply\nformat binary_little_endian 1.0\nelement vertex " + str(number_of_points) + "\n"
+    for name in vertex_dtype.names:
+        header += "property " + ply_types[vertex_dtype[name].str.replace("|", "")] + " " + name + "\n"
+    header += "end_header\n"
+    f.write(header.encode("ascii"))
+
+
+def write_dense_cloud(path, number_of_points, point_metrics, mixing, trend, seed):
+    # Write a binary dense cloud in chunks, so clouds with hundreds of millions of points never need to fit in memory.
+    # The metrics are driven by a few shared latent factors, which gives them a realistic correlation structure, and
+    # drift with the progress of the reconstruction (trend).
+    rng = np.random.default_rng(seed)
+    vertex_dtype = create_vertex_dtype(point_metrics)
+
+    with open(path + ".tmp", "wb") as f:
+        write_ply_header(f, vertex_dtype, number_of_points)
+
+        written = 0
+        while written < number_of_points:
+            count = min(CHUNK_SIZE, number_of_points - written)
+            chunk = np.empty(count, dtype=vertex_dtype)
+
+            # Points on a noisy unit sphere
+            normals = rng.standard_normal((count, 3)).astype(np.float32)
+            normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+            points = normals * rng.uniform(0.45, 0.5, (count, 1)).astype(np.float32)
+            for i, axis in enumerate(["x", "y", "z"]):
+                chunk[axis] = points[:, i]
+                chunk["n" + axis] = normals[:, i]
+
+            colors = rng.integers(0, 256, (count, 3), dtype=np.uint8)
+            chunk["red"], chunk["green"], chunk["blue"] = colors[:, 0], colors[:, 1], colors[:, 2]
+
+            # Metric responses in [0, 1]
+            latent = rng.standard_normal((count, mixing.shape[0])).astype(np.float32)
+            responses = latent @ mixing + trend + 0.5 * rng.standard_normal((count, len(point_metrics))).astype(np.float32)
+            responses = 1.0 / (1.0 + np.exp(-responses))
+            for i, metric in enumerate(point_metrics):
+                chunk[metric] = responses[:, i]
+
+            chunk["confidence"] = rng.uniform(0, 1, count)
+            chunk["view_id"] = rng.integers(0, 300, count)
+
+            chunk.tofile(f)
+            written += count
+
+    os.replace(path + ".tmp", path)
+
+
+def create_run_series(rng, images, difficulty, quality):
+    # Saturating completeness curve, noisy but monotonically increasing
+    time_constant = 5.0 + 40.0 * difficulty * (1.5 - quality)
+    final_completeness = 100.0 - 15.0 * difficulty * (1.0 - quality) - rng.uniform(0, 3)
+    completeness = final_completeness * (1.0 - np.exp(-images / time_constant))
+    completeness = np.maximum.accumulate(np.clip(completeness + rng.normal(0, 0.5, len(images)), 0, 100))
+
+    pooled_value = np.clip(0.2 + 0.7 * completeness / 100 + rng.normal(0, 0.03, len(images)), 0, 1)
+    return completeness, pooled_value
+
+
+def write_series_file(path, rows):
+    # Write a ";" separated result file with one named series per line
+    with open(path, "w") as f:
+        for name, values in rows:
+            if np.issubdtype(np.asarray(values).dtype, np.integer):
+                f.write(name + ";" + ";".join(str(int(val)) for val in values) + "\n")
+            else:
+                f.write(name + ";" + ";".join(str(round(float(val), 6)) for val in values) + "\n")
+
+
+def write_run(results_folder, run_name, rng, images, difficulty, quality, points_per_cloud, point_metrics):
+    completeness, pooled_value = create_run_series(rng, images, difficulty, quality)
+
+    write_series_file(results_folder + "/Metrics/" + run_name + ".txt",
+                      [["Images", images],
+                       ["Completeness [%]", completeness],
+                       ["Points", np.round(points_per_cloud * completeness / 100)]])
+
+    write_series_file(results_folder + "/Termination/" + run_name + ".txt",
+                      [["Images", images], ["Pooled Value", pooled_value]])
+
+    # Metric runtimes grow with the number of images and points of the reconstruction
+    size_factor = (images / images[-1]) * (points_per_cloud / 1e6)
+    metric_rows = [["Images", images]]
+    total = np.zeros(len(images))
+    for metric in point_metrics:
+        base = 0.05 + 2.0 * (zlib.crc32(metric.encode()) % 100) / 100.0
+        runtime = base * (0.2 + size_factor) * rng.lognormal(0, 0.2, len(images))
+        metric_rows.append([metric + " [s]", runtime])
+        total += runtime
+    metric_rows.append(["TOTAL [s]", total])
+    write_series_file(results_folder + "/MetricRuntime/" + run_name + ".txt", metric_rows)
+
+    reconstruction = (1.0 + 0.5 * images) * rng.lognormal(0, 0.2, len(images))
+    rendering = 2.0 * rng.lognormal(0, 0.1, len(images))
+    write_series_file(results_folder + "/Runtime/" + run_name + ".txt",
+                      [["Images", images],
+                       ["Rendering [s]", rendering],
+                       ["Reconstruction [s]", reconstruction],
+                       ["TOTAL [s]", rendering + reconstruction + total]])
+
+
+def generate_synthetic_results(output_folder, number_of_models=14, metrics=None, repetitions=1, iterations=30,
+                               image_step=5, points_per_cloud=100000, clouds_per_run=5, point_metrics=None, seed=0,
+                               workers=1):
+    # Write a 000_Results tree in the layout produced by run_simulations.py
+    if metrics is None:
+        metrics = SIMULATION_METRICS
+    if point_metrics is None:
+        point_metrics = POINT_METRICS
+
+    models = get_model_names(number_of_models)
+
+    results_folder = output_folder + "/000_Results"
+    for sub_folder in ["Metrics", "Termination", "Runtime", "MetricRuntime", "DenseClouds"]:
+        os.makedirs(results_folder + "/" + sub_folder, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    mixing = rng.normal(0, 1, (4, len(point_metrics))).astype(np.float32)
+    model_difficulty = rng.uniform(0.2, 1.0, len(models))
+    metric_quality = rng.uniform(0.0, 1.0, len(metrics))
+    metric_trend = rng.normal(0, 1.5, len(point_metrics)).astype(np.float32)
+
+    manifest = {"runs": {}}
+    cloud_tasks = []
+    counter = 0
+    for m in range(len(models)):
+        for k in range(len(metrics)):
+            for i in range(repetitions):
+                run_name = create_run_name(counter, models[m], metrics[k], i)
+
+                # Runs stop after a varying number of iterations, which gives ragged series
+                run_iterations = max(2, iterations - int(rng.integers(0, max(1, iterations // 3))))
+                images = image_step * np.arange(1, run_iterations + 1)
+                write_run(results_folder, run_name, rng, images, model_difficulty[m], metric_quality[k], points_per_cloud, point_metrics)
+
+                # Dense clouds are written for evenly spread iterations
+                cloud_folder = results_folder + "/DenseClouds/" + run_name
+                os.makedirs(cloud_folder, exist_ok=True)
+                for index in np.unique(np.linspace(0, run_iterations - 1, min(clouds_per_run, run_iterations)).astype(int)):
+                    cloud_path = cloud_folder + "/dense_cloud_" + str(images[index]) + ".ply"
+                    progress = index / max(1, run_iterations - 1) - 0.5
+                    cloud_tasks.append([cloud_path, points_per_cloud, point_metrics, mixing, progress * metric_trend, [seed, counter, int(index)]])
+
+                manifest["runs"][run_name] = {"run_id": counter, "model": models[m], "metric": metrics[k], "repetition": i, "status": "done",
+                                              "attempts": 1, "outputs": collect_output_checksums(output_folder, run_name)}
+                counter += 1
+
+    # Record model and metric of every run like the simulation runner does
+    save_manifest(output_folder, manifest)
+
+    print("Writing", len(cloud_tasks), "dense clouds with", points_per_cloud, "points each..")
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(write_dense_cloud, *zip(*cloud_tasks)))
+    else:
+        for task in cloud_tasks:
+            write_dense_cloud(*task)
+
+    return counter
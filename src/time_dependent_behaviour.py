@@ -1,103 +1,119 @@
-import os
-from glob import glob
-from plyfile import PlyData, PlyElement, PlyProperty
 import numpy as np
-from matplotlib import pyplot as plt
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from src.cloud_store import list_dense_clouds, get_cloud_columns
+from src.results_catalog import query_results
+from src.pooled_stats import get_pooled_stats, calculate_minkowski_pooling
+
+# Properties of the dense clouds that are not pooled
+POOLING_IGNORE_LIST = ["view_id", "Depth_Map_Uncertainty", "Brightness_Index", "Distance_To_Vertices", "TSDF_Value", "Viewplanability", "Output", "confidence", "Combined_Metrics"]
+
+def pool_dense_cloud(cloud, ignore_list, power):
+    # Select the metric properties
+    metric_names = []
+    for name in get_cloud_columns(cloud):
+        # Skip xyz, rgb and normal
+        if name in ["x", "y", "z", "red", "green", "blue", "nx", "ny", "nz"]:
+            continue
+
+        if name in ignore_list:
+            continue
+
+        metric_names.append(name)
+
+    # Pool all metric columns of the dense cloud at once (or take the pooled values from its sidecar file)
+    points, pooled_stats = get_pooled_stats(cloud, metric_names, [power])
+
+    # Calculate the minkowski pooling for the values
+    pooled_values = {}
+    for name in metric_names:
+        pooled_values[name] = calculate_minkowski_pooling(points, pooled_stats[name], power)
+
+    return pooled_values
+
+def plot_metrics_over_time_with_averaging(project_folder, output_path, power=3, workers=1):
+    from tqdm import tqdm
 
-def plot_metrics_over_time_with_averaging(project_folder, output_path):
-    # First get all sub folders
-    sub_folders = glob(project_folder + "/000_Results/DenseClouds/*")
-    
     # Ignore list
-    ignore_list = ["view_id", "Depth_Map_Uncertainty", "Brightness_Index", "Distance_To_Vertices", "TSDF_Value", "Viewplanability", "Output", "confidence", "Combined_Metrics"]
+    ignore_list = POOLING_IGNORE_LIST
     
     # Accumulate the values in a recursive dictionary. The first key is always the metric name, the second one is the number of images, which includes the actual data points
     metric_values = {}
     
-    # Loop over all of them
-    for sub in sub_folders:
-        # Get all plys in the folder
-        dense_clouds = glob(sub + "/*.ply")
-        
-        # Loop over all dense clouds
-        for cloud in dense_clouds:
-            # Extract the image number
-            image_number = int(str(os.path.basename(cloud)).replace("dense_cloud_","").replace(".ply",""))
-
-            # Load the dense cloud
-            pcl = PlyData.read(os.path.abspath(cloud))
-
-            # Loop over all properties of the vertex element
-            for elem in pcl.elements:
-                elem : PlyElement
-                # Skip if the element is not
-                if elem.name != "vertex":
-                    continue
-
-                for prop in elem.properties:
-                    prop : PlyProperty
-
-                    # Skip xyz, rgb and normal
-                    if prop.name in ["x", "y", "z", "red", "green", "blue", "nx", "ny", "nz"]:
-                        continue
-                    
-                    if prop.name in ignore_list:
-                        continue
-
-                    # Get the data
-                    values = np.array(elem.data[prop.name])
-
-                    # Calculate the minkowski pooling for the values
-                    power = 3
-                    minkowski = np.power(np.sum(np.power(values, power)) / len(values), 1/power)
-                    #minkowski = np.mean(values)
-                    #std = np.std(values)
-
-                    # Check for validity
-                    if minkowski > 1 or minkowski < 0:
-                        continue
-                    
-                    # Initialize the sub dict if necessary
-                    if prop.name not in metric_values:
-                        metric_values[prop.name] = {}
-                        
-                    # Initialize the sub sub dict if necessary
-                    if str(image_number) not in metric_values[prop.name]:
-                        # Add to dict
-                        metric_values[prop.name][str(image_number)] = []
-                        
-                    # Add to list of values
-                    metric_values[prop.name][str(image_number)].append(minkowski)
-                    
-                    
-    # Loop over all termination files to get the pooled RQF metric from there
-    termination_files = glob(project_folder + "/000_Results/Termination/*.txt")
-    for termi in termination_files:
-        with open(termi, "r") as f:
-            # Collect the images and values
-            images = []
-            values = []
+    # Pool all dense clouds of all runs (converted ones are read from the cloud store). The clouds are independent of
+    # each other, so they can be pooled by a pool of processes that only return the pooled values.
+    dense_clouds = list_dense_clouds(project_folder)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pooled_clouds = list(tqdm(executor.map(pool_dense_cloud, dense_clouds, repeat(ignore_list), repeat(power), chunksize=4),
+                                      total=len(dense_clouds), desc="Pooling dense clouds"))
+    else:
+        pooled_clouds = [pool_dense_cloud(cloud, ignore_list, power) for cloud in tqdm(dense_clouds, desc="Pooling dense clouds")]
+
+    # The results are in the order of the clouds, so the merged values do not depend on the number of workers
+    for cloud, pooled_values in zip(dense_clouds, pooled_clouds):
+        # Extract the image number
+        image_number = cloud["images"]
+
+        for name in pooled_values:
+            minkowski = pooled_values[name]
+            #minkowski = np.mean(values)
+            #std = np.std(values)
+
+            # Check for validity
+            if minkowski > 1 or minkowski < 0:
+                continue
             
-            for line in f:
-                # Get images
-                if line.startswith("Images"):
-                    images = line.rstrip().split(";")[1:]
+            # Initialize the sub dict if necessary
+            if name not in metric_values:
+                metric_values[name] = {}
                 
-                # Get the pooled value
-                if line.startswith("Pooled Value"):
-                    values = line.rstrip().split(";")[1:]
-                    
-            if "RQF (ours)" not in metric_values:
-                metric_values["RQF (ours)"] = {}
+            # Initialize the sub sub dict if necessary
+            if str(image_number) not in metric_values[name]:
+                # Add to dict
+                metric_values[name][str(image_number)] = []
                 
-            for img, val in zip(images, values):
-                if img not in metric_values["RQF (ours)"]:
-                    metric_values["RQF (ours)"][img] = []
+            # Add to list of values
+            metric_values[name][str(image_number)].append(minkowski)
                 
-                metric_values["RQF (ours)"][img].append(float(val))
+    # Loop over all termination results to get the pooled RQF metric from there
+    for run, lines in query_results(project_folder, "Termination", ["Images", "Pooled Value"]):
+        # Collect the images and values
+        images = [str(int(img)) for img in lines.get("Images", [])]
+        values = lines.get("Pooled Value", [])
                 
-                    
-        
+        if "RQF (ours)" not in metric_values:
+            metric_values["RQF (ours)"] = {}
+            
+        for img, val in zip(images, values):
+            if img not in metric_values["RQF (ours)"]:
+                metric_values["RQF (ours)"][img] = []
+            
+            metric_values["RQF (ours)"][img].append(float(val))
+
+    # Mean and standard deviation of every metric per number of images
+    summaries = {}
+    for name in metric_values:
+        # Create lists for images and values
+        images = []
+        values = []
+        std = []
+        for img_str in metric_values[name]:
+            if len(img_str) != 0:
+                images.append(int(img_str))
+                values.append(np.mean(metric_values[name][img_str]))
+                std.append(np.std(metric_values[name][img_str]))
+        summaries[name] = [images, values, std]
+
+    draw_metrics_over_time(summaries, output_path)
+
+
+def draw_metrics_over_time(summaries, output_path):
+    # One panel per metric with the mean and the standard deviation of its pooled values, given as [images, mean, std]
+    from matplotlib import pyplot as plt
+    metric_values = summaries
+
     # Figure out how many sub plots we need
     cols = 6
     rows = len(metric_values.values()) // cols
@@ -112,17 +128,7 @@ def plot_metrics_over_time_with_averaging(project_folder, output_path):
     for name in metric_values:
         # Increase the counter
         counter += 1
-        
-        # Create lists for images and values
-        images = []
-        values = []
-        std = []
-        for img_str in metric_values[name]:
-            if len(img_str) != 0:
-                images.append(int(img_str))
-                values.append(np.mean(metric_values[name][img_str]))
-                std.append(np.std(metric_values[name][img_str]))
-        
+        images, values, std = metric_values[name]
 
         # Define which subplots
         plt.subplot(rows, cols, counter)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+import os
+import sys
+import hashlib
+import argparse
+
+# Stand-in for blender that renders a deterministic "image" from the content of its inputs. Every call is appended to
+# the file in STUB_BLENDER_LOG, so tests can count the renders that were not served from the cache.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scene')
+    parser.add_argument('--pose', required=True)
+    parser.add_argument('--textures', required=True)
+    parser.add_argument('-o', '--render-output', required=True)
+    args = parser.parse_args()
+
+    sha = hashlib.sha256()
+    for path in [args.scene, args.pose] + [args.textures + "/" + name for name in sorted(os.listdir(args.textures))]:
+        with open(path, "rb") as f:
+            sha.update(f.read())
+
+    # 1000 bytes per rendering
+    with open(args.render_output, "w") as f:
+        f.write((sha.hexdigest() * 16)[:1000])
+
+    # A file that another process writes next to the inputs during the render
+    if "STUB_BLENDER_SIDE_FILE" in os.environ:
+        with open(os.environ["STUB_BLENDER_SIDE_FILE"], "w") as f:
+            f.write("side")
+
+    with open(os.environ["STUB_BLENDER_LOG"], "a") as f:
+        f.write(" ".join(sys.argv[1:]) + "\n")
+    print("Rendered", args.render_output)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import os
+import time
+import argparse
+
+# Stand-in for orthosfm-simulation-executable that writes small result files into the Reco folder of its triplet after
+# sleeping for STUB_SIMULATION_SECONDS (default 0.5). Every completed run is appended to the file in
+# STUB_SIMULATION_LOG.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--projectFolder', required=True)
+    parser.add_argument('--tripletName', required=True)
+    parser.add_argument('--metricName', required=True)
+    args, _ = parser.parse_known_args()
+
+    reco_folder = args.projectFolder + "/" + args.tripletName + "/Reco"
+    os.makedirs(reco_folder, exist_ok=True)
+    time.sleep(float(os.environ.get("STUB_SIMULATION_SECONDS", "0.5")))
+
+    with open(reco_folder + "/global_metrics.txt", "w") as f:
+        f.write("Images;5;10\nCompleteness [%];50.0;95.0\nPoints;1000;2000\n")
+    with open(reco_folder + "/termination.txt", "w") as f:
+        f.write("Images;5;10\nPooled Value;0.5;0.9\n")
+    with open(reco_folder + "/time_measurements.txt", "w") as f:
+        f.write("Images;5;10\nRendering [s];1.0;1.5\n")
+
+    if "STUB_SIMULATION_LOG" in os.environ:
+        with open(os.environ["STUB_SIMULATION_LOG"], "a") as f:
+            f.write(args.tripletName + "\n")
+    print("Images: 10 Completeness: 95.0")
@@ -0,0 +1,49 @@
+import os
+import glob
+
+from src.synthetic_results import generate_synthetic_results
+from src.evaluation_pipeline import run_evaluation
+
+PARAMETERS = {"workers": 1, "correlation_mode": "exact", "bootstrap_samples": 100}
+
+
+def create_campaign(folder):
+    generate_synthetic_results(folder, number_of_models=2, metrics=["Density", "Coverage"], iterations=5,
+                               points_per_cloud=100, clouds_per_run=1)
+
+
+def get_stage_folders(folder, stage_name):
+    return glob.glob(folder + "/003_Cache/evaluation/" + stage_name + "/*")
+
+
+def test_cached_stage_is_reused(tmp_path):
+    folder = str(tmp_path)
+    create_campaign(folder)
+    assert run_evaluation(folder, PARAMETERS, ["alpha_completeness"]) == []
+
+    stage_folders = get_stage_folders(folder, "alpha_completeness")
+    assert len(stage_folders) == 1
+    with open(stage_folders[0] + "/marker.txt", "w") as f:
+        f.write("cached")
+
+    assert run_evaluation(folder, PARAMETERS, ["alpha_completeness"]) == []
+    assert os.path.exists(stage_folders[0] + "/marker.txt")
+
+
+def test_force_replaces_cached_stage(tmp_path):
+    folder = str(tmp_path)
+    create_campaign(folder)
+    assert run_evaluation(folder, PARAMETERS, ["alpha_completeness"]) == []
+
+    # Mark the cached result, a forced evaluation needs to replace the whole folder
+    stage_folder = get_stage_folders(folder, "alpha_completeness")[0]
+    with open(stage_folder + "/marker.txt", "w") as f:
+        f.write("stale")
+    with open(stage_folder + "/alpha_completeness_plot.png", "wb") as f:
+        f.write(b"stale")
+
+    assert run_evaluation(folder, PARAMETERS, ["alpha_completeness"], force=True) == []
+    assert get_stage_folders(folder, "alpha_completeness") == [stage_folder]
+    assert not os.path.exists(stage_folder + "/marker.txt")
+    with open(folder + "/001_Figures/alpha_completeness_plot.png", "rb") as f:
+        assert f.read(8) == b"\x89PNG\r\n\x1a\n"
@@ -0,0 +1,39 @@
+import numpy as np
+from scipy.stats import spearmanr
+
+from src.rank_correlation import calculate_spearman_correlation
+
+
+def create_tied_matrix(number_of_rows, seed=0):
+    # A metric that is mostly 0, a noisy copy of it and an independent column
+    rng = np.random.default_rng(seed)
+    values = rng.random(number_of_rows)
+    tied = np.where(values < 0.8, 0.0, values)
+    return np.stack([tied, values + rng.random(number_of_rows), rng.random(number_of_rows)], axis=1)
+
+
+def test_exact_mode_matches_spearmanr_on_tied_columns(tmp_path):
+    data_matrix = create_tied_matrix(200000)
+    correlation, error_bound = calculate_spearman_correlation(data_matrix, "exact", chunk_size=10000, workers=1,
+                                                              work_folder=str(tmp_path))
+    assert error_bound == 0.0
+    assert np.allclose(correlation, spearmanr(data_matrix).correlation, atol=1e-10)
+
+
+def test_exact_mode_does_not_load_tied_buckets(tmp_path, monkeypatch):
+    # The block of 160000 zeros needs to be ranked without reading more than a chunk of records at once
+    chunk_size = 10000
+    largest = [0]
+    fromfile = np.fromfile
+
+    def counting_fromfile(*args, **kwargs):
+        records = fromfile(*args, **kwargs)
+        largest[0] = max(largest[0], len(records))
+        return records
+
+    monkeypatch.setattr(np, "fromfile", counting_fromfile)
+    data_matrix = create_tied_matrix(200000)
+    correlation, _ = calculate_spearman_correlation(data_matrix, "exact", chunk_size=chunk_size, workers=1,
+                                                    work_folder=str(tmp_path))
+    assert 0 < largest[0] <= chunk_size
+    assert np.allclose(correlation, spearmanr(data_matrix).correlation, atol=1e-10)
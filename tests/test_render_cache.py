@@ -0,0 +1,98 @@
+import os
+import sys
+import subprocess
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_BLENDER = ROOT_FOLDER + "/tests/stub_blender.py"
+
+
+def create_inputs(folder):
+    os.makedirs(folder + "/scene")
+    os.makedirs(folder + "/textures")
+    os.makedirs(folder + "/renders")
+    with open(folder + "/scene/model.blend", "w") as f:
+        f.write("scene")
+    with open(folder + "/pose.txt", "w") as f:
+        f.write("0 0 0")
+    with open(folder + "/textures/albedo.png", "w") as f:
+        f.write("red")
+
+
+def render(folder, output_name, max_gb=50.0, side_file=None):
+    # Call the wrapper like the simulation executable calls blender and return the number of real renders so far
+    environment = dict(os.environ, BLENDER_CACHE_REAL_BLENDER=STUB_BLENDER, BLENDER_CACHE_DIR=folder + "/cache",
+                       BLENDER_CACHE_MAX_GB=str(max_gb), STUB_BLENDER_LOG=folder + "/renders.log")
+    if side_file is not None:
+        environment["STUB_BLENDER_SIDE_FILE"] = side_file
+    arguments = [folder + "/scene/model.blend", "--pose", folder + "/pose.txt", "--textures", folder + "/textures",
+                 "-o", folder + "/renders/" + output_name]
+    result = subprocess.run([sys.executable, ROOT_FOLDER + "/blender_cache.py"] + arguments, env=environment,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert "Rendered" in result.stdout
+    with open(folder + "/renders.log", "r") as f:
+        return len(f.readlines())
+
+
+def read(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def test_miss_then_hit(tmp_path):
+    folder = str(tmp_path)
+    create_inputs(folder)
+    assert render(folder, "first.png") == 1
+    assert render(folder, "second.png") == 1
+    assert read(folder + "/renders/first.png") == read(folder + "/renders/second.png")
+
+
+def test_changed_input_file_misses(tmp_path):
+    folder = str(tmp_path)
+    create_inputs(folder)
+    assert render(folder, "first.png") == 1
+    with open(folder + "/pose.txt", "w") as f:
+        f.write("1 0 0")
+    assert render(folder, "second.png") == 2
+    assert read(folder + "/renders/first.png") != read(folder + "/renders/second.png")
+
+
+def test_changed_input_folder_misses(tmp_path):
+    folder = str(tmp_path)
+    create_inputs(folder)
+    assert render(folder, "first.png") == 1
+    with open(folder + "/textures/albedo.png", "w") as f:
+        f.write("blue")
+    assert render(folder, "second.png") == 2
+    assert read(folder + "/renders/first.png") != read(folder + "/renders/second.png")
+
+
+def test_files_next_to_inputs_are_not_cached(tmp_path):
+    folder = str(tmp_path)
+    create_inputs(folder)
+    side_file = folder + "/scene/side.txt"
+    assert render(folder, "first.png", side_file=side_file) == 1
+    os.remove(side_file)
+    assert render(folder, "second.png", side_file=side_file) == 1
+    assert not os.path.exists(side_file)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    folder = str(tmp_path)
+    create_inputs(folder)
+
+    # Room for two renderings of 1000 bytes
+    max_gb = 2500 / 1024 ** 3
+
+    def render_pose(pose, output_name):
+        with open(folder + "/pose.txt", "w") as f:
+            f.write(pose)
+        return render(folder, output_name, max_gb)
+
+    assert render_pose("a", "a1.png") == 1
+    assert render_pose("b", "b1.png") == 2
+    # Using a makes b the least recently used entry, which is evicted by c
+    assert render_pose("a", "a2.png") == 2
+    assert render_pose("c", "c1.png") == 3
+    assert render_pose("a", "a3.png") == 3
+    assert render_pose("b", "b2.png") == 4
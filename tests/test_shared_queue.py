@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import subprocess
+
+ROOT_FOLDER = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+STUB_EXECUTABLE = ROOT_FOLDER + "/tests/stub_simulation_executable.py"
+
+MODELS = ["000_Model_a", "001_Model_b"]
+NUMBER_OF_NODES = 3
+
+
+def create_campaign_inputs(folder):
+    # A dataset with two models and an executable folder holding the stub executable
+    for model in MODELS:
+        os.makedirs(folder + "/dataset/" + model)
+    os.makedirs(folder + "/executable/resources")
+    shutil.copy(STUB_EXECUTABLE, folder + "/executable/orthosfm-simulation-executable.exe")
+    os.chmod(folder + "/executable/orthosfm-simulation-executable.exe", 0o755)
+
+
+def start_node(folder, node_id):
+    environment = dict(os.environ, STUB_SIMULATION_SECONDS="0.5", STUB_SIMULATION_LOG=folder + "/simulations.log",
+                       PYTHONUNBUFFERED="1")
+    output = open(folder + "/" + node_id + ".out", "w")
+    process = subprocess.Popen([sys.executable, ROOT_FOLDER + "/run_simulations.py", "--dataset", folder + "/dataset",
+                                "--executable-folder", folder + "/executable", "--blender", sys.executable,
+                                "--output-folder", folder + "/campaign", "--shared", "--node-id", node_id,
+                                "--heartbeat-interval", "0.5", "--stale-after", "3", "--progress-interval", "0.2"],
+                               cwd=ROOT_FOLDER, env=environment, stdout=output, stderr=subprocess.STDOUT,
+                               start_new_session=True)
+    return process, output
+
+
+def read_lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return f.read().splitlines()
+
+
+def wait_until_simulating(folder, node_id, timeout=60.0):
+    # Wait until the node started a simulation, i.e. its last output line announces a run
+    start = time.time()
+    while time.time() - start < timeout:
+        lines = read_lines(folder + "/" + node_id + ".out")
+        if len(lines) > 0 and lines[-1].startswith("========= Running Configuration:"):
+            return lines[-1].split()[3]
+        time.sleep(0.02)
+    raise TimeoutError("Node " + node_id + " did not start a simulation")
+
+
+def test_killed_node_runs_are_finished_by_the_others(tmp_path):
+    folder = str(tmp_path)
+    create_campaign_inputs(folder)
+
+    nodes = [start_node(folder, "node" + str(i)) for i in range(NUMBER_OF_NODES)]
+
+    # Kill the first node (and its simulation) in the middle of a run, so its claim goes stale
+    abandoned_run = wait_until_simulating(folder, "node0")
+    time.sleep(0.2)
+    os.killpg(nodes[0][0].pid, signal.SIGKILL)
+    nodes[0][0].wait()
+
+    for process, output in nodes[1:]:
+        assert process.wait(timeout=300) == 0
+    for process, output in nodes:
+        output.close()
+
+    with open(folder + "/campaign/campaign_manifest.json", "r") as f:
+        runs = json.load(f)["runs"]
+    assert len(runs) == len(MODELS) * 18
+    assert all(entry["status"] == "done" for entry in runs.values())
+    assert runs[abandoned_run]["attempts"] >= 2
+
+    # Every run was completed by exactly one node and its results were harvested
+    finished = {}
+    for i in range(NUMBER_OF_NODES):
+        for line in read_lines(folder + "/node" + str(i) + ".out"):
+            if line.startswith("Finished") and line.split()[4] == "'done'":
+                finished[line.split()[1]] = finished.get(line.split()[1], 0) + 1
+    assert finished == {run_name: 1 for run_name in runs}
+    for run_name in runs:
+        assert os.path.exists(folder + "/campaign/000_Results/Metrics/" + run_name + ".txt")